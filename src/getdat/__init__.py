@@ -0,0 +1,4 @@
+from .utils import AnnasArchive
+from .exceptions import GetdatError, DownloadError
+
+__all__ = ["AnnasArchive", "GetdatError", "DownloadError"]
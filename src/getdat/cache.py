@@ -0,0 +1,166 @@
+import os
+import sqlite3
+import threading
+import time
+from .config import load_config
+
+CACHE_DB_ENV = "GETDAT_CACHE_DB"
+DEFAULT_CACHE_DB = os.path.join("~", ".cache", "getdat", "cache.db")
+
+
+def cache_db_path() -> str:
+    return os.path.expanduser(os.environ.get(CACHE_DB_ENV) or DEFAULT_CACHE_DB)
+
+
+class _SQLiteCache:
+    """A table of the local SQLite cache whose rows expire after `ttl` seconds
+
+    Subclasses set _SCHEMA and the [cache] config key of their TTL.
+    """
+
+    DEFAULT_TTL = 0
+    _TTL_KEY = ""
+    _SCHEMA = ""
+
+    def __init__(self, path: str | None = None, ttl: float | None = None):
+        self.path = path or cache_db_path()
+        if ttl is None:
+            ttl = load_config("cache").get(self._TTL_KEY, self.DEFAULT_TTL)
+        self.ttl = ttl
+        self._lock = threading.Lock()
+        self._db = None
+
+    def _connect(self) -> sqlite3.Connection:
+        # opened on first use so commands that never use the cache skip it
+        if self._db is None:
+            if self.path != ":memory:":
+                os.makedirs(os.path.dirname(self.path) or ".", exist_ok=True)
+            self._db = sqlite3.connect(self.path, check_same_thread=False, timeout=30)
+            with self._db:
+                self._db.execute(self._SCHEMA)
+        return self._db
+
+    def close(self):
+        if self._db is not None:
+            self._db.close()
+            self._db = None
+
+
+class ResolutionCache(_SQLiteCache):
+    """Final download URLs of libgen mirrors, keyed by md5 and source
+
+    Resolving a libgen link takes two HTML round trips: the mirror's page
+    and then its `GET` anchor. The resolved URL is stored in a local
+    SQLite table for `ttl` seconds (`resolve_ttl` in the [cache] table of
+    the config file) so repeat downloads and retries go straight to the
+    file. Entries are not checked when stored. A download that fails from
+    a cached URL invalidates it and the link is resolved again.
+    """
+
+    DEFAULT_TTL = 6 * 60 * 60
+    _TTL_KEY = "resolve_ttl"
+
+    _SCHEMA = """
+        CREATE TABLE IF NOT EXISTS resolutions (
+            md5 TEXT NOT NULL,
+            source TEXT NOT NULL,
+            url TEXT NOT NULL,
+            expires REAL NOT NULL,
+            PRIMARY KEY (md5, source)
+        )
+    """
+
+    def get(self, md5: str, source: str) -> str | None:
+        with self._lock:
+            db = self._connect()
+            row = db.execute(
+                "SELECT url, expires FROM resolutions WHERE md5 = ? AND source = ?",
+                (md5, source),
+            ).fetchone()
+            if row is None:
+                return None
+            url, expires = row
+            if expires < time.time():
+                with db:
+                    db.execute(
+                        "DELETE FROM resolutions WHERE md5 = ? AND source = ?",
+                        (md5, source),
+                    )
+                return None
+            return url
+
+    def set(self, md5: str, source: str, url: str):
+        if self.ttl <= 0:
+            return
+        with self._lock:
+            db = self._connect()
+            with db:
+                db.execute(
+                    "INSERT OR REPLACE INTO resolutions (md5, source, url, expires) "
+                    "VALUES (?, ?, ?, ?)",
+                    (md5, source, url, time.time() + self.ttl),
+                )
+
+    def invalidate(self, md5: str, source: str):
+        with self._lock:
+            db = self._connect()
+            with db:
+                db.execute(
+                    "DELETE FROM resolutions WHERE md5 = ? AND source = ?",
+                    (md5, source),
+                )
+
+
+class MissCache(_SQLiteCache):
+    """URLs that recently had no results or failed to download, with why
+
+    Search pages without results and download URLs that answered with an
+    error or the wrong file are kept for `ttl` seconds (`miss_ttl` in the
+    [cache] table of the config file) so batch jobs do not ask the mirrors
+    again for answers already known. The TTL is short because mirrors add
+    files and dead links come back.
+    """
+
+    DEFAULT_TTL = 15 * 60
+    _TTL_KEY = "miss_ttl"
+
+    _SCHEMA = """
+        CREATE TABLE IF NOT EXISTS misses (
+            url TEXT PRIMARY KEY,
+            reason TEXT NOT NULL,
+            expires REAL NOT NULL
+        )
+    """
+
+    def get(self, url: str) -> str | None:
+        with self._lock:
+            db = self._connect()
+            row = db.execute(
+                "SELECT reason, expires FROM misses WHERE url = ?", (url,)
+            ).fetchone()
+            if row is None:
+                return None
+            reason, expires = row
+            if expires < time.time():
+                with db:
+                    db.execute("DELETE FROM misses WHERE url = ?", (url,))
+                return None
+            return reason
+
+    def set(self, url: str, reason: str):
+        if self.ttl <= 0:
+            return
+        with self._lock:
+            db = self._connect()
+            with db:
+                db.execute(
+                    "INSERT OR REPLACE INTO misses (url, reason, expires) "
+                    "VALUES (?, ?, ?)",
+                    (url, reason, time.time() + self.ttl),
+                )
+
+    def invalidate(self, url: str):
+        with self._lock:
+            db = self._connect()
+            with db:
+                db.execute("DELETE FROM misses WHERE url = ?", (url,))
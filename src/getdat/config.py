@@ -0,0 +1,29 @@
+import os
+import tomllib
+
+CONFIG_ENV = "GETDAT_CONFIG"
+DEFAULT_CONFIG_PATH = os.path.join("~", ".config", "getdat", "config.toml")
+
+
+def config_path() -> str:
+    """Path to getdat's config file. GETDAT_CONFIG overrides the default"""
+    return os.path.expanduser(os.environ.get(CONFIG_ENV) or DEFAULT_CONFIG_PATH)
+
+
+def load_config(section: str | None = None) -> dict:
+    """Load getdat's TOML config file
+
+    Returns an empty dict if the file does not exist. If `section` is given
+    only that table is returned, ex: load_config("ebook")
+
+        [ebook]
+        instances = ["http://localhost:8080", "gs", "org"]
+    """
+    try:
+        with open(config_path(), "rb") as f:
+            config = tomllib.load(f)
+    except FileNotFoundError:
+        return {}
+    if section:
+        return config.get(section, {})
+    return config
@@ -0,0 +1,438 @@
+import http.client
+import ipaddress
+import json
+import os
+import socket
+import socketserver
+import threading
+import time
+import uuid
+from concurrent.futures import ThreadPoolExecutor
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from urllib.parse import urlencode, urlparse, parse_qs
+
+DAEMON_ENV = "GETDAT_DAEMON"
+DEFAULT_SOCKET_PATH = os.path.join("~", ".cache", "getdat", "getdat.sock")
+DEFAULT_PORT = 8765
+
+
+def default_address() -> str:
+    """Address getdat serve listens on and the CLI looks for
+
+    GETDAT_DAEMON overrides it, ex: unix:/tmp/getdat.sock or
+    http://127.0.0.1:8765
+    """
+    address = os.environ.get(DAEMON_ENV)
+    if address:
+        return address
+    if hasattr(socket, "AF_UNIX"):
+        return f"unix:{os.path.expanduser(DEFAULT_SOCKET_PATH)}"
+    return f"http://127.0.0.1:{DEFAULT_PORT}"
+
+
+def _is_loopback(host: str | None) -> bool:
+    if host == "localhost":
+        return True
+    try:
+        return ipaddress.ip_address(host or "").is_loopback
+    except ValueError:
+        return False
+
+
+class TTLCache:
+    """A small thread-safe in-memory cache whose entries expire after `ttl` seconds"""
+
+    def __init__(self, ttl: float = 300, max_entries: int = 1024):
+        self.ttl = ttl
+        self.max_entries = max_entries
+        self._entries = {}
+        self._lock = threading.Lock()
+
+    def get(self, key):
+        with self._lock:
+            entry = self._entries.get(key)
+            if entry is None:
+                return None
+            expires, value = entry
+            if expires < time.monotonic():
+                del self._entries[key]
+                return None
+            return value
+
+    def set(self, key, value):
+        with self._lock:
+            if len(self._entries) >= self.max_entries:
+                # drop the entry closest to expiring
+                del self._entries[min(self._entries, key=lambda k: self._entries[k][0])]
+            self._entries[key] = (time.monotonic() + self.ttl, value)
+
+
+class GetdatDaemon:
+    """Long running getdat service exposing AnnasArchive over local HTTP
+
+    Keeps one requests Session, cached search, links and scrape results
+    and a pool of download workers alive between calls. Listens on a Unix
+    socket (unix:/path) or on localhost (http://127.0.0.1:port). There is no
+    authentication, so other addresses are refused, as is starting a second
+    daemon on the address of one that is running. Over HTTP, requests must
+    name the daemon's loopback address in their Host header, which keeps
+    out web pages using DNS rebinding, and jobs must be posted as JSON,
+    which browsers only send cross-origin after a CORS preflight that the
+    daemon never answers. Jobs only download into `download_dir`.
+
+    GET  /health                        status of the daemon
+    GET  /search?q=&ext=&lang=&content=&sort=&instance=
+    GET  /links?md5=&instance=
+    GET  /scrape?url=&key=&source=      fetch and parse one page
+    POST /jobs                          {"link", "dest", "title", "resource_name"}
+    GET  /jobs, /jobs/<id>              download job status
+    """
+
+    _SCRAPE_KEYS = ("search_page_scrape", "detail_page_scrape", "download_page_scrape")
+
+    def __init__(
+        self,
+        address: str | None = None,
+        workers: int = 4,
+        ttl: float = 300,
+        limit_rate: int | None = None,
+        resolve_cache=None,
+        miss_cache=None,
+        download_dir: str | None = None,
+    ):
+        import requests
+
+        self.address = address or default_address()
+        self.download_dir = os.path.realpath(
+            os.path.expanduser(download_dir or os.environ.get("GETDAT_BOOK_DIR") or ".")
+        )
+        self.limit_rate = limit_rate
+        self.resolve_cache = resolve_cache
+        self.miss_cache = miss_cache
+        self.session = requests.Session()
+        self.cache = TTLCache(ttl=ttl)
+        self.jobs = {}
+        self._jobs_lock = threading.Lock()
+        self._archives = {}
+        self._archives_lock = threading.Lock()
+        self._executor = ThreadPoolExecutor(max_workers=workers)
+        self._server = self._bind()
+
+    def _bind(self):
+        handler = self._handler_class()
+        parsed = urlparse(self.address)
+        if not self.address.startswith("unix:") and not _is_loopback(parsed.hostname):
+            raise DaemonError(
+                f"{self.address} is not a loopback address, getdat serve only "
+                "listens on localhost"
+            )
+        if DaemonClient.discover(self.address):
+            raise DaemonError(f"A getdat daemon is already running on {self.address}")
+        if self.address.startswith("unix:"):
+            path = self.address.removeprefix("unix:")
+            os.makedirs(os.path.dirname(path) or ".", exist_ok=True)
+            if os.path.exists(path):
+                # left behind by a daemon that did not shut down cleanly
+                os.unlink(path)
+
+            class UnixServer(socketserver.ThreadingUnixStreamServer):
+                daemon_threads = True
+
+            return UnixServer(path, handler)
+        server = ThreadingHTTPServer((parsed.hostname, parsed.port or 0), handler)
+        server.daemon_threads = True
+        if not parsed.port:
+            self.address = f"http://{parsed.hostname}:{server.server_address[1]}"
+        return server
+
+    def archive(self, instance=None):
+        """The AnnasArchive for `instance`, created once and kept warm"""
+        from .utils import AnnasArchive
+
+        key = tuple(instance or ())
+        with self._archives_lock:
+            if key not in self._archives:
+                self._archives[key] = AnnasArchive(
+                    instance=list(key) or None,
+                    session=self.session,
+                    limit_rate=self.limit_rate,
+                    resolve_cache=self.resolve_cache,
+                    miss_cache=self.miss_cache,
+                )
+            return self._archives[key]
+
+    def _cached(self, key, func):
+        value = self.cache.get(key)
+        if value is None:
+            value = func()
+            self.cache.set(key, value)
+        return value
+
+    def search(self, q: str, instance=None, **filters) -> list:
+        archive = self.archive(instance)
+        params = {
+            name: filters.get(name) for name in ("ext", "lang", "content", "sort")
+        }
+        # spellings of the same search share one entry
+        key = (
+            "search",
+            archive._search_query(q, params),
+            tuple(instance or ()),
+            filters.get("pages"),
+            filters.get("limit"),
+        )
+        return self._cached(key, lambda: archive.search(q, **filters))
+
+    def links(self, md5: str, instance=None) -> list:
+        key = ("links", md5, tuple(instance or ()))
+        return self._cached(key, lambda: self.archive(instance).links(md5))
+
+    def scrape(self, url: str, key: str, source: str) -> dict:
+        def fetch():
+            return self.archive()._fetch_scrape(url, key, source)
+
+        return self._cached(("scrape", url, key, source), fetch)
+
+    def submit(self, link: str, dest: str, title: str = "", resource_name: str = ""):
+        path = os.path.realpath(os.path.expanduser(dest))
+        if os.path.commonpath([path, self.download_dir]) != self.download_dir:
+            raise DaemonError(f"{dest} is outside of {self.download_dir}")
+        job = {
+            "id": uuid.uuid4().hex,
+            "status": "pending",
+            "link": link,
+            "dest": dest,
+            "title": title,
+            "path": None,
+            "error": None,
+        }
+        with self._jobs_lock:
+            self.jobs[job["id"]] = job
+        self._executor.submit(self._run_job, job, resource_name)
+        return dict(job)
+
+    def _run_job(self, job: dict, resource_name: str):
+        from .exceptions import GetdatError
+
+        job["status"] = "running"
+        try:
+            job["path"] = self.archive().fetch(
+                job["link"], job["dest"], job["title"], resource_name
+            )
+        except (GetdatError, OSError) as e:
+            job["status"], job["error"] = "failed", str(e)
+        else:
+            job["status"] = "done"
+
+    def job(self, job_id: str) -> dict | None:
+        with self._jobs_lock:
+            job = self.jobs.get(job_id)
+            return dict(job) if job else None
+
+    def serve_forever(self):
+        try:
+            self._server.serve_forever()
+        finally:
+            self.close()
+
+    def shutdown(self):
+        self._server.shutdown()
+
+    def close(self):
+        self._server.server_close()
+        self._executor.shutdown(wait=False, cancel_futures=True)
+        self.session.close()
+        if self.address.startswith("unix:"):
+            path = self.address.removeprefix("unix:")
+            if os.path.exists(path):
+                os.unlink(path)
+
+    def _handler_class(self):
+        daemon = self
+
+        class Handler(BaseHTTPRequestHandler):
+            protocol_version = "HTTP/1.1"
+
+            def log_message(self, format, *args):
+                pass
+
+            def _is_local(self) -> bool:
+                """Whether the Host header names this daemon's loopback address"""
+                if daemon.address.startswith("unix:"):
+                    return True
+                host = urlparse(f"//{self.headers.get('Host') or ''}")
+                try:
+                    port = host.port
+                except ValueError:
+                    return False
+                bound = urlparse(daemon.address).port
+                return _is_loopback(host.hostname) and port == bound
+
+            def do_GET(self):
+                from requests.exceptions import RequestException
+
+                if not self._is_local():
+                    return self._send({"error": "Forbidden"}, status=403)
+                parsed = urlparse(self.path)
+                params = {k: v[-1] for k, v in parse_qs(parsed.query).items()}
+                instance = parse_qs(parsed.query).get("instance")
+                try:
+                    match parsed.path.rstrip("/").split("/"):
+                        case ["", "health"]:
+                            return self._send({"status": "ok", "pid": os.getpid()})
+                        case ["", "search"] if params.get("q"):
+                            filters = {
+                                k: params.get(k)
+                                for k in ("ext", "lang", "content", "sort")
+                            }
+                            results = daemon.search(
+                                params["q"], instance=instance, **filters
+                            )
+                            return self._send({"results": results})
+                        case ["", "links"] if params.get("md5"):
+                            links = daemon.links(params["md5"], instance=instance)
+                            return self._send({"links": links})
+                        case ["", "scrape"] if (
+                            params.get("url")
+                            and params.get("key") in daemon._SCRAPE_KEYS
+                        ):
+                            results = daemon.scrape(
+                                params["url"], params["key"], params.get("source")
+                            )
+                            return self._send({"results": results})
+                        case ["", "jobs"]:
+                            with daemon._jobs_lock:
+                                jobs = [dict(job) for job in daemon.jobs.values()]
+                            return self._send({"jobs": jobs})
+                        case ["", "jobs", job_id]:
+                            job = daemon.job(job_id)
+                            if job:
+                                return self._send(job)
+                            return self._send({"error": "Job not found"}, status=404)
+                        case _:
+                            return self._send({"error": "Not found"}, status=404)
+                except RequestException as e:
+                    return self._send({"error": str(e)}, status=502)
+                except (AttributeError, KeyError, TypeError) as e:
+                    return self._send({"error": f"Could not scrape: {e}"}, status=502)
+
+            def do_POST(self):
+                if not self._is_local():
+                    return self._send({"error": "Forbidden"}, status=403)
+                if urlparse(self.path).path.rstrip("/") != "/jobs":
+                    return self._send({"error": "Not found"}, status=404)
+                length = int(self.headers.get("Content-Length") or 0)
+                body = self.rfile.read(length)
+                if self.headers.get_content_type() != "application/json":
+                    return self._send(
+                        {"error": "Content-Type must be application/json"}, status=415
+                    )
+                try:
+                    body = json.loads(body or b"{}")
+                    link, dest = body["link"], body["dest"]
+                except (ValueError, KeyError, TypeError):
+                    return self._send({"error": "link and dest required"}, status=400)
+                try:
+                    job = daemon.submit(
+                        link, dest, body.get("title", ""), body.get("resource_name", "")
+                    )
+                except DaemonError as e:
+                    return self._send({"error": str(e)}, status=403)
+                return self._send(job, status=202)
+
+            def _send(self, data, status: int = 200):
+                body = json.dumps(data).encode("utf-8")
+                self.send_response(status)
+                self.send_header("Content-Type", "application/json")
+                self.send_header("Content-Length", str(len(body)))
+                self.end_headers()
+                self.wfile.write(body)
+
+        return Handler
+
+
+class UnixHTTPConnection(http.client.HTTPConnection):
+    def __init__(self, path: str, timeout: float | None = None):
+        super().__init__("localhost", timeout=timeout)
+        self.path = path
+
+    def connect(self):
+        self.sock = socket.socket(socket.AF_UNIX, socket.SOCK_STREAM)
+        self.sock.settimeout(self.timeout)
+        self.sock.connect(self.path)
+
+
+class DaemonError(Exception):
+    """The daemon could not be reached or could not answer a request"""
+
+
+class DaemonClient:
+    """Thin client for a running `getdat serve`
+
+    Uses only the standard library, so it can be used from programs that
+    do not depend on requests or BeautifulSoup.
+    """
+
+    def __init__(self, address: str | None = None, timeout: float = 60):
+        self.address = address or default_address()
+        self.timeout = timeout
+
+    @classmethod
+    def discover(cls, address: str | None = None):
+        """A client for the running daemon, or None if there is none"""
+        client = cls(address)
+        try:
+            client._call("GET", "/health", timeout=0.5)
+        except DaemonError:
+            return None
+        return client
+
+    def _connection(self, timeout: float):
+        if self.address.startswith("unix:"):
+            return UnixHTTPConnection(self.address.removeprefix("unix:"), timeout)
+        parsed = urlparse(self.address)
+        return http.client.HTTPConnection(parsed.hostname, parsed.port, timeout=timeout)
+
+    def _call(self, method: str, path: str, body=None, timeout: float | None = None):
+        connection = self._connection(timeout or self.timeout)
+        try:
+            headers = {"Content-Type": "application/json"} if body else {}
+            connection.request(
+                method, path, body=json.dumps(body) if body else None, headers=headers
+            )
+            response = connection.getresponse()
+            data = json.loads(response.read() or b"{}")
+        except (OSError, http.client.HTTPException, ValueError) as e:
+            raise DaemonError(f"getdat daemon unavailable at {self.address}: {e}")
+        finally:
+            connection.close()
+        if response.status >= 400:
+            raise DaemonError(data.get("error", f"HTTP {response.status}"))
+        return data
+
+    def search(self, q: str, instance=None, **filters) -> list:
+        params = [("q", q)]
+        params += [(k, v) for k, v in filters.items() if v]
+        params += [("instance", i) for i in instance or ()]
+        return self._call("GET", f"/search?{urlencode(params)}")["results"]
+
+    def links(self, md5: str, instance=None) -> list:
+        params = [("md5", md5)] + [("instance", i) for i in instance or ()]
+        return self._call("GET", f"/links?{urlencode(params)}")["links"]
+
+    def scrape(self, url: str, key: str, source: str) -> dict:
+        params = urlencode({"url": url, "key": key, "source": source})
+        return self._call("GET", f"/scrape?{params}")["results"]
+
+    def submit(self, link: str, dest: str, title: str = "", resource_name: str = ""):
+        body = {
+            "link": link,
+            # the daemon may run in another working directory
+            "dest": os.path.abspath(os.path.expanduser(dest)),
+            "title": title,
+            "resource_name": resource_name,
+        }
+        return self._call("POST", "/jobs", body=body)
+
+    def job(self, job_id: str) -> dict:
+        return self._call("GET", f"/jobs/{job_id}")
@@ -0,0 +1,6 @@
+class GetdatError(Exception):
+    """Base class for errors raised by getdat's library API"""
+
+
+class DownloadError(GetdatError):
+    """A download link did not lead to a file"""
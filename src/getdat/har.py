@@ -0,0 +1,305 @@
+import base64
+import io
+import json
+import threading
+import time
+from collections import deque
+from datetime import datetime, timedelta, timezone
+import requests
+from requests.adapters import BaseAdapter, HTTPAdapter
+from requests.exceptions import ConnectionError
+from requests.models import Response
+from requests.structures import CaseInsensitiveDict
+from requests.utils import get_encoding_from_headers
+
+HAR_VERSION = "1.2"
+
+
+def _header_list(headers) -> list:
+    return [{"name": name, "value": value} for name, value in headers.items()]
+
+
+# media types whose bodies are pages, captured whatever their size
+_TEXT_TYPES = ("text/", "application/json", "application/xml", "application/xhtml")
+
+
+def _har_content(
+    content: bytes, mime_type: str, size: int | None = None, truncated: bool = False
+) -> dict:
+    """HAR content of a body, as text when it is UTF-8 and base64 otherwise
+
+    `size` is the size of the whole body when only the first bytes of it,
+    `content`, were kept. Such a body is marked `_truncated`.
+    """
+    har = {"size": len(content) if size is None else size, "mimeType": mime_type}
+    if truncated:
+        har["_truncated"] = True
+    try:
+        har["text"] = content.decode("utf-8")
+    except UnicodeDecodeError:
+        har["text"] = base64.b64encode(content).decode("ascii")
+        har["encoding"] = "base64"
+    return har
+
+
+def _body(har: dict) -> bytes:
+    text = har.get("text", "")
+    if har.get("encoding") == "base64":
+        return base64.b64decode(text)
+    return text.encode("utf-8")
+
+
+class _CapturedBody:
+    """A response's raw stream that keeps a copy of the bytes read from it
+
+    The body is captured as the caller reads it, so a streamed download is
+    recorded as far as it was actually downloaded. At most `limit` bytes
+    are kept, None for all of them. `on_done(body)` is called once, when
+    the body has been read or the response is closed.
+    """
+
+    def __init__(self, raw, limit: int | None, on_done):
+        self._raw = raw
+        self._limit = limit
+        self._on_done = on_done
+        self._chunks = []
+        self._kept = 0
+        self._done = False
+        self.size = 0
+        self.truncated = False
+        self.started = time.perf_counter()
+
+    def __getattr__(self, name):
+        return getattr(self._raw, name)
+
+    @property
+    def content(self) -> bytes:
+        return b"".join(self._chunks)
+
+    def _keep(self, chunk: bytes):
+        self.size += len(chunk)
+        if self._limit is not None and self._kept + len(chunk) > self._limit:
+            chunk = chunk[: self._limit - self._kept]
+            self.truncated = True
+        self._chunks.append(chunk)
+        self._kept += len(chunk)
+
+    def stream(self, *args, **kwargs):
+        for chunk in self._raw.stream(*args, **kwargs):
+            self._keep(chunk)
+            yield chunk
+        self.finish()
+
+    def read(self, *args, **kwargs):
+        chunk = self._raw.read(*args, **kwargs)
+        self._keep(chunk or b"")
+        return chunk
+
+    def close(self):
+        self.finish()
+        self._raw.close()
+
+    def finish(self):
+        if not self._done:
+            self._done = True
+            self._on_done(self)
+
+
+class _RecordingAdapter(HTTPAdapter):
+    def __init__(self, recorder: "HarRecorder", **kwargs):
+        super().__init__(**kwargs)
+        self._recorder = recorder
+
+    def send(self, request, **kwargs):
+        started = datetime.now(timezone.utc)
+        response = super().send(request, **kwargs)
+        content_type = response.headers.get("Content-Type", "")
+        limit = (
+            None if content_type.startswith(_TEXT_TYPES) else self._recorder.max_body
+        )
+
+        def on_done(body: _CapturedBody):
+            receive = time.perf_counter() - body.started
+            self._recorder.add(request, response, started, receive, body)
+
+        response.raw = self._recorder.capture(response.raw, limit, on_done)
+        return response
+
+
+class HarRecorder:
+    """Captures every request of a Session into a HAR 1.2 file
+
+    Response bodies are copied as the caller reads them, so streamed
+    downloads are sniffed, throttled and aborted as they would be without
+    the recorder. Pages are kept whole. Of other bodies, such as the
+    files downloaded, only the first `max_body` bytes are kept, and the
+    rest is marked truncated. Entries stay in memory until save. Timings
+    are the wait for the response headers and the time spent reading the
+    body, in milliseconds.
+
+        recorder = HarRecorder("session.har")
+        archive = AnnasArchive(session=recorder.session())
+        ...
+        recorder.save()
+    """
+
+    MAX_BODY = 1024 * 1024
+
+    def __init__(self, path: str, max_body: int | None = MAX_BODY):
+        self.path = path
+        self.max_body = max_body
+        self.entries = []
+        self._open = set()
+        self._lock = threading.Lock()
+
+    def capture(self, raw, limit: int | None, on_done) -> _CapturedBody:
+        """Wrap `raw` so its body is recorded, see _CapturedBody"""
+
+        def done(body: _CapturedBody):
+            with self._lock:
+                self._open.discard(body)
+            on_done(body)
+
+        body = _CapturedBody(raw, limit, done)
+        with self._lock:
+            self._open.add(body)
+        return body
+
+    def session(self, session: requests.Session | None = None) -> requests.Session:
+        session = session or requests.Session()
+        adapter = _RecordingAdapter(self)
+        session.mount("http://", adapter)
+        session.mount("https://", adapter)
+        return session
+
+    def add(
+        self,
+        request,
+        response: Response,
+        started: datetime,
+        receive: float,
+        body: _CapturedBody,
+    ):
+        wait = response.elapsed.total_seconds() * 1000
+        receive *= 1000
+        entry = {
+            "startedDateTime": started.isoformat(),
+            "time": wait + receive,
+            "request": {
+                "method": request.method,
+                "url": request.url,
+                "httpVersion": "HTTP/1.1",
+                "headers": _header_list(request.headers),
+                "queryString": [],
+                "cookies": [],
+                "headersSize": -1,
+                "bodySize": -1,
+            },
+            "response": {
+                "status": response.status_code,
+                "statusText": response.reason or "",
+                "httpVersion": "HTTP/1.1",
+                "headers": _header_list(response.headers),
+                "cookies": [],
+                "content": _har_content(
+                    body.content,
+                    response.headers.get("Content-Type", ""),
+                    body.size,
+                    body.truncated,
+                ),
+                "redirectURL": response.headers.get("Location", ""),
+                "headersSize": -1,
+                "bodySize": body.size,
+            },
+            "cache": {},
+            "timings": {"send": 0, "wait": wait, "receive": receive},
+        }
+        with self._lock:
+            self.entries.append(entry)
+
+    def har(self) -> dict:
+        with self._lock:
+            unfinished = list(self._open)
+        # bodies that were never read to the end or closed, as far as they got
+        for body in unfinished:
+            body.finish()
+        with self._lock:
+            entries = sorted(self.entries, key=lambda entry: entry["startedDateTime"])
+        return {
+            "log": {
+                "version": HAR_VERSION,
+                "creator": {"name": "getdat", "version": ""},
+                "entries": entries,
+            }
+        }
+
+    def save(self):
+        with open(self.path, "w") as f:
+            json.dump(self.har(), f)
+
+
+class _ReplayAdapter(BaseAdapter):
+    def __init__(self, replayer: "HarReplayer"):
+        super().__init__()
+        self._replayer = replayer
+
+    def send(self, request, **kwargs):
+        return self._replayer.response(request)
+
+    def close(self):
+        pass
+
+
+class HarReplayer:
+    """Answers the requests of a Session from a HAR file, with no network
+
+    Responses are matched by method and URL. A URL requested several
+    times gets its recorded responses in order and then the last one
+    again. A request that was not recorded raises ConnectionError, like
+    an unreachable host would.
+    """
+
+    def __init__(self, har: dict):
+        self._entries = {}
+        for entry in har["log"]["entries"]:
+            key = (entry["request"]["method"], entry["request"]["url"])
+            self._entries.setdefault(key, deque()).append(entry)
+        self._lock = threading.Lock()
+
+    @classmethod
+    def load(cls, path: str) -> "HarReplayer":
+        with open(path) as f:
+            return cls(json.load(f))
+
+    def session(self, session: requests.Session | None = None) -> requests.Session:
+        session = session or requests.Session()
+        adapter = _ReplayAdapter(self)
+        session.mount("http://", adapter)
+        session.mount("https://", adapter)
+        return session
+
+    def response(self, request) -> Response:
+        with self._lock:
+            entries = self._entries.get((request.method, request.url))
+            if not entries:
+                raise ConnectionError(
+                    f"No recorded response for {request.method} {request.url}",
+                    request=request,
+                )
+            entry = entries.popleft() if len(entries) > 1 else entries[0]
+        recorded = entry["response"]
+        content = _body(recorded["content"])
+        response = Response()
+        response.status_code = recorded["status"]
+        response.reason = recorded["statusText"]
+        response.headers = CaseInsensitiveDict(
+            (header["name"], header["value"]) for header in recorded["headers"]
+        )
+        response.encoding = get_encoding_from_headers(response.headers)
+        response.url = request.url
+        response.request = request
+        response.elapsed = timedelta(milliseconds=entry["timings"]["wait"])
+        response.raw = io.BytesIO(content)
+        response._content = content
+        response._content_consumed = True
+        return response
@@ -0,0 +1,276 @@
+import os
+import sqlite3
+import threading
+import time
+import uuid
+from urllib.parse import urlparse
+from requests.exceptions import RequestException
+from .exceptions import GetdatError, DownloadError
+
+QUEUE_DB_ENV = "GETDAT_QUEUE_DB"
+DEFAULT_QUEUE_DB = os.path.join("~", ".cache", "getdat", "queue.db")
+
+PENDING = "pending"
+RUNNING = "running"
+DONE = "done"
+FAILED = "failed"
+STATUSES = (PENDING, RUNNING, DONE, FAILED)
+
+
+def queue_db_path() -> str:
+    return os.path.expanduser(os.environ.get(QUEUE_DB_ENV) or DEFAULT_QUEUE_DB)
+
+
+class JobQueue:
+    """Persistent download queue stored in a local SQLite table
+
+    Jobs are an Anna's Archive md5 or a download link plus the directory
+    they are saved to. `run` works through pending jobs with a bounded
+    pool of worker threads and a cap on concurrent downloads per host.
+    A job's file path is recorded before its download starts, so after a
+    crash the job goes back to pending and resumes from its `.part` file.
+
+    A running job is leased to the run that claimed it for _LEASE_SECONDS
+    and the lease is renewed while that run is alive. Only jobs whose
+    lease has run out are taken back, so runs started side by side share
+    the queue instead of downloading the same file twice.
+    """
+
+    _LEASE_SECONDS = 60
+
+    _SCHEMA = """
+        CREATE TABLE IF NOT EXISTS jobs (
+            id INTEGER PRIMARY KEY AUTOINCREMENT,
+            md5 TEXT,
+            link TEXT,
+            title TEXT NOT NULL DEFAULT '',
+            resource_name TEXT NOT NULL DEFAULT '',
+            dest TEXT NOT NULL,
+            status TEXT NOT NULL DEFAULT 'pending',
+            attempts INTEGER NOT NULL DEFAULT 0,
+            path TEXT,
+            error TEXT,
+            created REAL NOT NULL,
+            updated REAL NOT NULL,
+            owner TEXT,
+            lease REAL
+        )
+    """
+    # columns added since the first release, for databases created before
+    _COLUMNS = {"owner": "TEXT", "lease": "REAL"}
+
+    def __init__(self, path: str | None = None):
+        self.path = path or queue_db_path()
+        if self.path != ":memory:":
+            os.makedirs(os.path.dirname(self.path) or ".", exist_ok=True)
+        self._lock = threading.Lock()
+        self._db = sqlite3.connect(self.path, check_same_thread=False, timeout=30)
+        self._db.row_factory = sqlite3.Row
+        with self._db:
+            self._db.execute(self._SCHEMA)
+            columns = {
+                row["name"] for row in self._db.execute("PRAGMA table_info(jobs)")
+            }
+            for column, kind in self._COLUMNS.items():
+                if column not in columns:
+                    self._db.execute(f"ALTER TABLE jobs ADD COLUMN {column} {kind}")
+
+    def close(self):
+        self._db.close()
+
+    def _execute(self, sql: str, params=()) -> list:
+        with self._lock, self._db:
+            return [dict(row) for row in self._db.execute(sql, params)]
+
+    def add(
+        self,
+        dest: str,
+        md5: str | None = None,
+        link: str | None = None,
+        title: str = "",
+        resource_name: str = "",
+    ) -> int:
+        """Queue an md5 or a download link and return the job id"""
+        if not (md5 or link):
+            raise ValueError("A job needs an md5 or a link")
+        now = time.time()
+        with self._lock, self._db:
+            cursor = self._db.execute(
+                "INSERT INTO jobs (md5, link, title, resource_name, dest, created, updated) "
+                "VALUES (?, ?, ?, ?, ?, ?, ?)",
+                (md5, link, title, resource_name, dest, now, now),
+            )
+            return cursor.lastrowid
+
+    def get(self, job_id: int) -> dict | None:
+        rows = self._execute("SELECT * FROM jobs WHERE id = ?", (job_id,))
+        return rows[0] if rows else None
+
+    def jobs(self, status: str | None = None) -> list:
+        if status:
+            return self._execute(
+                "SELECT * FROM jobs WHERE status = ? ORDER BY id", (status,)
+            )
+        return self._execute("SELECT * FROM jobs ORDER BY id")
+
+    def counts(self) -> dict:
+        counts = {status: 0 for status in STATUSES}
+        rows = self._execute("SELECT status, COUNT(*) AS n FROM jobs GROUP BY status")
+        counts.update({row["status"]: row["n"] for row in rows})
+        return counts
+
+    def recover(self) -> int:
+        """Return jobs left running by a crashed or killed run to pending
+
+        Jobs whose lease is still being renewed belong to a live run and
+        are left alone.
+        """
+        now = time.time()
+        with self._lock, self._db:
+            cursor = self._db.execute(
+                "UPDATE jobs SET status = ?, owner = NULL, lease = NULL, updated = ? "
+                "WHERE status = ? AND (lease IS NULL OR lease < ?)",
+                (PENDING, now, RUNNING, now),
+            )
+            return cursor.rowcount
+
+    def claim(self, owner: str | None = None) -> dict | None:
+        """Mark the oldest pending job as running, leased to `owner`, and return it"""
+        while True:
+            with self._lock, self._db:
+                row = self._db.execute(
+                    "SELECT * FROM jobs WHERE status = ? ORDER BY id LIMIT 1",
+                    (PENDING,),
+                ).fetchone()
+                if row is None:
+                    return None
+                now = time.time()
+                lease = now + self._LEASE_SECONDS
+                cursor = self._db.execute(
+                    "UPDATE jobs SET status = ?, attempts = attempts + 1, owner = ?, "
+                    "lease = ?, updated = ? WHERE id = ? AND status = ?",
+                    (RUNNING, owner, lease, now, row["id"], PENDING),
+                )
+                # another process claimed it between the select and the update
+                if cursor.rowcount:
+                    return {
+                        **dict(row),
+                        "status": RUNNING,
+                        "attempts": row["attempts"] + 1,
+                        "owner": owner,
+                        "lease": lease,
+                    }
+
+    def renew(self, owner: str) -> int:
+        """Extend the lease on the jobs `owner` is running"""
+        with self._lock, self._db:
+            cursor = self._db.execute(
+                "UPDATE jobs SET lease = ? WHERE owner = ? AND status = ?",
+                (time.time() + self._LEASE_SECONDS, owner, RUNNING),
+            )
+            return cursor.rowcount
+
+    def _update(self, job_id: int, **fields):
+        columns = ", ".join(f"{column} = ?" for column in fields)
+        self._execute(
+            f"UPDATE jobs SET {columns}, updated = ? WHERE id = ?",
+            (*fields.values(), time.time(), job_id),
+        )
+
+    def set_path(self, job_id: int, path: str):
+        self._update(job_id, path=path)
+
+    def finish(self, job_id: int, path: str):
+        self._update(job_id, status=DONE, path=path, error=None)
+
+    def fail(self, job_id: int, error: str, retry: bool = False):
+        self._update(job_id, status=PENDING if retry else FAILED, error=error)
+
+    def run(
+        self,
+        archive,
+        workers: int = 4,
+        per_host: int = 2,
+        max_attempts: int = 3,
+        on_update=None,
+        fastest: bool = False,
+    ) -> dict:
+        """Process pending jobs until none are left and return the counts
+
+        `archive` is an AnnasArchive. At most `workers` jobs run at once
+        and at most `per_host` of them download from the same host.
+        `on_update(job)` is called from worker threads as jobs finish.
+        With `fastest` the direct links of an md5 are probed concurrently
+        and tried fastest first, see AnnasArchive.rank.
+        """
+        self.recover()
+        owner = uuid.uuid4().hex
+        stopped = threading.Event()
+
+        def heartbeat():
+            while not stopped.wait(self._LEASE_SECONDS / 3):
+                self.renew(owner)
+
+        host_slots = {}
+        host_slots_lock = threading.Lock()
+
+        def host_slot(url: str) -> threading.BoundedSemaphore:
+            host = urlparse(url).hostname or ""
+            with host_slots_lock:
+                if host not in host_slots:
+                    host_slots[host] = threading.BoundedSemaphore(per_host)
+                return host_slots[host]
+
+        def worker():
+            while job := self.claim(owner):
+                try:
+                    path = self._process(archive, job, host_slot, fastest)
+                except (GetdatError, RequestException, OSError) as e:
+                    retry = job["attempts"] < max_attempts
+                    self.fail(job["id"], str(e), retry=retry)
+                else:
+                    self.finish(job["id"], path)
+                if on_update:
+                    on_update(self.get(job["id"]))
+
+        renewer = threading.Thread(target=heartbeat, daemon=True)
+        renewer.start()
+        threads = [threading.Thread(target=worker) for _ in range(max(workers, 1))]
+        for thread in threads:
+            thread.start()
+        for thread in threads:
+            thread.join()
+        stopped.set()
+        renewer.join()
+        return self.counts()
+
+    def _candidates(self, archive, job: dict, fastest: bool = False) -> list:
+        if job["link"]:
+            return [{"link": job["link"], "title": job["title"]}]
+        links = [link for link in archive.links(job["md5"]) if link["direct"]]
+        if fastest:
+            # failed probes stay last in case they only failed for now
+            links = archive.rank(links, job["resource_name"])
+        return links
+
+    def _process(self, archive, job: dict, host_slot, fastest: bool = False) -> str:
+        errors = []
+        for candidate in self._candidates(archive, job, fastest):
+            try:
+                url = candidate.get("url") or archive.resolve(
+                    candidate["link"], candidate["title"]
+                )
+                path = job["path"]
+                if not path:
+                    name = job["md5"] if job["md5"] and not job["resource_name"] else ""
+                    path = os.path.join(
+                        os.path.expanduser(job["dest"]),
+                        name or archive._filename(job["resource_name"], url),
+                    )
+                    self.set_path(job["id"], path)
+                    job["path"] = path
+                with host_slot(url):
+                    return archive.fetch(url, path)
+            except (DownloadError, RequestException) as e:
+                errors.append(f"{candidate['title'] or candidate['link']}: {e}")
+        raise DownloadError("; ".join(errors) or "No direct download links found")
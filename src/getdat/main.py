@@ -1,14 +1,133 @@
 import click
-from .utils import AnnasEbook, print_help
+import contextlib
+import os
+import re
+import sys
+from .cache import MissCache, ResolutionCache
+from .daemon import DaemonClient, default_address
+from .progress import PROGRESS_MODES, progress_reporter
+from .utils import AnnasEbook, print_help, parse_size
 from .constants import EBOOK_ERROR_MSG, MOVIE_WEB, TOTALSPORTK, BRAINTRUST
 
 
+class InstanceType(click.ParamType):
+    """An Anna's Archive instance key or the base URL of a mirror"""
+
+    name = "instance"
+
+    def convert(self, value, param, ctx):
+        if value in AnnasEbook._ANNAS_URLS.keys() or AnnasEbook._is_url(value):
+            return value
+        self.fail(
+            f"{value!r} is not one of {', '.join(AnnasEbook._ANNAS_URLS.keys())} "
+            "or an http(s):// URL.",
+            param,
+            ctx,
+        )
+
+
+def size_option(ctx, param, value):
+    if value is None:
+        return value
+    try:
+        return parse_size(value)
+    except ValueError as e:
+        raise click.BadParameter(str(e))
+
+
+limit_rate_option = click.option(
+    "--limit-rate",
+    callback=size_option,
+    help="Maximum download speed in bytes per second. Example: 500K, 1M",
+)
+progress_option = click.option(
+    "--progress",
+    type=click.Choice(PROGRESS_MODES),
+    default="auto",
+    show_default=True,
+    help=(
+        "How download progress is shown on stderr: bar for a status line "
+        "with bytes, speed now and on average, ETA and host, log for one "
+        "JSON object per line, or off. auto shows the bar on a terminal."
+    ),
+)
+total_rate_option = click.option(
+    "--total-rate",
+    callback=size_option,
+    help=(
+        "Bandwidth budget in bytes per second shared by all concurrent "
+        "downloads. Example: 2M"
+    ),
+)
+
+
+class CliGroup(click.Group):
+    """The getdat group, where a bare --profile takes the default path
+
+    Click would read the command after `--profile` as its value, so
+    `getdat --profile ebook ...` is read as `--profile=getdat.prof`. A
+    value that is not a command, `getdat --profile out.prof ebook ...`,
+    is left for click to parse.
+    """
+
+    def parse_args(self, ctx, args):
+        from .profiling import DEFAULT_PROFILE
+
+        for idx, arg in enumerate(args):
+            if not arg.startswith("-"):
+                break
+            if arg == "--profile":
+                if args[idx + 1 : idx + 2] and args[idx + 1] in self.commands:
+                    args = [
+                        *args[:idx],
+                        f"--profile={DEFAULT_PROFILE}",
+                        *args[idx + 1 :],
+                    ]
+                break
+        return super().parse_args(ctx, args)
+
+
+def md5_stream(items):
+    """Lowercased md5s of `items`, where - reads md5s from stdin as they come"""
+    for item in items:
+        for md5 in (line.strip() for line in sys.stdin) if item == "-" else [item]:
+            if not md5:
+                continue
+            if re.fullmatch(r"[0-9a-fA-F]{32}", md5):
+                yield md5.lower()
+            else:
+                click.echo(click.style(f"Skipping {md5}: not an md5", fg="red"))
+
+
 @click.group(
-    epilog="Check out our docs at https://getdat.chrisdixononcode.dev for help and contributing."
+    cls=CliGroup,
+    epilog="Check out our docs at https://getdat.chrisdixononcode.dev for help and contributing.",
+)
+@click.option(
+    "--profile",
+    metavar="[=PATH]",
+    type=click.Path(dir_okay=False, writable=True),
+    help=(
+        "Profile the command and write the profile to PATH, getdat.prof by "
+        "default. Paths ending in .folded or .collapsed get collapsed stacks "
+        "of every thread from a sampling profiler, others cProfile's pstats."
+    ),
 )
-def cli():
+@click.pass_context
+def cli(ctx, profile):
     """A command line utility for getting resources available online"""
-    pass
+    if profile:
+        from .profiling import profiler
+
+        prof = profiler(profile)
+
+        def write_profile():
+            prof.disable()
+            prof.dump_stats(profile)
+            click.echo(f"Profile written to {profile}", err=True)
+
+        prof.enable()
+        ctx.call_on_close(write_profile)
 
 
 @cli.command()
@@ -86,23 +205,155 @@ def cinema():
 @click.option(
     "-i",
     "--instance",
-    type=click.Choice(AnnasEbook._ANNAS_URLS.keys()),
-    default=AnnasEbook._ANNAS_ORG_URL,
+    type=InstanceType(),
+    multiple=True,
     help=(
         "The instance of Anna's Archive you would like to "
         "use for your search:\n "
-        f"{', '.join(AnnasEbook._ANNAS_URLS.values())}\n"
+        f"{', '.join(AnnasEbook._ANNAS_URLS.keys())} or the base URL "
+        "of a self-hosted mirror or caching proxy. "
+        "Repeat to rank several instances; later ones are tried when "
+        "earlier ones cannot be reached. Overrides GETDAT_INSTANCE and "
+        "the config file if set.\n"
         f"- Default: {AnnasEbook._ANNAS_ORG_URL}"
     ),
 )
+@click.option(
+    "--daemon/--no-daemon",
+    default=True,
+    help=(
+        "Fetch and parse pages through a running `getdat serve` daemon. "
+        "Falls back to this process if none is running. Default: --daemon"
+    ),
+)
+@click.option(
+    "-p",
+    "--pages",
+    type=click.IntRange(min=1),
+    help=(
+        "Number of search result pages to fetch up front. Pages after the "
+        "first are fetched concurrently. More pages can be loaded from the "
+        "results with More Results. Default: 1"
+    ),
+)
+@click.option(
+    "-n",
+    "--limit",
+    type=click.IntRange(min=1),
+    help=(
+        "Maximum number of search results. Fetches result pages until "
+        "this many are found unless --pages is set."
+    ),
+)
+@limit_rate_option
+@click.option(
+    "--record",
+    type=click.Path(dir_okay=False, writable=True),
+    help=(
+        "Save every request and response, with timings, to a HAR file. "
+        "Skips the daemon and the local caches."
+    ),
+)
+@click.option(
+    "--replay",
+    type=click.Path(exists=True, dir_okay=False),
+    help="Answer every request from a HAR file saved with --record, offline.",
+)
+@click.option(
+    "--md5",
+    multiple=True,
+    help=(
+        "Anna's Archive md5 of a known ebook. Skips the search and goes "
+        "straight to its download links. Repeat for several, fetched "
+        "concurrently, or use - to read them from stdin and only list "
+        "their links."
+    ),
+)
+@click.option(
+    "--links-only",
+    type=click.File("w", lazy=True),
+    help=(
+        "Resolve the download URL of every search result, or every --md5, "
+        "in parallel and write them to this file (- for stdout) for an "
+        "external downloader instead of downloading."
+    ),
+)
+@click.option(
+    "--links-format",
+    type=click.Choice(["aria2c", "wget"]),
+    default="aria2c",
+    show_default=True,
+    help=(
+        "Format of the --links-only file: an aria2c input file with output "
+        "file names (aria2c -i FILE), or a URL list (wget -i FILE)."
+    ),
+)
+@click.option(
+    "--links-workers",
+    type=click.IntRange(min=1),
+    default=AnnasEbook._RESOLVE_WORKERS,
+    show_default=True,
+    help="Number of download links --links-only resolves at once.",
+)
+@click.option(
+    "--fastest",
+    is_flag=True,
+    help=(
+        "Probe the direct download links concurrently and download from "
+        "the one with the shortest expected download time instead of "
+        "asking."
+    ),
+)
+@click.option(
+    "--progressive",
+    is_flag=True,
+    help=(
+        "Print search results as the first page downloads instead of once "
+        "it has arrived. That page is fetched here, not through the daemon."
+    ),
+)
+@progress_option
 @click.argument("q", nargs=-1)
-def ebook(q, ext, lang, content, sort, output_dir, instance):
+def ebook(
+    q,
+    ext,
+    lang,
+    content,
+    sort,
+    output_dir,
+    instance,
+    daemon,
+    pages,
+    limit,
+    limit_rate,
+    record,
+    replay,
+    md5,
+    links_only,
+    links_format,
+    links_workers,
+    fastest,
+    progressive,
+    progress,
+):
     """Search and download an ebook available through Anna's Archive
 
     ex: getdat ebook <Search>
     """
-    if not q:
+    if not q and not md5:
         print_help(EBOOK_ERROR_MSG)
+    if record and replay:
+        raise click.UsageError("--record and --replay cannot be used together.")
+    from .har import HarRecorder, HarReplayer
+
+    recorder = HarRecorder(record) if record else None
+    session = None
+    if recorder:
+        session = recorder.session()
+    elif replay:
+        session = HarReplayer.load(replay).session()
+    # a capture holds the whole flow, so pages are not fetched elsewhere
+    # and libgen links are resolved in it rather than read from the cache
     ebook = AnnasEbook(
         q=q,
         ext=ext,
@@ -111,5 +362,357 @@ def ebook(q, ext, lang, content, sort, output_dir, instance):
         sort=sort,
         output_dir=output_dir,
         instance=instance,
+        daemon=DaemonClient.discover() if daemon and not session else None,
+        limit_rate=limit_rate,
+        pages=pages,
+        limit=limit,
+        resolve_cache=None if session else ResolutionCache(),
+        session=session,
+        fastest=fastest,
+        miss_cache=None if session else MissCache(),
+        progressive=progressive,
+        progress=progress_reporter(progress),
+    )
+    try:
+        if links_only:
+            ebook.export_links(
+                links_only,
+                links_format,
+                md5s=md5_stream(md5) if md5 else None,
+                workers=links_workers,
+            )
+        elif md5:
+            ebook.run_md5(md5_stream(md5), interactive="-" not in md5)
+        else:
+            ebook.run()
+    finally:
+        if recorder:
+            recorder.save()
+
+
+@cli.command()
+@click.option(
+    "-a",
+    "--address",
+    default=default_address,
+    show_default="unix:~/.cache/getdat/getdat.sock",
+    help=(
+        "Unix socket (unix:/path) or localhost URL (http://127.0.0.1:8765) "
+        "to listen on. Overrides GETDAT_DAEMON env var if set."
+    ),
+)
+@click.option(
+    "-w",
+    "--workers",
+    type=click.IntRange(min=1),
+    default=4,
+    show_default=True,
+    help="Number of concurrent download jobs.",
+)
+@click.option(
+    "--ttl",
+    type=click.FloatRange(min=0),
+    default=300,
+    show_default=True,
+    help="Seconds that search, links and page results stay cached.",
+)
+@click.option(
+    "-o",
+    "--output_dir",
+    help=(
+        "Directory download jobs are saved under. Jobs for other paths are "
+        "refused. Overrides GETDAT_BOOK_DIR env var if set. Defaults to the "
+        "working directory."
+    ),
+)
+@limit_rate_option
+@total_rate_option
+def serve(address, workers, ttl, output_dir, limit_rate, total_rate):
+    """Runs getdat as a daemon that keeps sessions and caches warm
+
+    ex: getdat serve
+
+    getdat ebook forwards its requests to the daemon while it is running.
+    """
+    from .daemon import DaemonError, GetdatDaemon
+    from .ratelimit import default_limiter
+
+    if total_rate:
+        default_limiter().set_total_rate(total_rate)
+    try:
+        daemon = GetdatDaemon(
+            address=address,
+            workers=workers,
+            ttl=ttl,
+            limit_rate=limit_rate,
+            resolve_cache=ResolutionCache(),
+            miss_cache=MissCache(),
+            download_dir=output_dir,
+        )
+    except DaemonError as e:
+        raise click.ClickException(str(e))
+    click.echo(
+        click.style(f"getdat daemon listening on {daemon.address}", fg="bright_cyan")
+    )
+    try:
+        daemon.serve_forever()
+    except KeyboardInterrupt:
+        pass
+
+
+@cli.group()
+@click.option(
+    "--db",
+    type=click.Path(dir_okay=False),
+    help=(
+        "Path to the queue's SQLite database. Overrides GETDAT_QUEUE_DB "
+        "env var if set. Default: ~/.cache/getdat/queue.db"
+    ),
+)
+@click.pass_context
+def queue(ctx, db):
+    """Persistent download queue for bulk ebook downloads
+
+    ex: getdat queue add <md5> <md5> && getdat queue run
+    """
+    from .jobqueue import JobQueue
+
+    ctx.obj = ctx.with_resource(contextlib.closing(JobQueue(db)))
+
+
+@queue.command("add")
+@click.option(
+    "-o",
+    "--output_dir",
+    help=(
+        "Directory the downloads are saved to. Overrides GETDAT_BOOK_DIR "
+        "env var if set. Defaults to the working directory."
+    ),
+)
+@click.option(
+    "-t",
+    "--title",
+    default="",
+    help=(
+        "Title of the download link(s) as shown on the detail page, "
+        "ex: 'Libgen.li'. Needed to resolve libgen links."
+    ),
+)
+@click.argument("items", nargs=-1, required=True)
+@click.pass_obj
+def queue_add(job_queue, output_dir, title, items):
+    """Queues md5s or download links. Use - to read them from stdin"""
+    dest = os.path.abspath(
+        os.path.expanduser(output_dir or os.environ.get("GETDAT_BOOK_DIR") or ".")
+    )
+    if items == ("-",):
+        items = (line.strip() for line in sys.stdin)
+    added = 0
+    for item in filter(None, items):
+        if AnnasEbook._is_url(item):
+            job_queue.add(dest, link=item, title=title)
+        elif re.fullmatch(r"[0-9a-fA-F]{32}", item):
+            job_queue.add(dest, md5=item.lower())
+        else:
+            click.echo(click.style(f"Skipping {item}: not an md5 or URL", fg="red"))
+            continue
+        added += 1
+    click.echo(f"Queued {added} download(s)")
+
+
+@queue.command("run")
+@click.option(
+    "-w",
+    "--workers",
+    type=click.IntRange(min=1),
+    default=4,
+    show_default=True,
+    help="Number of downloads that run at once.",
+)
+@click.option(
+    "--per-host",
+    type=click.IntRange(min=1),
+    default=2,
+    show_default=True,
+    help="Maximum concurrent downloads from the same host.",
+)
+@click.option(
+    "--max-attempts",
+    type=click.IntRange(min=1),
+    default=3,
+    show_default=True,
+    help="Attempts before a job is marked failed.",
+)
+@click.option(
+    "-i",
+    "--instance",
+    type=InstanceType(),
+    multiple=True,
+    help="Anna's Archive instance(s) used to look up md5 jobs.",
+)
+@click.option(
+    "--fastest",
+    is_flag=True,
+    help="Probe the direct links of md5 jobs and try the fastest first.",
+)
+@limit_rate_option
+@total_rate_option
+@progress_option
+@click.pass_obj
+def queue_run(
+    job_queue,
+    workers,
+    per_host,
+    max_attempts,
+    instance,
+    fastest,
+    limit_rate,
+    total_rate,
+    progress,
+):
+    """Downloads queued jobs, resuming any interrupted ones"""
+    from .ratelimit import default_limiter
+    from .utils import AnnasArchive
+
+    if total_rate:
+        default_limiter().set_total_rate(total_rate)
+
+    def on_update(job):
+        if job["status"] == "done":
+            click.echo(f"Done {job['id']} | {job['path']}")
+        else:
+            status = "Retrying" if job["status"] == "pending" else "Failed"
+            click.echo(click.style(f"{status} {job['id']} | {job['error']}", fg="red"))
+
+    counts = job_queue.run(
+        AnnasArchive(
+            instance=instance,
+            limit_rate=limit_rate,
+            resolve_cache=ResolutionCache(),
+            miss_cache=MissCache(),
+            progress=progress_reporter(progress),
+        ),
+        workers=workers,
+        per_host=per_host,
+        max_attempts=max_attempts,
+        on_update=on_update,
+        fastest=fastest,
+    )
+    click.echo(", ".join(f"{status}: {n}" for status, n in counts.items()))
+
+
+@queue.command("status")
+@click.option(
+    "-s",
+    "--status",
+    type=click.Choice(["pending", "running", "done", "failed"]),
+    help="Only list jobs with this status.",
+)
+@click.pass_obj
+def queue_status(job_queue, status):
+    """Lists queued jobs and their status"""
+    for job in job_queue.jobs(status):
+        item = job["md5"] or job["link"]
+        detail = job["path"] if job["status"] == "done" else job["error"] or ""
+        click.echo(f" {job['id']} | {job['status']} | {item} | {detail}")
+    counts = job_queue.counts()
+    click.echo(", ".join(f"{status}: {n}" for status, n in counts.items()))
+
+
+@cli.command()
+@click.option(
+    "-w",
+    "--workers",
+    type=click.IntRange(min=1),
+    help="Number of parsing processes. Defaults to the number of CPUs.",
+)
+@click.option(
+    "--chunksize",
+    type=click.IntRange(min=1),
+    help="Pages sent to a process at a time. Defaults to about 4 batches per process.",
+)
+@click.argument("paths", nargs=-1, required=True, type=click.Path(exists=True))
+def parse(workers, chunksize, paths):
+    """Parses saved search, detail and libgen pages in bulk
+
+    ex: getdat parse ~/archive/pages > results.ndjson
+
+    Directories are searched for .html files. Each page is printed as one
+    line of JSON in input order.
+    """
+    import json
+    from .parse import page_paths, parse_pages
+
+    for record in parse_pages(page_paths(paths), workers, chunksize):
+        click.echo(json.dumps(record, ensure_ascii=False))
+
+
+@cli.command()
+@click.option(
+    "--host", default="127.0.0.1", show_default=True, help="Interface to bind."
+)
+@click.option(
+    "-p", "--port", default=8080, show_default=True, help="Port to listen on."
+)
+@click.option(
+    "--latency",
+    type=float,
+    default=0.0,
+    show_default=True,
+    help="Seconds of latency added before every response.",
+)
+@click.option(
+    "--rate",
+    callback=size_option,
+    help="Bandwidth cap per connection in bytes per second. Example: 500K, 2M",
+)
+@click.option(
+    "--fail-rate",
+    type=click.FloatRange(min=0, max=1),
+    default=0.0,
+    show_default=True,
+    help="Probability that a request is answered with a 503.",
+)
+@click.option(
+    "--size",
+    callback=size_option,
+    default="1M",
+    show_default=True,
+    help="Size of the binary payloads served for downloads. Example: 50M",
+)
+@click.option(
+    "--results",
+    type=click.IntRange(min=0),
+    default=20,
+    show_default=True,
+    help="Number of results on each search page.",
+)
+@click.option(
+    "--pages",
+    type=click.IntRange(min=0),
+    help="Number of search pages with results. Unlimited if not set.",
+)
+def mirror(host, port, latency, rate, fail_rate, size, results, pages):
+    """Runs a local mock Anna's Archive mirror for offline testing
+
+    ex: getdat mirror --latency 0.2 --rate 1M --fail-rate 0.05
+
+    Search it with: getdat ebook <Search> --instance http://127.0.0.1:8080
+    """
+    from .mock_server import MockMirror
+
+    server = MockMirror(
+        host=host,
+        port=port,
+        latency=latency,
+        rate=rate,
+        fail_rate=fail_rate,
+        payload_size=size,
+        results=results,
+        pages=pages,
     )
-    ebook.run()
+    click.echo(click.style(f"Mock mirror listening on {server.url}", fg="bright_cyan"))
+    try:
+        server.serve_forever()
+    except KeyboardInterrupt:
+        pass
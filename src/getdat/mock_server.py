@@ -0,0 +1,264 @@
+import hashlib
+import random
+import re
+import threading
+import time
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from urllib.parse import urlparse, parse_qs, quote
+from .utils import AnnasArchive
+
+
+class MockMirror:
+    """A local stand-in for Anna's Archive and its libgen mirrors
+
+    Serves fake search pages, /md5/ detail pages, libgen style pages with a
+    `GET` anchor and large binary payloads so the download pipeline can be
+    tested and benchmarked without network access. Point AnnasArchive or
+    AnnasEbook at it by passing `mirror.url` as the instance.
+
+    Payloads honour Range requests. Latency is added before every response,
+    `rate` caps the bytes per second written per connection and `fail_rate`
+    is the probability that a request is answered with a 503 instead.
+    Search pages hold `results` results each, and pages after `pages` are
+    empty.
+    """
+
+    _PAYLOAD_MAGIC = {
+        AnnasArchive._PDF: b"%PDF-1.4\n",
+        AnnasArchive._EPUB: b"PK\x03\x04mimetypeapplication/epub+zip",
+    }
+    _CONTENT_TYPES = {
+        AnnasArchive._PDF: "application/pdf",
+        AnnasArchive._EPUB: "application/epub+zip",
+    }
+    _CHUNK_SIZE = 16 * 1024
+
+    def __init__(
+        self,
+        host: str = "127.0.0.1",
+        port: int = 0,
+        latency: float = 0.0,
+        rate: int | None = None,
+        fail_rate: float = 0.0,
+        payload_size: int = 1024 * 1024,
+        results: int = 20,
+        pages: int | None = None,
+        seed: int | None = None,
+    ):
+        self.latency = latency
+        self.rate = rate
+        self.fail_rate = fail_rate
+        self.payload_size = payload_size
+        self.results = results
+        self.pages = pages
+        self._random = random.Random(seed)
+        self._random_lock = threading.Lock()
+        self._thread = None
+        self._server = ThreadingHTTPServer((host, port), self._handler_class())
+        self._server.daemon_threads = True
+
+    @property
+    def url(self) -> str:
+        host, port = self._server.server_address[:2]
+        return f"http://{host}:{port}"
+
+    def start(self):
+        self._thread = threading.Thread(target=self._server.serve_forever, daemon=True)
+        self._thread.start()
+        return self
+
+    def stop(self):
+        self._server.shutdown()
+        self._server.server_close()
+        if self._thread:
+            self._thread.join()
+
+    def serve_forever(self):
+        try:
+            self._server.serve_forever()
+        finally:
+            self._server.server_close()
+
+    def __enter__(self):
+        return self.start()
+
+    def __exit__(self, *exc):
+        self.stop()
+
+    def _should_fail(self) -> bool:
+        with self._random_lock:
+            return self._random.random() < self.fail_rate
+
+    @staticmethod
+    def md5_for(q: str, idx: int) -> str:
+        return hashlib.md5(f"{q}-{idx}".encode()).hexdigest()
+
+    @classmethod
+    def ext_for(cls, md5: str) -> str:
+        exts = list(cls._PAYLOAD_MAGIC.keys())
+        return exts[int(md5, 16) % len(exts)]
+
+    def payload(self, md5: str, start: int = 0, end: int | None = None) -> bytes:
+        """Deterministic payload bytes for `md5` in [start, end)"""
+        end = self.payload_size if end is None else min(end, self.payload_size)
+        magic = self._PAYLOAD_MAGIC.get(self.ext_for(md5))
+        block = magic + bytes.fromhex(md5) * 64
+        data = bytearray()
+        offset = start
+        while offset < end:
+            block_offset = offset % len(block)
+            piece = block[block_offset : block_offset + (end - offset)]
+            data += piece
+            offset += len(piece)
+        return bytes(data)
+
+    def search_page(self, q: str, page: int = 1) -> str:
+        scrape = AnnasArchive._SOURCE_DICT[AnnasArchive._SOURCE_ANNAS][
+            "search_page_scrape"
+        ]
+        title_container = scrape["title_container"]
+        rows = []
+        first = (page - 1) * self.results
+        last = first + self.results
+        if self.pages is not None and page > self.pages:
+            last = first
+        for idx in range(first, last):
+            md5 = self.md5_for(q, idx)
+            ext = self.ext_for(md5)
+            size = f"{self.payload_size / (1024 * 1024):.1f}MB"
+            rows.append(
+                f'<a href="/md5/{md5}" class="{scrape["class"]}">'
+                f'<div class="{title_container["class"]}">'
+                f"English [en], {ext}, {size}, {q} {idx + 1}.{ext}"
+                "</div></a>"
+            )
+        return self._html(f"Search: {q}", "\n".join(rows))
+
+    def detail_page(self, md5: str) -> str:
+        css_class = AnnasArchive._SOURCE_DICT[AnnasArchive._SOURCE_ANNAS][
+            "detail_page_scrape"
+        ]["class"]
+        links = [
+            (f"{AnnasArchive._FAST_PARTNER_SERVER} #1", f"/fast_download/{md5}/0/0"),
+            (f"{AnnasArchive._SLOW_PARTNER_SERVER} #1", f"/slow_download/{md5}/0/0"),
+            ("IPFS Gateway #1", f"{self.url}/ipfs/{md5}"),
+            (AnnasArchive._LIBGEN_RS, f"{self.url}/ads.php?md5={md5}"),
+            ("Bulk torrent downloads", "/torrents"),
+        ]
+        anchors = "\n".join(
+            f'<a href="{href}" class="{css_class}">{title}</a>' for title, href in links
+        )
+        return self._html(md5, anchors)
+
+    def libgen_page(self, md5: str) -> str:
+        ext = self.ext_for(md5)
+        href = f"{self.url}/get.php?md5={md5}&key=MOCKMIRROR/{quote(md5)}.{ext}"
+        return self._html(md5, f'<a href="{href}">GET</a>')
+
+    @staticmethod
+    def _html(title: str, body: str) -> str:
+        return (
+            '<!DOCTYPE html><html><head><meta charset="utf-8">'
+            f"<title>{title}</title></head><body>{body}</body></html>"
+        )
+
+    def _handler_class(self):
+        mirror = self
+
+        class Handler(BaseHTTPRequestHandler):
+            protocol_version = "HTTP/1.1"
+
+            def log_message(self, format, *args):
+                pass
+
+            def do_HEAD(self):
+                self._dispatch(head=True)
+
+            def do_GET(self):
+                self._dispatch(head=False)
+
+            def _dispatch(self, head: bool):
+                if mirror.latency:
+                    time.sleep(mirror.latency)
+                if mirror._should_fail():
+                    return self._send_html("Service Unavailable", status=503, head=head)
+                parsed = urlparse(self.path)
+                params = parse_qs(parsed.query)
+                path = parsed.path
+                if path == "/search":
+                    q = " ".join(params.get("q", [""]))
+                    page = int(params.get("page", ["1"])[0])
+                    return self._send_html(mirror.search_page(q, page), head=head)
+                if match := re.fullmatch(r"/md5/([0-9a-f]{32})", path):
+                    return self._send_html(mirror.detail_page(match[1]), head=head)
+                if path == "/ads.php" and params.get("md5"):
+                    return self._send_html(
+                        mirror.libgen_page(params["md5"][0]), head=head
+                    )
+                if path == "/get.php" and params.get("md5"):
+                    return self._send_payload(params["md5"][0], head=head)
+                if match := re.fullmatch(r"/ipfs/([0-9a-f]{32})", path):
+                    return self._send_payload(match[1], head=head)
+                if re.match(r"/(fast|slow)_download/", path):
+                    return self._send_html("Browser verification", head=head)
+                return self._send_html("Not Found", status=404, head=head)
+
+            def _send_html(self, html: str, status: int = 200, head: bool = False):
+                body = html.encode("utf-8")
+                self.send_response(status)
+                self.send_header("Content-Type", "text/html; charset=utf-8")
+                self.send_header("Content-Length", str(len(body)))
+                self.end_headers()
+                if not head:
+                    self._write(body)
+
+            def _send_payload(self, md5: str, head: bool = False):
+                size = mirror.payload_size
+                start, end = 0, size
+                status = 200
+                range_header = self.headers.get("Range")
+                if range_header:
+                    match = re.fullmatch(r"bytes=(\d*)-(\d*)", range_header.strip())
+                    if match and (match[1] or match[2]):
+                        if match[1]:
+                            start = int(match[1])
+                            end = int(match[2]) + 1 if match[2] else size
+                        else:
+                            start = max(size - int(match[2]), 0)
+                        end = min(end, size)
+                    if not match or start >= size or start >= end:
+                        self.send_response(416)
+                        self.send_header("Content-Range", f"bytes */{size}")
+                        self.send_header("Content-Length", "0")
+                        self.end_headers()
+                        return
+                    status = 206
+                ext = mirror.ext_for(md5)
+                self.send_response(status)
+                self.send_header("Content-Type", mirror._CONTENT_TYPES.get(ext))
+                self.send_header("Content-Length", str(end - start))
+                self.send_header("Accept-Ranges", "bytes")
+                if status == 206:
+                    self.send_header("Content-Range", f"bytes {start}-{end - 1}/{size}")
+                self.end_headers()
+                if head:
+                    return
+                offset = start
+                while offset < end:
+                    chunk_end = min(offset + mirror._CHUNK_SIZE, end)
+                    if not self._write(mirror.payload(md5, offset, chunk_end)):
+                        return
+                    offset = chunk_end
+
+            def _write(self, data: bytes) -> bool:
+                for idx in range(0, len(data), mirror._CHUNK_SIZE):
+                    chunk = data[idx : idx + mirror._CHUNK_SIZE]
+                    if mirror.rate:
+                        time.sleep(len(chunk) / mirror.rate)
+                    try:
+                        self.wfile.write(chunk)
+                    except (BrokenPipeError, ConnectionResetError):
+                        return False
+                return True
+
+        return Handler
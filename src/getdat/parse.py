@@ -0,0 +1,80 @@
+import os
+from concurrent.futures import ProcessPoolExecutor
+from .utils import AnnasArchive
+
+HTML_EXT = (".html", ".htm")
+
+
+def page_paths(paths) -> list:
+    """HTML files among `paths`, with directories walked in sorted order"""
+    found = []
+    for path in paths:
+        if not os.path.isdir(path):
+            found.append(path)
+            continue
+        for root, dirs, files in os.walk(path):
+            dirs.sort()
+            found.extend(
+                os.path.join(root, name)
+                for name in sorted(files)
+                if name.lower().endswith(HTML_EXT)
+            )
+    return found
+
+
+def parse_page(path: str) -> dict:
+    """Results of one saved page, scraped with the first rule that matches
+
+    Rules are tried in _SOURCE_DICT order: search, detail and then libgen
+    pages. Both libgen mirrors share one rule, so a libgen page is reported
+    under the first of them. A page that cannot be read or scraped is
+    reported with an error instead of results, so one bad page does not
+    stop a bulk parse.
+    """
+    try:
+        with open(path, "rb") as f:
+            content = f.read()
+    except OSError as e:
+        return {"path": path, "error": str(e)}
+    for (source_name, scrape_key), rule in AnnasArchive._SCRAPE_RULES.items():
+        try:
+            results = rule.scrape(content)
+        except Exception as e:
+            return {"path": path, "error": f"{type(e).__name__}: {e}"}
+        if results:
+            return {
+                "path": path,
+                "source": source_name,
+                "page": scrape_key,
+                "results": [
+                    {
+                        "value": value,
+                        "title": str(title),
+                        "link": link,
+                        "md5": AnnasArchive._md5(link),
+                    }
+                    for value, title, link in results
+                ],
+            }
+    return {"path": path, "source": None, "page": None, "results": []}
+
+
+def parse_pages(paths, workers: int | None = None, chunksize: int | None = None):
+    """Parse saved pages across a pool of processes
+
+    Yields parse_page's dict for each path in input order as soon as it
+    and every path before it are parsed. Paths are sent to the workers in
+    batches of `chunksize`, by default about four batches per worker, so
+    inter-process overhead stays small next to parsing. One worker parses
+    in this process.
+    """
+    paths = list(paths)
+    workers = workers or os.cpu_count() or 1
+    if workers == 1 or len(paths) <= 1:
+        yield from map(parse_page, paths)
+        return
+    workers = min(workers, len(paths))
+    if chunksize is None:
+        chunksize = max(1, len(paths) // (workers * 4))
+    with ProcessPoolExecutor(workers) as pool:
+        yield from pool.map(parse_page, paths, chunksize=chunksize)
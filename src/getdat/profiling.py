@@ -0,0 +1,75 @@
+import cProfile
+import os
+import sys
+import threading
+from collections import Counter
+
+DEFAULT_PROFILE = "getdat.prof"
+# output paths written as collapsed stacks by the sampling profiler
+COLLAPSED_EXT = (".folded", ".collapsed")
+
+
+class SamplingProfiler:
+    """Samples the stack of every thread every `interval` seconds
+
+    A background thread reads sys._current_frames(), so the profiled
+    code runs at full speed and worker threads are profiled too, which
+    cProfile does not do. Samples are written as collapsed stacks, one
+    `thread;outer;...;inner count` line per stack, the input format of
+    flamegraph.pl, speedscope and inferno.
+    """
+
+    def __init__(self, interval: float = 0.005):
+        self.interval = interval
+        self.samples = Counter()
+        self._stopped = threading.Event()
+        self._thread = None
+
+    @staticmethod
+    def _label(frame) -> str:
+        code = frame.f_code
+        return f"{code.co_name} ({os.path.basename(code.co_filename)}:{code.co_firstlineno})"
+
+    def _stack(self, frame) -> tuple:
+        stack = []
+        while frame is not None:
+            stack.append(self._label(frame))
+            frame = frame.f_back
+        return tuple(reversed(stack))
+
+    def _sample(self):
+        names = {thread.ident: thread.name for thread in threading.enumerate()}
+        for ident, frame in sys._current_frames().items():
+            if ident == self._thread.ident:
+                continue
+            self.samples[(names.get(ident, str(ident)),) + self._stack(frame)] += 1
+
+    def _run(self):
+        while not self._stopped.wait(self.interval):
+            self._sample()
+
+    def enable(self):
+        self._stopped.clear()
+        self._thread = threading.Thread(target=self._run, daemon=True)
+        self._thread.start()
+
+    def disable(self):
+        self._stopped.set()
+        if self._thread:
+            self._thread.join()
+
+    def dump_stats(self, path: str):
+        with open(path, "w") as f:
+            for stack, count in self.samples.most_common():
+                f.write(f"{';'.join(stack)} {count}\n")
+
+
+def profiler(path: str):
+    """Profiler for `path`, a SamplingProfiler for collapsed stacks
+
+    Both kinds are started with enable(), stopped with disable() and
+    written with dump_stats(path). Other paths get cProfile's pstats.
+    """
+    if path.endswith(COLLAPSED_EXT):
+        return SamplingProfiler()
+    return cProfile.Profile()
@@ -0,0 +1,228 @@
+import json
+import sys
+import threading
+import time
+from collections import deque
+
+PROGRESS_MODES = ("auto", "bar", "log", "off")
+
+
+def format_duration(seconds: float) -> str:
+    """Format seconds as 42s, 3:05 or 1:02:09"""
+    seconds = int(seconds)
+    if seconds < 60:
+        return f"{seconds}s"
+    minutes, seconds = divmod(seconds, 60)
+    if minutes < 60:
+        return f"{minutes}:{seconds:02}"
+    hours, minutes = divmod(minutes, 60)
+    return f"{hours}:{minutes:02}:{seconds:02}"
+
+
+class Transfer:
+    """Bytes received by one download over time
+
+    `done` counts bytes already on disk from an interrupted download, so
+    progress and ETA cover the whole file, while rates only count bytes
+    received by this transfer. The current rate is measured over the last
+    WINDOW seconds.
+    """
+
+    WINDOW = 3.0
+
+    def __init__(self, name: str, host: str, total=None, offset: int = 0, now=None):
+        self.name = name
+        self.host = host or ""
+        self.total = total
+        self.done = offset
+        self.received = 0
+        self.started = time.monotonic() if now is None else now
+        self._samples = deque([(self.started, 0)])
+
+    def add(self, size: int, now: float):
+        self.done += size
+        self.received += size
+        self._samples.append((now, self.received))
+        while len(self._samples) > 2 and now - self._samples[1][0] >= self.WINDOW:
+            self._samples.popleft()
+
+    def rate(self, now: float) -> float:
+        since, received = self._samples[0]
+        return (self.received - received) / max(now - since, 1e-6)
+
+    def average(self, now: float) -> float:
+        return self.received / max(now - self.started, 1e-6)
+
+    def eta(self, now: float) -> float | None:
+        rate = self.rate(now) or self.average(now)
+        if self.total is None or not rate:
+            return None
+        return max(self.total - self.done, 0) / rate
+
+    def stats(self, now: float) -> dict:
+        return {
+            "name": self.name,
+            "host": self.host,
+            "bytes": self.done,
+            "total": self.total,
+            "rate": round(self.rate(now)),
+            "average": round(self.average(now)),
+            "eta": None if self.eta(now) is None else round(self.eta(now), 1),
+            "elapsed": round(now - self.started, 1),
+        }
+
+
+class Progress:
+    """Follows concurrent downloads and reports on them every `interval` seconds
+
+    AnnasArchive calls start() when a download begins, update() for every
+    chunk and finish() at the end, from any thread. Subclasses render the
+    reports: TerminalProgress and LogProgress.
+    """
+
+    interval = 0.5
+
+    def __init__(self, file=None, interval: float | None = None):
+        self.file = file or sys.stderr
+        if interval is not None:
+            self.interval = interval
+        self.transfers = []
+        self._lock = threading.Lock()
+        self._reported = 0.0
+
+    def start(self, name: str, host: str, total=None, offset: int = 0) -> Transfer:
+        now = time.monotonic()
+        transfer = Transfer(name, host, total, offset, now)
+        with self._lock:
+            self.transfers.append(transfer)
+            self._started(transfer, now)
+        return transfer
+
+    def update(self, transfer: Transfer, size: int):
+        now = time.monotonic()
+        with self._lock:
+            transfer.add(size, now)
+            if now - self._reported >= self.interval:
+                self._reported = now
+                self._report(now)
+
+    def finish(self, transfer: Transfer, error: BaseException | None = None):
+        now = time.monotonic()
+        with self._lock:
+            if transfer in self.transfers:
+                self.transfers.remove(transfer)
+            self._finished(transfer, error, now)
+
+    def _write(self, text: str):
+        self.file.write(text)
+        self.file.flush()
+
+    def _started(self, transfer: Transfer, now: float):
+        pass
+
+    def _report(self, now: float):
+        pass
+
+    def _finished(self, transfer: Transfer, error, now: float):
+        pass
+
+
+class TerminalProgress(Progress):
+    """A status line of bytes, current and average rate, ETA and hosts
+
+    Several downloads at once share one line with their totals. A line
+    is printed for each finished download, leaving the cursor on a new
+    line for other output until the next report.
+    """
+
+    @staticmethod
+    def _size(size: float) -> str:
+        from .utils import format_size
+
+        return format_size(size)
+
+    def _line(self, now: float) -> str:
+        transfers = self.transfers
+        done = sum(transfer.done for transfer in transfers)
+        rate = sum(transfer.rate(now) for transfer in transfers)
+        average = sum(transfer.average(now) for transfer in transfers)
+        parts = [self._size(done)]
+        if all(transfer.total for transfer in transfers):
+            total = sum(transfer.total for transfer in transfers)
+            parts = [f"{self._size(done)} / {self._size(total)}"]
+            parts.append(f"{done * 100 // max(total, 1)}%")
+        parts.append(f"{self._size(rate)}/s now")
+        parts.append(f"{self._size(average)}/s avg")
+        etas = [transfer.eta(now) for transfer in transfers]
+        if None not in etas:
+            parts.append(f"ETA {format_duration(max(etas))}")
+        hosts = sorted({transfer.host for transfer in transfers})
+        parts.append(", ".join(hosts))
+        if len(transfers) > 1:
+            parts.insert(0, f"{len(transfers)} downloads")
+        return " " + " | ".join(parts)
+
+    def _report(self, now: float):
+        if self.transfers:
+            self._write(f"\r{self._line(now)}\x1b[K")
+
+    def _finished(self, transfer: Transfer, error, now: float):
+        elapsed = format_duration(now - transfer.started)
+        if error is None:
+            status = f"Downloaded {transfer.name}"
+        else:
+            status = f"Failed {transfer.name} ({error or type(error).__name__})"
+        self._write(
+            f"\r {status} | {self._size(transfer.done)} in {elapsed} | "
+            f"{self._size(transfer.average(now))}/s avg | {transfer.host}\x1b[K\n"
+        )
+
+
+class LogProgress(Progress):
+    """One JSON object per line: start, progress of each download, done or failed
+
+        {"event": "progress", "name": "book.pdf", "host": "libgen.rs",
+         "bytes": 1048576, "total": 4194304, "rate": 524288,
+         "average": 498012, "eta": 6.0, "elapsed": 2.1}
+
+    Rates are bytes per second and times seconds. Progress lines are
+    written every `interval` seconds, 5 by default.
+    """
+
+    interval = 5.0
+
+    def _event(self, event: str, transfer: Transfer, now: float, **fields):
+        record = {"event": event, **transfer.stats(now), **fields}
+        self._write(json.dumps(record) + "\n")
+
+    def _started(self, transfer: Transfer, now: float):
+        self._event("start", transfer, now)
+
+    def _report(self, now: float):
+        for transfer in self.transfers:
+            self._event("progress", transfer, now)
+
+    def _finished(self, transfer: Transfer, error, now: float):
+        if error is None:
+            self._event("done", transfer, now)
+        else:
+            self._event(
+                "failed", transfer, now, error=str(error) or type(error).__name__
+            )
+
+
+def progress_reporter(mode: str = "auto", file=None) -> Progress | None:
+    """The Progress for a --progress mode, None when off
+
+    `auto` shows the status line when stderr is a terminal and nothing
+    otherwise.
+    """
+    file = file or sys.stderr
+    if mode == "auto":
+        mode = "bar" if file.isatty() else "off"
+    match mode:
+        case "bar":
+            return TerminalProgress(file)
+        case "log":
+            return LogProgress(file)
+    return None
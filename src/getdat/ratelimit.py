@@ -0,0 +1,198 @@
+import contextlib
+import fnmatch
+import threading
+import time
+from .config import load_config
+
+BACKOFF_STATUS = (429, 503)
+
+
+class TokenBucket:
+    """Token bucket refilled at `rate` tokens per second up to `capacity`"""
+
+    def __init__(self, rate: float, capacity: float | None = None):
+        self.rate = rate
+        self.capacity = capacity or max(rate, 1.0)
+        self._tokens = self.capacity
+        self._updated = time.monotonic()
+        self._lock = threading.Lock()
+
+    def _refill(self, now: float):
+        self._tokens = min(
+            self.capacity, self._tokens + (now - self._updated) * self.rate
+        )
+        self._updated = now
+
+    def acquire(self, tokens: float = 1.0):
+        """Block until `tokens` are available and take them
+
+        More tokens than the bucket holds are taken a bucketful at a time,
+        so a byte bucket can throttle chunks larger than its rate.
+        """
+        while tokens > 0:
+            needed = min(tokens, self.capacity)
+            self._take(needed)
+            tokens -= needed
+
+    def _take(self, tokens: float):
+        while True:
+            with self._lock:
+                self._refill(time.monotonic())
+                if self._tokens >= tokens:
+                    self._tokens -= tokens
+                    return
+                wait = (tokens - self._tokens) / self.rate
+            time.sleep(wait)
+
+
+class HostLimiter:
+    """Concurrency cap, request rate and adaptive backoff for one host
+
+    `concurrency` caps requests waiting on a response and `rate` caps
+    requests started per second. Both are optional. `backoff` is called
+    when the host answers 429 or 503: the host is paused for Retry-After
+    or an exponentially growing delay, at most _MAX_DELAY, and its rate
+    is halved. Every successful response moves the rate back towards the
+    configured value.
+    """
+
+    _BASE_DELAY = 1.0
+    _MAX_DELAY = 60.0
+
+    def __init__(
+        self,
+        concurrency: int | None = None,
+        rate: float | None = None,
+        burst: float | None = None,
+    ):
+        self.concurrency = concurrency
+        self.rate = rate
+        self._slots = threading.BoundedSemaphore(concurrency) if concurrency else None
+        self._bucket = TokenBucket(rate, burst) if rate else None
+        self._lock = threading.Lock()
+        self._backoff_until = 0.0
+        self._failures = 0
+
+    @contextlib.contextmanager
+    def slot(self):
+        """Wait out any backoff and the token bucket, then hold a request slot"""
+        while True:
+            with self._lock:
+                wait = self._backoff_until - time.monotonic()
+            if wait <= 0:
+                break
+            time.sleep(wait)
+        if self._bucket:
+            self._bucket.acquire()
+        if not self._slots:
+            yield
+            return
+        with self._slots:
+            yield
+
+    def backoff(self, retry_after: float | None = None):
+        with self._lock:
+            self._failures += 1
+            delay = retry_after
+            if delay is None:
+                delay = self._BASE_DELAY * 2 ** (self._failures - 1)
+            delay = min(delay, self._MAX_DELAY)
+            self._backoff_until = max(self._backoff_until, time.monotonic() + delay)
+            if self._bucket:
+                self._bucket.rate = max(self._bucket.rate / 2, self.rate / 16)
+
+    def success(self):
+        with self._lock:
+            self._failures = 0
+            if self._bucket and self._bucket.rate < self.rate:
+                self._bucket.rate = min(self._bucket.rate * 1.25, self.rate)
+
+    def observe(self, response) -> bool:
+        """Adapt to `response`. Returns True if the request should be retried
+
+        A host asking to be left alone for longer than _MAX_DELAY is still
+        backed off from, but the request is given up on rather than
+        waiting that long.
+        """
+        if response.status_code not in BACKOFF_STATUS:
+            self.success()
+            return False
+        try:
+            retry_after = max(float(response.headers.get("Retry-After")), 0.0)
+        except (TypeError, ValueError):
+            retry_after = None
+        self.backoff(retry_after)
+        return retry_after is None or retry_after <= self._MAX_DELAY
+
+
+class RateLimiter:
+    """Per-host limits shared by every AnnasArchive in the process
+
+    Limits are matched against the request's host with fnmatch patterns,
+    first match wins. Patterns in the [ratelimit] table of the config file
+    are tried before the defaults:
+
+        [ratelimit."annas-archive.*"]
+        concurrency = 2
+        rate = 1.0
+        burst = 3
+
+    `bandwidth` is an optional budget in bytes per second shared by every
+    download in the process. It is set with `set_total_rate` or with
+    `total_rate` in the [bandwidth] table of the config file.
+    """
+
+    DEFAULT_LIMITS = {
+        "annas-archive.*": {"concurrency": 4, "rate": 3.0, "burst": 5},
+        "libgen.*": {"concurrency": 4, "rate": 2.0, "burst": 4},
+        "*ipfs*": {"concurrency": 4, "rate": 5.0, "burst": 10},
+        "*.library.lol": {"concurrency": 4, "rate": 2.0, "burst": 4},
+    }
+
+    def __init__(self, limits: dict | None = None, total_rate: int | None = None):
+        self.limits = dict(self.DEFAULT_LIMITS if limits is None else limits)
+        self.bandwidth = None
+        self._hosts = {}
+        self._lock = threading.Lock()
+        self.set_total_rate(total_rate)
+
+    @classmethod
+    def from_config(cls):
+        from .utils import parse_size
+
+        limits = load_config("ratelimit")
+        for pattern, limit in cls.DEFAULT_LIMITS.items():
+            limits.setdefault(pattern, limit)
+        total_rate = load_config("bandwidth").get("total_rate")
+        return cls(limits, parse_size(total_rate) if total_rate else None)
+
+    def set_total_rate(self, total_rate: int | None):
+        """Share `total_rate` bytes per second between all downloads, None to lift it"""
+        self.bandwidth = TokenBucket(total_rate) if total_rate else None
+
+    def for_host(self, host: str) -> HostLimiter:
+        with self._lock:
+            if host not in self._hosts:
+                limit = next(
+                    (
+                        limit
+                        for pattern, limit in self.limits.items()
+                        if fnmatch.fnmatch(host, pattern)
+                    ),
+                    {},
+                )
+                self._hosts[host] = HostLimiter(**limit)
+            return self._hosts[host]
+
+
+_default_limiter = None
+_default_limiter_lock = threading.Lock()
+
+
+def default_limiter() -> RateLimiter:
+    """The process wide RateLimiter, loaded from the config file once"""
+    global _default_limiter
+    with _default_limiter_lock:
+        if _default_limiter is None:
+            _default_limiter = RateLimiter.from_config()
+        return _default_limiter
@@ -0,0 +1,197 @@
+import codecs
+import functools
+from html.parser import HTMLParser
+from importlib.util import find_spec
+import soupsieve
+from bs4 import BeautifulSoup, SoupStrainer
+from .config import load_config
+
+PARSERS = ("html.parser", "lxml")
+DEFAULT_PARSER = "html.parser"
+
+
+@functools.cache
+def configured_parser() -> str:
+    """BeautifulSoup backend set with `parser` in the [scrape] table
+
+        [scrape]
+        parser = "lxml"
+
+    html.parser ships with Python and is the default. lxml is faster and
+    comes with the lxml extra, ex: pipx install 'getdat[lxml]'. The config
+    file is read once per process.
+    """
+    parser = load_config("scrape").get("parser", DEFAULT_PARSER)
+    if parser not in PARSERS:
+        raise ValueError(f"parser must be one of {', '.join(PARSERS)}, not {parser!r}")
+    if parser == "lxml" and not find_spec("lxml"):
+        raise ValueError('parser = "lxml" needs lxml, install getdat[lxml]')
+    return parser
+
+
+def css_selector(rule: dict) -> str:
+    """CSS selector for a rule given as `selector` or as `tag` and `class`"""
+    if rule.get("selector"):
+        return rule["selector"]
+    classes = "".join(
+        f".{soupsieve.escape(name)}" for name in (rule.get("class") or "").split()
+    )
+    return f"{rule.get('tag') or ''}{classes}" or "*"
+
+
+class ScrapeRule:
+    """A scrape rule of AnnasArchive._SOURCE_DICT, compiled once
+
+    Rules are data. Elements are matched by `tag` and `class`, where every
+    class in the string must be present in any order, or by a CSS
+    `selector`. `title_container` is a nested rule for the element that
+    holds each result's title, otherwise the element's own text is the
+    title. `text` keeps only elements with that title and `exclude_text`
+    drops them.
+
+    Only `tag` elements and their children are built into the tree, so
+    the selector walks the candidate elements rather than the whole page.
+    Pages are parsed with `parser`, by default configured_parser().
+    """
+
+    def __init__(self, rule: dict, parser: str | None = None):
+        self._parser = parser
+        self.selector = soupsieve.compile(css_selector(rule))
+        tag = rule.get("tag")
+        self.tag = tag
+        # a tag and classes match each element on its own, a CSS selector
+        # may depend on the element's ancestors
+        self.per_element = bool(tag) and not rule.get("selector")
+        self.strainer = SoupStrainer(tag) if tag else None
+        title = rule.get("title_container")
+        self.title = soupsieve.compile(css_selector(title)) if title else None
+        self.text = rule.get("text")
+        self.exclude_text = rule.get("exclude_text")
+
+    @property
+    def parser(self) -> str:
+        return self._parser or configured_parser()
+
+    def soup(self, content, encoding: str | None = None) -> BeautifulSoup:
+        """Parse `content`, bytes as received or str
+
+        Bytes are handed to the parser as they are. With the `encoding`
+        from the response headers they are decoded once without sniffing,
+        and lxml decodes them itself without a Python str copy.
+        """
+        if not isinstance(content, bytes):
+            encoding = None
+        return BeautifulSoup(
+            content, self.parser, parse_only=self.strainer, from_encoding=encoding
+        )
+
+    def scrape(self, content, encoding: str | None = None) -> list:
+        """(value, title, link) of each match, valued by position among matches"""
+        return self.results(self.selector.select(self.soup(content, encoding)))
+
+    def results(self, matches: list) -> list:
+        """(value, title, link) of each of `matches`, the elements selected"""
+        results = []
+        for idx, el in enumerate(matches):
+            title = (
+                el.string if self.title is None else self.title.select_one(el).string
+            )
+            if self.text is not None and title != self.text:
+                continue
+            if self.exclude_text is not None and title == self.exclude_text:
+                continue
+            results.append((idx + 1, title, el["href"]))
+        return results
+
+
+class PushScraper(HTMLParser):
+    """Scrapes a page with a ScrapeRule as its bytes arrive
+
+    feed() takes chunks of the page and returns the (value, title, link)
+    of each match whose element was completed by that chunk, so results
+    can be shown before the page has finished downloading. The markup of
+    the `tag` elements of the rule completed by a chunk is collected and
+    parsed once, on its own, so results, values included, are the ones
+    ScrapeRule.scrape gives for the whole page. Rules with a CSS
+    `selector` or without a `tag` cannot be split this way and are
+    scraped when the page is closed.
+
+        scraper = PushScraper(rule, "utf-8")
+        for chunk in response.iter_content(chunk_size=16 * 1024):
+            for value, title, link in scraper.feed(chunk):
+                ...
+        results = scraper.close()
+    """
+
+    def __init__(self, rule: ScrapeRule, encoding: str | None = None):
+        super().__init__(convert_charrefs=False)
+        self.rule = rule
+        self._decoder = codecs.getincrementaldecoder(encoding or "utf-8")("replace")
+        self._markup = []
+        self._completed = []
+        self._depth = 0
+        self._page = None if rule.per_element else []
+        self._matches = 0
+
+    def _append(self, text: str):
+        if self._depth:
+            self._markup.append(text)
+
+    def handle_starttag(self, tag, attrs):
+        if tag == self.rule.tag:
+            self._depth += 1
+        self._append(self.get_starttag_text())
+
+    def handle_startendtag(self, tag, attrs):
+        self._append(self.get_starttag_text())
+
+    def handle_endtag(self, tag):
+        self._append(f"</{tag}>")
+        if tag == self.rule.tag and self._depth:
+            self._depth -= 1
+            if not self._depth:
+                self._completed.extend(self._markup)
+                self._markup = []
+
+    def handle_data(self, data):
+        self._append(data)
+
+    def handle_entityref(self, name):
+        self._append(f"&{name};")
+
+    def handle_charref(self, name):
+        self._append(f"&#{name};")
+
+    def _results(self) -> list:
+        """Results of the elements completed since the last call"""
+        if not self._completed:
+            return []
+        markup, self._completed = "".join(self._completed), []
+        matches = self.rule.selector.select(self.rule.soup(markup))
+        found = [
+            (self._matches + value, title, link)
+            for value, title, link in self.rule.results(matches)
+        ]
+        # values count every match of the selector, kept or not
+        self._matches += len(matches)
+        return found
+
+    def feed(self, chunk) -> list:
+        if isinstance(chunk, bytes):
+            chunk = self._decoder.decode(chunk)
+        if self._page is not None:
+            self._page.append(chunk)
+            return []
+        super().feed(chunk)
+        return self._results()
+
+    def close(self) -> list:
+        rest = self._decoder.decode(b"", final=True)
+        if self._page is not None:
+            return self.rule.scrape("".join(self._page) + rest)
+        super().feed(rest)
+        super().close()
+        if self._depth:
+            # an element left open at the end of the page
+            self._completed.extend(self._markup)
+        return self._results()
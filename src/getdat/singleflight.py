@@ -0,0 +1,54 @@
+import threading
+
+
+class _Call:
+    def __init__(self):
+        self.done = threading.Event()
+        self.value = None
+        self.error = None
+        self.shared = 0
+
+
+class SingleFlight:
+    """Coalesces concurrent calls for the same key into one
+
+    The first caller of do() for a key runs the function. Callers that
+    arrive with that key while it is running wait and get the same value,
+    or the same exception raised again, instead of running it themselves.
+    Once the call returns the key is forgotten, so nothing is cached.
+
+        flights = SingleFlight()
+        page = flights.do(url, lambda: fetch(url))
+    """
+
+    def __init__(self):
+        self._calls = {}
+        self._lock = threading.Lock()
+
+    def do(self, key, func):
+        with self._lock:
+            call = self._calls.get(key)
+            leader = call is None
+            if leader:
+                call = self._calls[key] = _Call()
+            else:
+                call.shared += 1
+        if not leader:
+            call.done.wait()
+            if call.error:
+                raise call.error
+            return call.value
+        try:
+            call.value = func()
+        except BaseException as e:
+            call.error = e
+            raise
+        finally:
+            with self._lock:
+                del self._calls[key]
+            call.done.set()
+        return call.value
+
+    def in_flight(self) -> int:
+        with self._lock:
+            return len(self._calls)
@@ -1,10 +1,47 @@
 import click
+import functools
+import math
+import mimetypes
 import os
+import queue
+import re
 import requests
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor
 from typing import Literal
+from urllib.parse import parse_qs, urlencode, urlparse, unquote
 from requests.exceptions import ConnectionError, ChunkedEncodingError
 from requests.models import Response
-from bs4 import BeautifulSoup
+from .config import load_config
+from .daemon import DaemonError
+from .exceptions import DownloadError
+from .ratelimit import TokenBucket, default_limiter
+from .scrape import PushScraper, ScrapeRule
+from .singleflight import SingleFlight
+from .writer import DEFAULT_BUFFER_SIZE, FileWriter
+
+
+def parse_size(value: str) -> int:
+    """Parse a curl style size such as 500, 200K, 1.5M or 2G into bytes"""
+    units = {"": 1, "k": 1024, "m": 1024**2, "g": 1024**3}
+    value = str(value).strip().lower().removesuffix("b")
+    unit = value[-1:] if value[-1:] in units else ""
+    number = value[: len(value) - len(unit)]
+    try:
+        size = float(number) * units[unit]
+    except ValueError:
+        raise ValueError(f"Invalid size: {value}")
+    return int(size)
+
+
+def format_size(size: float) -> str:
+    """Format bytes the way parse_size reads them, ex: 1.5M"""
+    for unit in ("", "K", "M"):
+        if size < 1024:
+            return f"{size:.3g}{unit}"
+        size /= 1024
+    return f"{size:.3g}G"
 
 
 def print_help(msg: str):
@@ -15,9 +52,24 @@ def print_help(msg: str):
     ctx.exit()
 
 
-class AnnasEbook:
+class AnnasArchive:
+    """Programmatic access to Anna's Archive with no terminal I/O
+
+    search, links, resolve and fetch return plain data or raise, so they
+    can be called in-process from services:
+
+        archive = AnnasArchive(instance="gs")
+        results = archive.search("Treasure Island Stevenson", ext="epub")
+        links = archive.links(results[0]["md5"])
+        link = next(link for link in links if link["direct"])
+        path = archive.fetch(link["link"], "~/books", link["title"], results[0]["title"])
+
+    Requests raise requests' ConnectionError once every ranked instance
+    has been tried and fetch raises DownloadError when a link does not lead
+    to a file. Calls keep no per-call state on the instance, so one
+    AnnasArchive may be shared between threads.
+    """
 
-    _ENTRY_NOT_DISPLAYED = "Entry information could not be displayed"
     _FAST_PARTNER_SERVER = "Fast Partner Server"
     _SLOW_PARTNER_SERVER = "Slow Partner Server"
     _INTERNET_ARCHIVE = "Borrow from the Internet Archive"
@@ -56,6 +108,23 @@ class AnnasEbook:
 
     _FILE_EXT = (_PDF, _EPUB, _MOBI, _CBR, _CBZ, _FB2, _FB2_ZIP, _AZW3, _DJVU)
 
+    # (offset, signature) that files of each extension start with
+    _ZIP_MAGIC = (0, b"PK\x03\x04")
+    _MOBI_MAGIC = (60, b"BOOKMOBI")
+    _MAGIC = {
+        _PDF: (0, b"%PDF-"),
+        _EPUB: _ZIP_MAGIC,
+        _CBZ: _ZIP_MAGIC,
+        _FB2_ZIP: _ZIP_MAGIC,
+        _MOBI: _MOBI_MAGIC,
+        _AZW3: _MOBI_MAGIC,
+        _DJVU: (0, b"AT&TFORM"),
+        _CBR: (0, b"Rar!\x1a\x07"),
+    }
+    _HTML_MAGIC = (b"<!doctype html", b"<html", b"<head", b"<body")
+    # bytes of a download inspected before anything is written
+    _SNIFF_SIZE = 4 * 1024
+
     _BOOK_NF = "nf"
     _BOOK_F = "f"
     _BOOK_U = "u"
@@ -98,18 +167,834 @@ class AnnasEbook:
                     ),
                 },
             },
-            "detail_page_scrape": {"tag": "a", "class": "js-download-link"},
+            "detail_page_scrape": {
+                "tag": "a",
+                "class": "js-download-link",
+                "exclude_text": "Bulk torrent downloads",
+            },
+        },
+        _LIBGEN_RS: {"download_page_scrape": {"tag": "a", "text": "GET"}},
+        _LIBGEN_LI: {
+            "url": "https://libgen.li/",
+            "download_page_scrape": {"tag": "a", "text": "GET"},
         },
-        _LIBGEN_RS: {"download_page_scrape": {"tag": "a"}},
-        _LIBGEN_LI: {"url": "https://libgen.li/", "download_page_scrape": {"tag": "a"}},
     }
-    _current_source = _SOURCE_ANNAS
+    # every *_scrape rule above compiled once, see ScrapeRule for the format
+    _SCRAPE_RULES = {
+        (source_name, scrape_key): ScrapeRule(rule)
+        for source_name, source in _SOURCE_DICT.items()
+        for scrape_key, rule in source.items()
+        if scrape_key.endswith("_scrape")
+    }
     _browser = "Continue in Browser"
-    _scrape_key = "search_page_scrape"
-    _selected_result = {}
-    _msg = "Searching Anna's Archive..."
-    _resource_name = ""
-    _search_params = dict()
+    _CHUNK_SIZE = 64 * 1024
+    # small chunks let search results show while the page downloads
+    _STREAM_CHUNK_SIZE = 8 * 1024
+    # bytes downloaded from each link when probing its speed
+    _PROBE_SIZE = 64 * 1024
+    _BACKOFF_RETRIES = 2
+    # seconds an instance that failed to connect is passed over
+    _DEMOTE_SECONDS = 300
+    # result pages fetched at once, and the most fetched to reach a limit
+    _PAGE_WORKERS = 4
+    _MAX_PAGES = 50
+    # download links resolved at once by export_links
+    _RESOLVE_WORKERS = 16
+
+    def __init__(
+        self,
+        instance: str | list | tuple | None = None,
+        session: requests.Session | None = None,
+        limiter=None,
+        limit_rate: int | None = None,
+        resolve_cache=None,
+        miss_cache=None,
+        buffer_size: int | None = None,
+        fsync: bool | None = None,
+        progress=None,
+    ):
+        self.instances = self._resolve_instances(instance)
+        # instance -> monotonic time until which it is ranked after the others
+        self._demoted = {}
+        self._demoted_lock = threading.Lock()
+        # a shared Session keeps connection pools warm between calls
+        self._session = session
+        # per-host limits are shared by every instance in the process
+        self._limiter = limiter or default_limiter()
+        # bytes per second for each download, like curl's --limit-rate
+        if limit_rate is None:
+            limit_rate = load_config("bandwidth").get("limit_rate")
+            limit_rate = parse_size(limit_rate) if limit_rate else None
+        self.limit_rate = limit_rate
+        # bytes of a download held in memory while the disk catches up, and
+        # whether finished files are flushed to disk, see FileWriter
+        download = load_config("download")
+        if buffer_size is None:
+            buffer_size = download.get("buffer_size", DEFAULT_BUFFER_SIZE)
+            buffer_size = parse_size(buffer_size)
+        self.buffer_size = buffer_size
+        self.fsync = download.get("fsync", False) if fsync is None else fsync
+        # Progress that downloads report to, None to download silently
+        self.progress = progress
+        # ResolutionCache of libgen download URLs, None to always resolve
+        self._resolve_cache = resolve_cache
+        # MissCache of empty search pages and dead download URLs, None to retry
+        self._miss_cache = miss_cache
+        # concurrent fetches of the same page share one request and parse
+        self._flights = SingleFlight()
+
+    @classmethod
+    def _resolve_instances(cls, instance) -> list:
+        """Ranked list of Anna's Archive instances to try, best first
+
+        Instances can be keys of _ANNAS_URLS or base URLs of a self-hosted
+        mirror or caching proxy. They come from the `instance` argument,
+        then GETDAT_INSTANCE (comma or space separated), then `instances`
+        in the [ebook] table of the config file.
+        """
+        if not instance:
+            instance = os.environ.get("GETDAT_INSTANCE", "").replace(",", " ").split()
+        if not instance:
+            instance = load_config("ebook").get("instances", [])
+        if isinstance(instance, str):
+            instance = [instance]
+        instances = [
+            i for i in instance if i in cls._ANNAS_URLS.keys() or cls._is_url(i)
+        ]
+        return instances or [cls._ANNAS_ORG_URL]
+
+    @property
+    def instance(self) -> str:
+        """The best ranked instance that has not failed to connect lately"""
+        now = time.monotonic()
+        with self._demoted_lock:
+            for instance in self.instances:
+                if self._demoted.get(instance, 0) <= now:
+                    return instance
+        return self.instances[0]
+
+    def _instance_url(self, instance: str | None = None) -> str:
+        instance = instance or self.instance
+        return self._ANNAS_URLS.get(instance, instance).rstrip("/")
+
+    def _fallback_url(self, url: str) -> str | None:
+        """`url` on the instance ranked after the one that failed to serve it
+
+        The failed instance is demoted for _DEMOTE_SECONDS, so new requests
+        start on the next one and go back to it once that time is up. The
+        fallback is worked out from `url` alone, so concurrent requests
+        each walk the ranking on their own. None when `url` is not on an
+        instance or there is none left to try.
+        """
+        for idx, instance in enumerate(self.instances):
+            instance_url = self._instance_url(instance)
+            if url == instance_url or url.startswith(f"{instance_url}/"):
+                break
+        else:
+            return None
+        with self._demoted_lock:
+            self._demoted[instance] = time.monotonic() + self._DEMOTE_SECONDS
+        if idx + 1 >= len(self.instances):
+            return None
+        return f"{self._instance_url(self.instances[idx + 1])}{url[len(instance_url):]}"
+
+    @staticmethod
+    def _is_url(value) -> bool:
+        return isinstance(value, str) and value.startswith(("https://", "http://"))
+
+    def _source(self, name: str) -> dict | None:
+        source = self._SOURCE_DICT.get(name)
+        if name == self._SOURCE_ANNAS:
+            # copy so the shared _SOURCE_DICT never holds this instance's url
+            source = {**source, "url": self._instance_url()}
+        return source
+
+    def _absolute_link(self, link: str) -> str:
+        if self._is_url(link):
+            return link
+        return f"{self._instance_url()}{link}"
+
+    @staticmethod
+    def _md5(link: str) -> str | None:
+        match = re.search(r"[0-9a-f]{32}", link or "")
+        return match[0] if match else None
+
+    @staticmethod
+    def _lang_tag(tag: str) -> str:
+        """Conventional case of a language tag, ex: zh-hant -> zh-Hant"""
+        subtags = tag.lower().split("-")
+        for idx, subtag in enumerate(subtags[1:], 1):
+            if len(subtag) == 4 and subtag.isalpha():
+                subtags[idx] = subtag.title()
+            elif len(subtag) == 2 or (len(subtag) == 3 and subtag.isdigit()):
+                subtags[idx] = subtag.upper()
+        return "-".join(subtags)
+
+    def _search_query(self, q: str, params: dict, page: int = 1) -> str:
+        """Canonical query string of a search
+
+        Whitespace in `q` is collapsed. Filters are trimmed, lowercased
+        (language tags get their conventional case), dropped when unknown,
+        deduplicated and sorted, and keys come in alphabetical order, so
+        the same search always gives the same URL for caches to key on.
+        Filter values are comma separated strings or lists.
+        """
+        query = [("q", " ".join(str(q).split()))]
+        for key in sorted(params):
+            value = params[key] or ""
+            if isinstance(value, (list, tuple)):
+                value = ",".join(value)
+            values = set()
+            for v in str(value).split(","):
+                v = v.strip().lower()
+                match key:
+                    case "ext":
+                        if v in self._FILE_EXT:
+                            values.add(v)
+                    case "content":
+                        if v in self._CONTENT_OPTIONS.keys():
+                            values.add(self._CONTENT_OPTIONS.get(v).get("value"))
+                    case "lang":
+                        if v:
+                            values.add(self._lang_tag(v))
+                    case _:
+                        if v:
+                            values.add(v)
+            query += [(key, v) for v in sorted(values)]
+        if page > 1:
+            query.append(("page", page))
+        return urlencode(query)
+
+    def _search_url(self, q: str, params: dict, page: int = 1) -> str:
+        return f"{self._instance_url()}/search?{self._search_query(q, params, page)}"
+
+    def _page_count(self, page_size: int, found: int, pages=None, limit=None) -> int:
+        """How many result pages to fetch after the first
+
+        `page_size` is the number of results on the first page and `found`
+        the number of results so far. Without `pages`, pages are fetched
+        until `limit` results are found, up to _MAX_PAGES.
+        """
+        if not page_size:
+            return 0
+        count = (pages or (self._MAX_PAGES if limit else 1)) - 1
+        if limit:
+            count = min(count, math.ceil(max(limit - found, 0) / page_size))
+        return max(count, 0)
+
+    @staticmethod
+    def _map(func, items, workers: int) -> list:
+        """Call `func(item)` for each of `items`, up to `workers` at once
+
+        Results are in the order of `items`.
+        """
+        items = list(items)
+        if len(items) <= 1 or workers <= 1:
+            return [func(item) for item in items]
+        with ThreadPoolExecutor(max_workers=min(len(items), workers)) as executor:
+            return list(executor.map(func, items))
+
+    def _on_fallback(self, url: str):
+        """Called before `url` is retried on the next ranked instance"""
+
+    def _request(
+        self, url: str, stream: bool = False, headers: dict | None = None
+    ) -> Response:
+        """GET `url` within the per-host limits of the rate limiter
+
+        A host answering 429 or 503 is backed off from and the request is
+        retried, up to _BACKOFF_RETRIES times. Connection errors on an
+        Anna's Archive instance fall back to the next ranked instance, see
+        _fallback_url.
+
+        Pages, requests that are not streamed and have no extra headers,
+        are coalesced: callers asking for a URL that is already being
+        fetched wait for that response and share it.
+        """
+        if stream or headers:
+            return self._send(url, stream, headers)
+        return self._flights.do(("get", url), lambda: self._send(url))
+
+    def _send(
+        self, url: str, stream: bool = False, headers: dict | None = None
+    ) -> Response:
+        retries = self._BACKOFF_RETRIES
+        while True:
+            host = self._limiter.for_host(urlparse(url).hostname or "")
+            try:
+                with host.slot():
+                    response = (self._session or requests).get(
+                        url, stream=stream, headers=headers
+                    )
+            except (ConnectionError, ChunkedEncodingError):
+                url = self._fallback_url(url)
+                if not url:
+                    raise
+                self._on_fallback(url)
+                continue
+            if host.observe(response) and retries:
+                retries -= 1
+                response.close()
+                continue
+            return response
+
+    def _scrape(
+        self,
+        content,
+        scrape_key: str,
+        source_name: str,
+        url: str,
+        encoding: str | None = None,
+    ) -> dict:
+        """Scrape `content`, the raw bytes of a page, with a compiled rule
+
+        `encoding` is the page's charset from the response headers, see
+        _charset. Without one the parser sniffs the encoding.
+        """
+        results = dict()
+        rule = self._SCRAPE_RULES.get((source_name, scrape_key))
+        if rule:
+            for value, title, link in rule.scrape(content, encoding):
+                results[str(value)] = {"title": title, "link": link, "value": value}
+        results["0"] = {"title": self._browser, "link": url, "value": 0}
+        return results
+
+    def _fetch_scrape(self, url: str, scrape_key: str, source_name: str) -> dict:
+        """Fetch `url` and scrape it
+
+        Identical calls made while one is in flight wait for it and share
+        its results instead of fetching and parsing the page again. Each
+        caller gets its own copy of the results. Pages known to have no
+        results are not fetched at all, see _remember_empty.
+        """
+
+        def fetch() -> dict:
+            if self._cached_miss(url):
+                return {"0": {"title": self._browser, "link": url, "value": 0}}
+            response = self._request(url)
+            results = self._scrape(
+                response.content,
+                scrape_key,
+                source_name,
+                response.url,
+                self._charset(response),
+            )
+            self._remember_empty(url, response, results)
+            return results
+
+        results = self._flights.do(("scrape", url, scrape_key, source_name), fetch)
+        return {key: dict(result) for key, result in results.items()}
+
+    @staticmethod
+    def _total_size(response: Response) -> int | None:
+        """Size of the whole file from Content-Range or Content-Length"""
+        total = (response.headers.get("Content-Range") or "").rpartition("/")[2]
+        if response.status_code == 206 and total.isdigit():
+            return int(total)
+        if response.status_code == 200 and response.headers.get("Content-Length"):
+            return int(response.headers["Content-Length"])
+        return None
+
+    @staticmethod
+    def _charset(response: Response) -> str | None:
+        """The charset declared in the Content-Type header, if any
+
+        Unlike response.encoding this does not fall back to ISO-8859-1 for
+        text/html without a charset, which would override a <meta> charset.
+        """
+        content_type = response.headers.get("Content-Type") or ""
+        match = re.search(r"charset=[\"']?([\w.:-]+)", content_type, re.IGNORECASE)
+        return match[1] if match else None
+
+    def _is_html(self, response: Response) -> bool:
+        content_type = response.headers.get("Content-Type") or ""
+        return content_type.split(";")[0].strip() == self._HTML_CONTENT_TYPE
+
+    def _is_direct(self, title: str) -> bool:
+        """Whether a detail page link can be downloaded without a browser"""
+        return not any(
+            browser_only in (title or "")
+            for browser_only in (
+                *self._MEMBER_LOGIN_REQUIRED,
+                self._SLOW_PARTNER_SERVER,
+            )
+        )
+
+    def _libgen_source(self, title: str) -> str | None:
+        for libgen in self._LIBGEN_EXTERNAL:
+            if libgen in (title or ""):
+                return libgen
+        return None
+
+    @classmethod
+    def _filename(cls, resource_name: str, url: str = "") -> str:
+        """File name for a search result title: "lang, ext, size, name"
+
+        Falls back to the last segment of `url`, or the md5 in `url` for
+        script links like libgen's get.php, for other titles. A get.php
+        link whose key= is a file path gets that path's extension.
+
+        Titles and URLs come from the mirrors, so path separators in the
+        name are replaced and the file stays in the directory it is saved to.
+        """
+        parts = (resource_name or "").split(", ", 3)
+        if len(parts) == 4:
+            name, ext = parts[-1], parts[1].strip()
+            if f".{ext}" not in name:
+                name = f"{name}.{ext}"
+        else:
+            parsed = urlparse(url)
+            name = unquote(parsed.path.rsplit("/", 1)[-1])
+            if not name or name.endswith(".php"):
+                key = parse_qs(parsed.query).get("key", [""])[0]
+                ext = os.path.splitext(key.rsplit("/", 1)[-1])[1]
+                name = f"{cls._md5(url) or 'download'}{ext}"
+        name = name.replace("/", "_").replace(os.sep, "_")
+        return name if name.strip(".") else "download"
+
+    @staticmethod
+    def _content_ext(response: Response) -> str:
+        """The file extension for the response's Content-Type, "" if unknown"""
+        content_type = (response.headers.get("Content-Type") or "").split(";")[0]
+        ext = mimetypes.guess_extension(content_type.strip())
+        return ext if ext and ext != ".bin" else ""
+
+    @classmethod
+    def _expected_ext(cls, resource_name: str) -> str | None:
+        """The ext of a search result title: lang, ext, size, name"""
+        parts = (resource_name or "").split(", ", 3)
+        return parts[1].strip().lower() if len(parts) == 4 else None
+
+    @classmethod
+    def _sniff(cls, head: bytes, ext: str | None = None) -> str | None:
+        """What is wrong with a download starting with `head`, if anything
+
+        HTML is never a download. When the expected `ext` is known the
+        file must start with its magic bytes. A PDF may have up to 1K of
+        junk before its header.
+        """
+        start = head.lstrip(b"\xef\xbb\xbf \t\r\n")[:32].lower()
+        if start.startswith(cls._HTML_MAGIC):
+            return "an HTML page"
+        if ext not in cls._MAGIC:
+            return None
+        offset, magic = cls._MAGIC[ext]
+        if ext == cls._PDF:
+            found = magic in head[:1024]
+        else:
+            found = head[offset : offset + len(magic)] == magic
+        return None if found else f"not the expected {ext} file"
+
+    def _write(
+        self, response: Response, path: str, mode: str = "wb", ext: str | None = None
+    ):
+        """Stream `response` to `path` within limit_rate and the shared budget
+
+        A new file's first _SNIFF_SIZE bytes are checked with _sniff before
+        `path` is opened. A mismatch closes the response and raises
+        DownloadError, so no more of it is downloaded and nothing is written.
+
+        Chunks are written to disk by a FileWriter thread, up to buffer_size
+        bytes behind the network, and fsynced at the end if fsync is set.
+        Each chunk is reported to self.progress, if set.
+        """
+        chunk_size = self._CHUNK_SIZE
+        buckets = [self._limiter.bandwidth]
+        if self.limit_rate:
+            buckets.append(TokenBucket(self.limit_rate))
+            # smaller chunks keep a slow transfer smooth
+            chunk_size = min(chunk_size, max(self.limit_rate // 8, 1024))
+        buckets = [bucket for bucket in buckets if bucket]
+        transfer = None
+        if self.progress:
+            offset = os.path.getsize(path) if mode == "ab" else 0
+            transfer = self.progress.start(
+                os.path.basename(path).removesuffix(".part"),
+                urlparse(response.url).hostname,
+                self._total_size(response),
+                offset,
+            )
+
+        def received(chunks):
+            for chunk in chunks:
+                for bucket in buckets:
+                    bucket.acquire(len(chunk))
+                if transfer:
+                    self.progress.update(transfer, len(chunk))
+                yield chunk
+
+        chunks = received(response.iter_content(chunk_size=chunk_size))
+        try:
+            head = b""
+            if mode == "wb":
+                for chunk in chunks:
+                    head += chunk
+                    if len(head) >= self._SNIFF_SIZE:
+                        break
+                problem = self._sniff(head, ext)
+                if problem:
+                    response.close()
+                    raise DownloadError(f"Download from {response.url} is {problem}")
+            with (
+                open(path, mode) as f,
+                FileWriter(f, self.buffer_size, self.fsync) as writer,
+            ):
+                writer.write(head)
+                for chunk in chunks:
+                    writer.write(chunk)
+        except BaseException as e:
+            if transfer:
+                self.progress.finish(transfer, e)
+            raise
+        if transfer:
+            self.progress.finish(transfer)
+
+    def search(
+        self,
+        q: str,
+        ext: str | None = None,
+        lang: str | None = None,
+        content: str | None = None,
+        sort: str | None = None,
+        pages: int | None = None,
+        limit: int | None = None,
+    ) -> list:
+        """Search Anna's Archive and return its results in page order
+
+        Filters take the same values as the ebook command's options, comma
+        separated or as lists. Each result is a dict with title, link, md5
+        and value.
+
+        Only the first result page is fetched unless `pages` or `limit` is
+        given. Further pages are fetched concurrently and merged, dropping
+        results repeated across pages, and `limit` caps the results returned.
+        """
+        params = {"ext": ext, "lang": lang, "content": content, "sort": sort}
+        results = self._search_page(q, params)
+        count = self._page_count(len(results), len(results), pages, limit)
+        fetch = functools.partial(self._search_page, q, params)
+        for page_results in self._map(fetch, range(2, 2 + count), self._PAGE_WORKERS):
+            if not page_results:
+                break
+            results += page_results
+        merged = {}
+        for result in results:
+            merged.setdefault(result["md5"] or result["link"], result)
+        results = list(merged.values())[:limit]
+        return [{**result, "value": idx + 1} for idx, result in enumerate(results)]
+
+    def _search_page(self, q: str, params: dict, page: int = 1) -> list:
+        results = self._fetch_scrape(
+            self._search_url(q, params, page), "search_page_scrape", self._SOURCE_ANNAS
+        )
+        return [
+            {**result, "md5": self._md5(result.get("link"))}
+            for key, result in results.items()
+            if key != "0"
+        ]
+
+    def links(self, md5: str) -> list:
+        """Download links listed on the /md5/ detail page of `md5`
+
+        Each link is a dict with title, an absolute link, value and
+        `direct`, which is False for links that need a member login or
+        browser verification.
+        """
+        results = self._fetch_scrape(
+            self._absolute_link(f"/md5/{md5}"), "detail_page_scrape", self._SOURCE_ANNAS
+        )
+        return [
+            {
+                **result,
+                "link": self._absolute_link(result.get("link")),
+                "direct": self._is_direct(result.get("title")),
+            }
+            for key, result in results.items()
+            if key != "0"
+        ]
+
+    def _cached_miss(self, url: str) -> str | None:
+        """Why `url` had no results or failed to download, if it did lately"""
+        return self._miss_cache.get(url) if self._miss_cache else None
+
+    def _remember_miss(self, url: str, reason: str, status: int | None = None):
+        # throttling and server errors tend to pass, so they are retried
+        if self._miss_cache and status != 429 and (status or 0) < 500:
+            self._miss_cache.set(url, reason)
+
+    def _remember_empty(self, url: str, response: Response, results: dict):
+        """Remember a page that loaded fine but had nothing to scrape"""
+        if self._miss_cache and response.status_code == 200 and len(results) == 1:
+            self._remember_miss(url, "No results")
+
+    def _resolution_key(self, link: str, title: str) -> tuple | None:
+        libgen = self._libgen_source(title)
+        if not (libgen and self._resolve_cache):
+            return None
+        return (self._md5(link) or link, libgen)
+
+    def _cached_resolution(self, link: str, title: str) -> str | None:
+        key = self._resolution_key(link, title)
+        return self._resolve_cache.get(*key) if key else None
+
+    def _remember_resolution(self, link: str, title: str, url: str):
+        key = self._resolution_key(link, title)
+        if key:
+            self._resolve_cache.set(*key, url)
+
+    def _forget_resolution(self, link: str, title: str):
+        key = self._resolution_key(link, title)
+        if key:
+            self._resolve_cache.invalidate(*key)
+
+    def resolve(self, link: str, title: str = "") -> str:
+        """Final download URL for a detail page link titled `title`
+
+        Libgen links are followed through the mirror's page to its `GET`
+        anchor, or taken from the resolve cache. Other links are returned
+        unchanged. Concurrent resolutions of one link share a request.
+        """
+        libgen = self._libgen_source(title)
+        if not libgen:
+            return link
+        cached = self._cached_resolution(link, title)
+        if cached:
+            return cached
+        return self._flights.do(
+            ("resolve", link, title), lambda: self._resolve_libgen(link, title, libgen)
+        )
+
+    def _resolve_libgen(self, link: str, title: str, libgen: str) -> str:
+        if self._cached_miss(link):
+            raise DownloadError(f"Direct Download Not Available from {title}")
+        response = self._request(link)
+        if response.status_code != 200 or not self._is_html(response):
+            self._remember_miss(
+                link, f"HTTP {response.status_code}", response.status_code
+            )
+            raise DownloadError(f"Direct Download Not Available from {title}")
+        results = self._scrape(
+            response.content,
+            "download_page_scrape",
+            libgen,
+            response.url,
+            self._charset(response),
+        )
+        # "0" is the page itself, for the browser
+        get_links = [result["link"] for key, result in results.items() if key != "0"]
+        if not get_links:
+            self._remember_miss(link, "No GET link")
+            raise DownloadError(f"Direct Download Not Available from {title}")
+        get_link = get_links[0]
+        if libgen == self._LIBGEN_LI and not self._is_url(get_link):
+            get_link = f"{self._source(libgen).get('url')}{get_link}"
+        self._remember_resolution(link, title, get_link)
+        return get_link
+
+    def resolve_md5(self, md5: str, resource_name: str = "") -> dict | None:
+        """The first direct link of `md5` that resolves to a download URL
+
+        Returns a dict with the md5, the link's title, the final url and
+        filename, the name fetch gives the file for `resource_name`, or
+        None when no direct link resolves. A filename without an extension
+        gets one from the Content-Type of a one byte ranged GET, like
+        fetch does, and is None when the Content-Type is unknown.
+        """
+        try:
+            links = self.links(md5)
+        except (ConnectionError, ChunkedEncodingError):
+            return None
+        for link in links:
+            if not link["direct"]:
+                continue
+            try:
+                url = self.resolve(link["link"], link["title"])
+            except (DownloadError, ConnectionError, ChunkedEncodingError):
+                continue
+            filename = self._filename(resource_name, url)
+            if not os.path.splitext(filename)[1]:
+                filename = self._typed_filename(filename, url)
+            return {
+                "md5": md5,
+                "title": link["title"],
+                "url": url,
+                "filename": filename,
+            }
+        return None
+
+    def _typed_filename(self, filename: str, url: str) -> str | None:
+        """`filename` with the extension of `url`'s Content-Type, if known"""
+        try:
+            response = self._request(url, stream=True, headers={"Range": "bytes=0-0"})
+        except (ConnectionError, ChunkedEncodingError):
+            return None
+        with response:
+            if response.status_code not in (200, 206) or self._is_html(response):
+                return None
+            ext = self._content_ext(response)
+        return f"{filename}{ext}" if ext else None
+
+    def probe(self, link: str, title: str = "", resource_name: str = "") -> dict:
+        """Resolve a detail page link and time a ranged GET of its first bytes
+
+        Returns a dict with the link, title and resolved url, plus:
+        - ttfb: seconds until the response headers arrived
+        - throughput: bytes per second over the first _PROBE_SIZE bytes
+        - size: the file's size from Content-Range or Content-Length
+        - ranges: whether the server accepts Range requests
+        - expected: estimated seconds for the whole download
+        - error: why the link cannot be downloaded, None if it can
+
+        The probed bytes are sniffed, so links serving an HTML page or the
+        wrong format for `resource_name` fail the probe.
+        """
+        probe = {"link": link, "title": title, "url": None, "ttfb": None}
+        probe.update(throughput=None, size=None, ranges=False, expected=None)
+        try:
+            probe["url"] = self.resolve(link, title)
+            missed = self._cached_miss(probe["url"])
+            if missed:
+                return {**probe, "error": missed}
+            response = self._request(
+                probe["url"],
+                stream=True,
+                headers={"Range": f"bytes=0-{self._PROBE_SIZE - 1}"},
+            )
+        except (DownloadError, ConnectionError, ChunkedEncodingError) as e:
+            return {**probe, "error": str(e) or type(e).__name__}
+        probe["ttfb"] = response.elapsed.total_seconds()
+        head = b""
+        with response:
+            if response.status_code not in (200, 206):
+                error = f"HTTP {response.status_code}"
+                self._remember_miss(probe["url"], error, response.status_code)
+                return {**probe, "error": error}
+            start = time.perf_counter()
+            try:
+                for chunk in response.iter_content(chunk_size=16 * 1024):
+                    head += chunk
+                    if len(head) >= self._PROBE_SIZE:
+                        break
+            except (ConnectionError, ChunkedEncodingError) as e:
+                return {**probe, "error": str(e) or type(e).__name__}
+            elapsed = time.perf_counter() - start
+        problem = self._sniff(head, self._expected_ext(resource_name))
+        if problem:
+            return {**probe, "error": f"Download is {problem}"}
+        probe["size"] = self._total_size(response)
+        probe["ranges"] = response.status_code == 206 or (
+            response.headers.get("Accept-Ranges") == "bytes"
+        )
+        probe["throughput"] = len(head) / max(elapsed, 1e-6)
+        remaining = max((probe["size"] or len(head)) - len(head), 0)
+        probe["expected"] = probe["ttfb"] + elapsed + remaining / probe["throughput"]
+        return {**probe, "error": None}
+
+    def rank(self, links: list, resource_name: str = "") -> list:
+        """Probe `links`, dicts with link and title, concurrently
+
+        Returns each link updated with its probe, fastest expected download
+        first and failed probes last.
+        """
+        if not links:
+            return []
+
+        def probe(link):
+            return {**link, **self.probe(link["link"], link["title"], resource_name)}
+
+        with ThreadPoolExecutor(max_workers=len(links)) as executor:
+            probes = list(executor.map(probe, links))
+        return sorted(
+            probes,
+            key=lambda probe: (probe["error"] is not None, probe["expected"] or 0),
+        )
+
+    def fetch(
+        self, link: str, dest: str, title: str = "", resource_name: str = ""
+    ) -> str:
+        """Download a detail page link to `dest` and return the path written
+
+        `dest` is a file path or a directory. Files written to a directory
+        are named after `resource_name`, a search result title, the same
+        way the ebook command names them. Files without an extension get
+        one from the response's Content-Type.
+
+        Bytes are written to `<path>.part` first. If a `.part` file is left
+        over from an interrupted download, only the missing bytes are
+        requested when the server supports Range requests.
+
+        A libgen URL from the resolve cache that fails to download is
+        dropped and the link is resolved again.
+        """
+        cached = self._cached_resolution(link, title)
+        try:
+            return self._fetch(self._resolve(link, title), dest, title, resource_name)
+        except DownloadError:
+            if not cached:
+                raise
+            self._forget_resolution(link, title)
+            return self._fetch(self._resolve(link, title), dest, title, resource_name)
+
+    def _resolve(self, link: str, title: str) -> str:
+        try:
+            return self.resolve(link, title)
+        except (ConnectionError, ChunkedEncodingError) as e:
+            raise DownloadError(f"Direct Download Not Available from {title}") from e
+
+    def _fetch(self, url: str, dest: str, title: str, resource_name: str) -> str:
+        if self._cached_miss(url):
+            raise DownloadError(f"Direct Download Not Available from {title}")
+        try:
+            path = os.path.expanduser(dest)
+            if os.path.isdir(path):
+                path = os.path.join(path, self._filename(resource_name, url))
+            part = f"{path}.part"
+            offset = os.path.getsize(part) if os.path.exists(part) else 0
+            headers = {"Range": f"bytes={offset}-"} if offset else None
+            response = self._request(url, stream=True, headers=headers)
+        except (ConnectionError, ChunkedEncodingError) as e:
+            raise DownloadError(f"Direct Download Not Available from {title}") from e
+        if response.status_code == 416 and offset:
+            # the .part file already holds every byte
+            response.close()
+        elif response.status_code not in (200, 206) or self._is_html(response):
+            response.close()
+            if response.status_code in (200, 206):
+                self._remember_miss(url, "Download is an HTML page")
+            else:
+                self._remember_miss(
+                    url, f"HTTP {response.status_code}", response.status_code
+                )
+            raise DownloadError(f"Direct Download Not Available from {title}")
+        else:
+            try:
+                self._write(
+                    response,
+                    part,
+                    "ab" if response.status_code == 206 else "wb",
+                    self._expected_ext(resource_name),
+                )
+            except (ConnectionError, ChunkedEncodingError) as e:
+                raise DownloadError(f"Download from {title or url} interrupted") from e
+        if not os.path.splitext(path)[1]:
+            path = f"{path}{self._content_ext(response)}"
+        os.replace(part, path)
+        return path
+
+
+class AnnasEbook(AnnasArchive):
+    """Search and download ebooks through Anna's Archive from the command line
+
+    The interactive click UI on top of AnnasArchive. Search filters, the
+    selected result, the current source and scrape key are per-instance
+    state and class attributes are read-only, so separate AnnasEbook
+    instances share no mutable state and can run searches in parallel
+    threads within one process. A single instance walks one search at a
+    time and should not be shared between threads.
+    """
+
+    _ENTRY_NOT_DISPLAYED = "Entry information could not be displayed"
+    _MORE_RESULTS = "More Results"
 
     def __init__(
         self,
@@ -119,18 +1004,53 @@ class AnnasEbook:
         content: str,
         sort: str,
         ext: str,
-        instance=_ANNAS_ORG_URL,
+        instance: str | list | tuple | None = None,
+        daemon=None,
+        limit_rate: int | None = None,
+        pages: int | None = None,
+        limit: int | None = None,
+        resolve_cache=None,
+        session: requests.Session | None = None,
+        fastest: bool = False,
+        miss_cache=None,
+        progressive: bool = False,
+        progress=None,
     ):
         self.q = " ".join(map(str, q))
         self.output_dir = output_dir or os.environ.get("GETDAT_BOOK_DIR")
-        self._search_params["ext"] = ext
-        self._search_params["lang"] = lang
-        self._search_params["content"] = content
-        self._search_params["sort"] = sort
-        if instance in self._ANNAS_URLS.keys():
-            self.instance = instance
-        else:
-            self.instance = self._ANNAS_ORG_URL
+        self._search_params = {
+            "ext": ext,
+            "lang": lang,
+            "content": content,
+            "sort": sort,
+        }
+        self._current_source = self._SOURCE_ANNAS
+        self._scrape_key = "search_page_scrape"
+        self._selected_result = {}
+        self._msg = "Searching Anna's Archive..."
+        self._resource_name = ""
+        # search result pages merged so far, see _fetch_search_results
+        self._pages = pages
+        self._limit = limit
+        self._page = 0
+        self._search_results = {}
+        self._search_browser = None
+        self._search_done = False
+        # DaemonClient of a running `getdat serve` that pages are fetched through
+        self._daemon = daemon
+        # pick the download link that probes fastest instead of prompting
+        self._fastest = fastest
+        # print search results as the first page downloads, see _echo_streamed
+        self._progressive = progressive
+        self._echoed = set()
+        super().__init__(
+            instance=instance,
+            session=session,
+            limit_rate=limit_rate,
+            resolve_cache=resolve_cache,
+            miss_cache=miss_cache,
+            progress=progress,
+        )
 
     @staticmethod
     def _cli_exit(code=0):
@@ -138,11 +1058,7 @@ class AnnasEbook:
         ctx.exit(code)
 
     def _determine_source(self) -> dict:
-        source = self._SOURCE_DICT.get(self._current_source)
-        if self._current_source == self._SOURCE_ANNAS:
-            annas_url = self._ANNAS_URLS.get(self.instance)
-            source.update({"url": annas_url})
-        return source
+        return self._source(self._current_source)
 
     def _determine_link(self) -> str:
         source = self._determine_source()
@@ -159,37 +1075,32 @@ class AnnasEbook:
         link = kwargs.get("link")
         if link:
             return link
-        source = self._determine_source()
-        url = source.get("url")
         match self._scrape_key:
             case "search_page_scrape":
-                search = f"/search?q={self.q}"
-                for key, value in self._search_params.items():
-                    if value:
-                        value_list = value.split(",")
-                        for v in value_list:
-                            match key:
-                                case "ext":
-                                    if v in self._FILE_EXT:
-                                        search += f"&{key}={v}"
-                                case "content":
-                                    if v in self._CONTENT_OPTIONS.keys():
-                                        search_value = self._CONTENT_OPTIONS.get(v).get(
-                                            "value"
-                                        )
-                                        search += f"&{key}={search_value}"
-                                case _:
-                                    search += f"&{key}={v}"
-                return f"{url}{search}"
+                return self._search_url(
+                    self.q, self._search_params, kwargs.get("page", 1)
+                )
             case _:
                 return self._determine_link()
 
-    def _get(self, *args, **kwargs):
+    def _on_fallback(self, url: str):
+        parsed = urlparse(url)
+        click.echo(
+            click.style(
+                f"No connection established. Trying {parsed.scheme}://{parsed.netloc}",
+                fg="bright_yellow",
+            )
+        )
+
+    def _echo_msg(self):
         if self._msg:
             click.echo(click.style(f"\n{self._msg}", fg="bright_yellow"))
             click.echo("")
+
+    def _get(self, *args, stream=False, **kwargs):
+        self._echo_msg()
         try:
-            response = requests.get(self._get_url(*args, **kwargs))
+            response = self._request(self._get_url(*args, **kwargs), stream=stream)
         except (ConnectionError, ChunkedEncodingError) as e:
             click.echo(click.style("No connection established", fg="bright_red"))
             raise e
@@ -197,45 +1108,128 @@ class AnnasEbook:
             return response
 
     def _scrape_results(self, response: Response) -> dict:
-        soup = BeautifulSoup(response.content, "html.parser")
-        source = self._determine_source()
-        scrape = source.get(self._scrape_key, {})
-        tag = scrape.get("tag", "")
-        tag_class = scrape.get("class", "")
-        results = dict()
-        match self._scrape_key:
-            case "search_page_scrape":
-                title_container = scrape.get("title_container")
-                tag_title_container = title_container.get("tag")
-                class_title_container = title_container.get("class")
-                for idx, el in enumerate(soup.find_all(tag, class_=tag_class)):
-                    title = el.find(
-                        tag_title_container, class_=class_title_container
-                    ).string
-                    results[str(idx + 1)] = {
-                        "title": title,
-                        "link": el["href"],
-                        "value": idx + 1,
-                    }
-            case "detail_page_scrape":
-                for idx, el in enumerate(soup.find_all(tag, class_=tag_class)):
-                    if el.string != "Bulk torrent downloads":
-                        results[str(idx + 1)] = {
-                            "title": el.string,
-                            "link": el["href"],
-                            "value": idx + 1,
-                        }
-            case "download_page_scrape":
-                for idx, el in enumerate(soup.find_all(tag)):
-                    # libgen pages
-                    if el.string == "GET":
-                        # should only be 1 entry
-                        results[str(idx + 1)] = {
-                            "title": el.string,
-                            "link": el["href"],
-                            "value": idx + 1,
-                        }
+        return self._scrape(
+            response.content,
+            self._scrape_key,
+            self._current_source,
+            response.url,
+            self._charset(response),
+        )
+
+    def _fetch_results(self, *args, on_result=None, **kwargs) -> dict:
+        """Fetch and scrape the current page, through the daemon if one is running
+
+        Falls back to fetching the page in this process if the daemon
+        cannot be reached. Search pages known to have no results are not
+        fetched again. With `on_result` the page is fetched in this process
+        and scraped while it downloads, see _stream_results.
+        """
+        search = self._scrape_key == "search_page_scrape"
+        url = self._get_url(*args, **kwargs) if search else None
+        if search and self._cached_miss(url):
+            self._echo_msg()
+            return {"0": {"title": self._browser, "link": url, "value": 0}}
+        if self._daemon and not on_result:
+            url = self._get_url(*args, **kwargs)
+            try:
+                results = self._daemon.scrape(
+                    url, self._scrape_key, self._current_source
+                )
+            except DaemonError:
+                self._daemon = None
+            else:
+                self._echo_msg()
+                return results
+        if on_result:
+            response, results = self._stream_results(on_result, *args, **kwargs)
+        else:
+            response = self._get(*args, **kwargs)
+            results = self._scrape_results(response)
+        if search:
+            self._remember_empty(url, response, results)
+        return results
+
+    def _stream_results(self, on_result, *args, **kwargs) -> tuple:
+        """Fetch the current page and scrape it as it downloads
+
+        `on_result` is called with each result as soon as its element has
+        arrived. Returns the response and the results of the whole page.
+        """
+        response = self._get(*args, stream=True, **kwargs)
+        rule = self._SCRAPE_RULES.get((self._current_source, self._scrape_key))
+        scraper = PushScraper(rule, self._charset(response))
+        results = {}
+
+        def found(matches):
+            for value, title, link in matches:
+                results[str(value)] = {"title": title, "link": link, "value": value}
+                on_result(results[str(value)])
+
+        with response:
+            for chunk in response.iter_content(chunk_size=self._STREAM_CHUNK_SIZE):
+                found(scraper.feed(chunk))
+        found(scraper.close())
         results["0"] = {"title": self._browser, "link": response.url, "value": 0}
+        return response, results
+
+    def _fetch_search_results(self, *args, **kwargs) -> dict:
+        """Fetch search result pages and merge them into the results so far
+
+        The first call fetches `pages` pages, or enough pages for `limit`
+        results, fetching the pages after the first concurrently. Each
+        later call is made when More Results is selected and lazily
+        fetches the next page only. Results keep one numbering across
+        pages and a More Results entry follows while pages remain.
+        """
+        first = self._page + 1
+        on_result = (
+            self._echo_streamed if self._progressive and not self._page else None
+        )
+        pages = [self._fetch_results(*args, page=first, on_result=on_result, **kwargs)]
+        count = 0
+        if not self._page:
+            found = len(pages[0]) - 1
+            count = self._page_count(found, found, self._pages, self._limit)
+        if count:
+
+            def fetch(page):
+                return self._fetch_results(*args, page=page, **kwargs)
+
+            msg, self._msg = self._msg, ""
+            try:
+                pages += self._map(
+                    fetch, range(first + 1, first + 1 + count), self._PAGE_WORKERS
+                )
+            finally:
+                self._msg = msg
+        self._page = first + count
+        self._search_browser = self._search_browser or pages[0].get("0")
+        links = {result["link"] for result in self._search_results.values()}
+        for page_results in pages:
+            rows = [result for key, result in page_results.items() if key != "0"]
+            if not rows:
+                self._search_done = True
+                break
+            for result in rows:
+                if result["link"] in links:
+                    continue
+                links.add(result["link"])
+                value = len(self._search_results) + 1
+                self._search_results[str(value)] = {**result, "value": value}
+        if self._limit and len(self._search_results) >= self._limit:
+            self._search_done = True
+            self._search_results = dict(
+                list(self._search_results.items())[: self._limit]
+            )
+        results = {**self._search_results, "0": self._search_browser}
+        if self._search_results and not self._search_done:
+            value = len(self._search_results) + 1
+            results[str(value)] = {
+                "title": self._MORE_RESULTS,
+                "link": "",
+                "value": value,
+                "more": True,
+            }
         return results
 
     def _echo_formatted_title(self, key, title_str):
@@ -248,6 +1242,26 @@ class AnnasEbook:
             )
         return click.echo(f" {key} | {title} | {ext} | {size} | {lang}")
 
+    def _echo_streamed(self, result: dict):
+        """Number and print a result of the first search page as it arrives
+
+        It is merged into the search results the way _fetch_search_results
+        merges them, and _echo_results then prints only what is left.
+        """
+        links = {merged["link"] for merged in self._search_results.values()}
+        if result["link"] in links:
+            return
+        if self._limit and len(self._search_results) >= self._limit:
+            return
+        if not self._echoed:
+            click.echo(click.style("Search Results", fg="bright_cyan"))
+            click.echo(click.style("==============", fg="bright_cyan"))
+            click.echo("")
+        key = str(len(self._search_results) + 1)
+        self._search_results[key] = {**result, "value": int(key)}
+        self._echo_formatted_title(key, result["title"])
+        self._echoed.add(key)
+
     def _echo_results(self, results) -> bool:
         have_results = True
         if len(results.keys()) == 1:
@@ -257,15 +1271,21 @@ class AnnasEbook:
         if len(results.keys()) == 0:
             have_results = False
             return have_results
-        click.echo(click.style("Search Results", fg="bright_cyan"))
-        click.echo(click.style("==============", fg="bright_cyan"))
-        click.echo("")
+        echoed, self._echoed = self._echoed, set()
+        if not echoed:
+            click.echo(click.style("Search Results", fg="bright_cyan"))
+            click.echo(click.style("==============", fg="bright_cyan"))
+            click.echo("")
         for key in results.keys():
+            if key in echoed:
+                continue
             value = results.get(key)
             title = value.get("title")
             if key == "0":
                 click.echo("")
                 click.echo(click.style(f" {key} | {title}", blink=True))
+            elif value.get("more"):
+                click.echo(click.style(f" {key} | {title}", fg="bright_cyan"))
             elif self._scrape_key == "detail_page_scrape":
                 if any(
                     dl_partner in title for dl_partner in self._MEMBER_LOGIN_REQUIRED
@@ -286,114 +1306,359 @@ class AnnasEbook:
 
     def _scrape_page(self, *args, **kwargs):
         try:
-            response = self._get(*args, **kwargs)
+            if self._scrape_key == "search_page_scrape":
+                results = self._fetch_search_results(*args, **kwargs)
+            else:
+                results = self._fetch_results(*args, **kwargs)
         except (ConnectionError, ChunkedEncodingError):
             self._cli_exit(code=1)
         else:
-            results = self._scrape_results(response)
             have_results = self._echo_results(results)
             if have_results:
                 value = click.prompt(
                     "Select Number", type=click.IntRange(min=0, max=(len(results) - 1))
                 )
                 self._selected_result = results.get(str(value))
+                if self._selected_result.get("more"):
+                    self._msg = "Fetching More Results..."
+                    return self._scrape_page(*args, **kwargs)
                 selected_link = self._selected_result.get("link")
                 return value
             else:
                 self._cli_exit()
 
-    def _to_filesystem(self, response: Response):
+    def _to_filesystem(self, response: Response) -> bool:
         """Write file to filesystem if it does not already exists
 
-        Throws a FileNotFoundError if self.output_dir is not valid
+        Returns whether the file was written. Nothing is written when
+        self.output_dir is not valid or the download is not the expected
+        file, see _write. Bytes go to `<path>.part` first, like fetch, so
+        an interrupted download never lands under the file's name.
         """
-        resource_name = self._resource_name.split(", ", 3)[-1]
-        ext = self._resource_name.split(", ", 3)[1].strip()
-        if f".{ext}" not in resource_name:
-            resource_name = f"{resource_name}.{ext}"
+        resource_path = self._filename(self._resource_name, response.url)
         if self.output_dir:
             resource_path = os.path.join(
-                os.path.expanduser(self.output_dir), resource_name
+                os.path.expanduser(self.output_dir), resource_path
             )
-            try:
-                with open(resource_path, "wb") as f:
-                    f.write(response.content)
-            except FileNotFoundError as e:
-                click.echo(click.style("Download Unsuccessful", fg="bright_red"))
-                click.echo(click.style(f"{e}", fg="bright_red"))
-            else:
-                click.echo("Done 📚 🎆 🎇")
-                click.echo(resource_path)
-        else:
-            try:
-                with open(resource_name, "wb") as f:
-                    f.write(response.content)
-            except FileNotFoundError as e:
-                click.echo(click.style("Download Unsuccessful", fg="bright_red"))
-                click.echo(click.style(f"{e}", fg="bright_red"))
-            else:
-                click.echo("Done 📚 🎆 🎇")
-                click.echo(resource_name)
+        part = f"{resource_path}.part"
+        try:
+            self._write(response, part, ext=self._expected_ext(self._resource_name))
+        except FileNotFoundError as e:
+            click.echo(click.style("Download Unsuccessful", fg="bright_red"))
+            click.echo(click.style(f"{e}", fg="bright_red"))
+            return False
+        except DownloadError as e:
+            click.echo(click.style(f"{e}.\n Try Another Download Link", fg="red"))
+            return False
+        except (ConnectionError, ChunkedEncodingError):
+            response.close()
+            if os.path.exists(part):
+                os.remove(part)
+            click.echo(
+                click.style(
+                    f"Download from {response.url} interrupted.\n "
+                    "Try Another Download Link",
+                    fg="red",
+                )
+            )
+            return False
+        os.replace(part, resource_path)
+        click.echo("Done 📚 🎆 🎇")
+        click.echo(resource_path)
+        return True
 
-    def _download(self, title, *args, **kwargs):
+    def _download(self, title, *args, **kwargs) -> bool:
         try:
-            response = self._get(*args, **kwargs)
+            response = self._get(*args, stream=True, **kwargs)
         except (ConnectionError, ChunkedEncodingError):
-            return click.echo(
+            click.echo(
                 click.style(
                     f"Direct Download Not Available from {title}.\n Try Another Download Link",
                     fg="red",
                 )
             )
-        else:
-            self._to_filesystem(response)
+            return False
+        return self._to_filesystem(response)
 
-    def _dl_or_launch_page(self, *args, **kwargs):
+    def _download_cached(self, title, link, *args, **kwargs) -> bool:
+        """Download from the cached libgen URL for `link`, if it still works"""
+        url = self._cached_resolution(link, title)
+        if not url:
+            return False
+        msg, self._msg = self._msg, ""
+        try:
+            response = self._get(*args, stream=True, **{**kwargs, "link": url})
+        except (ConnectionError, ChunkedEncodingError):
+            response = None
+        finally:
+            self._msg = msg
+        if response is None or response.status_code != 200 or self._is_html(response):
+            # validated on use: a stale URL is dropped and resolved again
+            self._forget_resolution(link, title)
+            return False
+        if not self._to_filesystem(response):
+            # not the file after all, resolved again from the mirror's page
+            self._forget_resolution(link, title)
+            return False
+        return True
+
+    def _dl_or_launch_page(self, *args, **kwargs) -> bool | None:
+        """Download the selected link, or open it in the browser
+
+        Returns whether a file was downloaded, or None when the link was
+        handed to the browser.
+        """
         title = self._selected_result.get("title")
-        link = self._determine_link()
+        link = page_link = self._determine_link()
         self._msg = f"Talking to {title}..."
+        if self._download_cached(title, page_link, *args, **kwargs):
+            return True
+        unavailable = click.style(
+            f"Direct Download Not Available from {title}.\n Try Another Download Link",
+            fg="red",
+        )
+        if self._cached_miss(link):
+            click.echo(unavailable)
+            return False
+        if self._libgen_source(title):  # libgen
+            self._echo_msg()
+            try:
+                kwargs["link"] = self.resolve(page_link, title)
+            except (ConnectionError, ChunkedEncodingError):
+                click.echo(click.style("No connection established", fg="bright_red"))
+                click.launch(link)
+                return None
+            except DownloadError:
+                click.echo(unavailable)
+                return False
+            self._msg = ""
+            return self._download(title, *args, **kwargs)
 
         try:
-            response = self._get(*args, **kwargs)
+            response = self._get(*args, stream=True, **kwargs)
+        except (ConnectionError, ChunkedEncodingError):
+            click.launch(link)
+            return None
+        if response.status_code != 200:
+            response.close()
+            self._remember_miss(
+                link, f"HTTP {response.status_code}", response.status_code
+            )
+            click.echo(unavailable)
+            return False
+        if not self._is_html(response):  # ipfs
+            return self._to_filesystem(response)
+        response.close()
+        if self._IPFS_URI in link:
+            self._remember_miss(link, "Download is an HTML page")
+            click.echo(unavailable)
+            return False
+        click.launch(link)  # Browser Only Options
+        return None
+
+    def _echo_probes(self, probes: list):
+        click.echo(click.style("Download Links by Expected Time", fg="bright_cyan"))
+        click.echo(click.style("===============================", fg="bright_cyan"))
+        click.echo("")
+        for probe in probes:
+            key, title = probe["value"], probe["title"]
+            if probe["error"]:
+                click.echo(
+                    click.style(f" {key} | {title} | {probe['error']}", fg="red")
+                )
+                continue
+            size = format_size(probe["size"]) if probe["size"] else "size unknown"
+            resumable = " | resumable" if probe["ranges"] else ""
+            click.echo(
+                f" {key} | {title} | ~{probe['expected']:.1f}s | "
+                f"{format_size(probe['throughput'])}/s | "
+                f"TTFB {probe['ttfb'] * 1000:.0f}ms | {size}{resumable}"
+            )
+        click.echo("")
+
+    def _select_fastest(self, results: dict, failed=()) -> int | None:
+        """Probe the direct links of detail page `results` and select the fastest
+
+        Links whose value is in `failed` were already tried and are left
+        out. Returns the selected value, or None when no link responds.
+        """
+        links = [
+            {**result, "link": self._absolute_link(result.get("link"))}
+            for key, result in results.items()
+            if key != "0"
+            and self._is_direct(result.get("title"))
+            and result.get("value") not in failed
+        ]
+        probes = self.rank(links, self._resource_name)
+        if probes:
+            self._echo_probes(probes)
+        best = next((probe for probe in probes if probe["error"] is None), None)
+        if best is None:
+            click.echo(click.style("No direct download responded", fg="red"))
+            return None
+        # the resolved URL, so the libgen page is not fetched again
+        self._selected_result = {**results[str(best["value"])], "link": best["url"]}
+        return best["value"]
+
+    def _scrape_fastest(self, *args, failed=(), **kwargs) -> int | None:
+        try:
+            results = self._fetch_results(*args, **kwargs)
         except (ConnectionError, ChunkedEncodingError):
-            return click.launch(link)
+            self._cli_exit(code=1)
         else:
-            if response.status_code != 200:
-                return click.echo(
-                    click.style(
-                        f"Direct Download Not Available from {title}.\n Try Another Download Link",
-                        fg="red",
-                    )
+            return self._select_fastest(results, failed)
+
+    def _fetch_md5(self, md5: str) -> dict | None:
+        """Download links on the detail page of `md5`, None if unreachable
+
+        Safe to call from several threads at once: the page is scraped
+        with the detail page rule directly rather than the current state.
+        """
+        url = self._absolute_link(f"/md5/{md5}")
+        if self._daemon:
+            try:
+                return self._daemon.scrape(
+                    url, "detail_page_scrape", self._SOURCE_ANNAS
                 )
-            content_type = response.headers.get("Content-Type")
-            if content_type != self._HTML_CONTENT_TYPE:  # ipfs
-                self._to_filesystem(response)
-            elif content_type == self._HTML_CONTENT_TYPE and self._IPFS_URI in link:
-                return click.echo(
-                    click.style(
-                        f"Direct Download Not Available from {title}.\n Try Another Download Link",
-                        fg="red",
+            except DaemonError:
+                self._daemon = None
+        try:
+            return self._fetch_scrape(url, "detail_page_scrape", self._SOURCE_ANNAS)
+        except (ConnectionError, ChunkedEncodingError):
+            return None
+
+    def _md5_results(self, md5s):
+        """(md5, _fetch_md5 results) of each md5 as soon as it is fetched
+
+        Detail pages are fetched concurrently and yielded in the order they
+        finish. `md5s` is read in a thread of its own, so a stream such as
+        stdin is fetched while it is still being written.
+        """
+        finished = queue.Queue()
+        with ThreadPoolExecutor(self._PAGE_WORKERS) as pool:
+
+            def submit():
+                count = 0
+                try:
+                    for md5 in md5s:
+                        future = pool.submit(self._fetch_md5, md5)
+                        future.add_done_callback(
+                            lambda future, md5=md5: finished.put((md5, future))
+                        )
+                        count += 1
+                except RuntimeError:  # the pool was shut down, results unread
+                    pass
+                finally:
+                    finished.put((None, count))
+
+            threading.Thread(target=submit, daemon=True).start()
+            count, received = None, 0
+            while count is None or received < count:
+                md5, item = finished.get()
+                if md5 is None:
+                    count = item
+                    continue
+                received += 1
+                yield md5, item.result()
+
+    def run_md5(self, md5s, interactive: bool = True):
+        """Download links of known md5s, skipping the search page
+
+        The links of each md5 are shown as its detail page is fetched. When
+        `interactive` a download is selected for each md5 in turn while the
+        other pages are fetched in the background.
+        """
+        for md5, results in self._md5_results(md5s):
+            click.echo(click.style(f"md5: {md5}", fg="bright_cyan"))
+            if results is None:
+                click.echo(click.style("No connection established", fg="bright_red"))
+                continue
+            self._scrape_key = "detail_page_scrape"
+            if not self._echo_results(results) or not interactive:
+                continue
+            self._resource_name = ""
+            failed = []
+            while True:
+                value = self._select_fastest(results, failed) if self._fastest else None
+                if value is None:
+                    if failed:
+                        self._echo_results(results)
+                    value = click.prompt(
+                        "Select Number",
+                        type=click.IntRange(min=0, max=(len(results) - 1)),
                     )
+                    self._selected_result = results.get(str(value))
+                if value == 0:
+                    click.launch(self._selected_result.get("link"))
+                    break
+                self._current_source = self._SOURCE_ANNAS
+                self._scrape_key = ""
+                if self._dl_or_launch_page() is not False:
+                    break
+                # not the file, so on to the next fastest link or back to the list
+                failed.append(value)
+                self._scrape_key = "detail_page_scrape"
+
+    def _links_entry(self, entry: dict, links_format: str) -> str:
+        if links_format == "wget":
+            return f"{entry['url']}\n"
+        lines = [entry["url"]]
+        if entry["filename"]:
+            lines.append(f"  out={entry['filename']}")
+        if self.output_dir:
+            lines.append(f"  dir={os.path.expanduser(self.output_dir)}")
+        return "\n".join(lines) + "\n"
+
+    def export_links(
+        self,
+        file,
+        links_format: str = "aria2c",
+        md5s=None,
+        workers: int | None = None,
+    ):
+        """Write resolved download URLs to `file` instead of downloading
+
+        Items are the search results, or `md5s` when given. Each one is
+        resolved through its detail page and libgen's GET page, `workers`
+        at a time (_RESOLVE_WORKERS by default) within the per-host rate
+        limits, and written in input order as an aria2c input file, with
+        the file names downloads get where their extension is known, or as
+        a plain wget URL list.
+        """
+        if md5s is None:
+            click.echo(
+                click.style(f"Searching Anna's Archive: {self.q}", fg="bright_yellow"),
+                err=True,
+            )
+            results = self.search(
+                self.q, **self._search_params, pages=self._pages, limit=self._limit
+            )
+            items = [(result["md5"], result["title"]) for result in results]
+            items = [(md5, title) for md5, title in items if md5]
+        else:
+            items = [(md5, "") for md5 in md5s]
+        click.echo(
+            click.style(
+                f"Resolving {len(items)} download link(s)...", fg="bright_yellow"
+            ),
+            err=True,
+        )
+        resolved = self._map(
+            lambda item: self.resolve_md5(*item),
+            items,
+            workers or self._RESOLVE_WORKERS,
+        )
+        written = 0
+        for (md5, _), entry in zip(items, resolved):
+            if entry is None:
+                click.echo(
+                    click.style(f"Skipping {md5}: no direct download", fg="red"),
+                    err=True,
                 )
-            elif any(libgen in title for libgen in self._LIBGEN_EXTERNAL):  # libgen
-                for libgen in self._LIBGEN_EXTERNAL:
-                    if libgen in title:
-                        self._current_source = libgen
-                self._scrape_key = "download_page_scrape"
-                results = self._scrape_results(response)
-                libgen_key = list(results.keys())[0]
-                link = results.get(libgen_key).get("link")
-                self._msg = ""
-                if title == self._LIBGEN_LI:
-                    source = self._determine_source()
-                    link = f"{source.get('url')}{link}"
-                    kwargs["link"] = link
-                    self._download(title, *args, **kwargs)
-                elif title == self._LIBGEN_RS:
-                    kwargs["link"] = link
-                    self._download(title, *args, **kwargs)
-            else:  # Browser Only Options
-                click.launch(link)
+                continue
+            file.write(self._links_entry(entry, links_format))
+            written += 1
+        click.echo(f"Wrote {written} download link(s)", err=True)
 
     def run(self, *args, **kwargs):
         self._msg = f"Searching Anna's Archive: {self.q}"
@@ -412,9 +1677,22 @@ class AnnasEbook:
         self._scrape_key = "detail_page_scrape"
         click.echo(click.style("==============", fg="bright_cyan"))
         self._msg = "Fetching Download Links..."
-        value = self._scrape_page(*args, **kwargs)
-        if value == 0:
-            return click.launch(self._selected_result.get("link"))
-        click.clear()
-        self._scrape_key = ""
-        self._dl_or_launch_page(*args, **kwargs)
+        book, failed = self._selected_result, []
+        while True:
+            value = None
+            if self._fastest:
+                value = self._scrape_fastest(*args, failed=failed, **kwargs)
+            if value is None:
+                value = self._scrape_page(*args, **kwargs)
+            if value == 0:
+                return click.launch(self._selected_result.get("link"))
+            if not failed:
+                click.clear()
+            self._scrape_key = ""
+            if self._dl_or_launch_page(*args, **kwargs) is not False:
+                return
+            # not the file, so back to the download links of the same book
+            failed.append(value)
+            self._selected_result = book
+            self._current_source = self._SOURCE_ANNAS
+            self._scrape_key = "detail_page_scrape"
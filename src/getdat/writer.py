@@ -0,0 +1,103 @@
+import os
+import threading
+from collections import deque
+
+DEFAULT_BUFFER_SIZE = 8 * 1024 * 1024
+
+
+class FileWriter:
+    """Writes chunks to an open file from a background thread
+
+    write() queues a chunk and returns at once while up to `buffer_size`
+    bytes are waiting, so a slow disk does not stall the socket reads
+    feeding it; past that it blocks until the disk catches up, which caps
+    memory. With `fsync` the file is flushed to disk before close()
+    returns. A `buffer_size` of 0 writes in the calling thread.
+
+    An error writing the file is raised from the next write() or from
+    close(). Leaving the `with` block on an exception still writes every
+    queued chunk, so a partial download can be resumed from the file.
+    The file itself is left open for its owner to close.
+
+        with open(path, "wb") as f, FileWriter(f, 4 * 1024 * 1024) as writer:
+            for chunk in response.iter_content(chunk_size=64 * 1024):
+                writer.write(chunk)
+    """
+
+    def __init__(
+        self, file, buffer_size: int = DEFAULT_BUFFER_SIZE, fsync: bool = False
+    ):
+        self.buffer_size = buffer_size
+        self.fsync = fsync
+        self._file = file
+        self._chunks = deque()
+        self._queued = 0
+        self._closing = False
+        self._error = None
+        self._changed = threading.Condition()
+        self._thread = None
+        if buffer_size > 0:
+            self._thread = threading.Thread(
+                target=self._run, name="getdat writer", daemon=True
+            )
+            self._thread.start()
+
+    def _run(self):
+        while True:
+            with self._changed:
+                while not self._chunks and not self._closing:
+                    self._changed.wait()
+                if not self._chunks:
+                    return
+                chunk = self._chunks.popleft()
+            try:
+                if self._error is None:
+                    self._file.write(chunk)
+            except OSError as e:
+                self._error = e
+            with self._changed:
+                self._queued -= len(chunk)
+                self._changed.notify_all()
+
+    def write(self, chunk: bytes):
+        if self._error:
+            raise self._error
+        if not self._thread:
+            self._file.write(chunk)
+            return
+        with self._changed:
+            # a chunk larger than the buffer still goes through on its own
+            while self._queued and self._queued + len(chunk) > self.buffer_size:
+                self._changed.wait()
+                if self._error:
+                    raise self._error
+            self._chunks.append(chunk)
+            self._queued += len(chunk)
+            self._changed.notify_all()
+
+    def close(self, sync: bool | None = None):
+        """Write what is queued and fsync the file if asked to"""
+        if self._thread:
+            with self._changed:
+                self._closing = True
+                self._changed.notify_all()
+            self._thread.join()
+            self._thread = None
+        if self._error:
+            raise self._error
+        if self.fsync if sync is None else sync:
+            self._file.flush()
+            os.fsync(self._file.fileno())
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, exc_type, exc, tb):
+        if exc_type is None:
+            self.close()
+            return
+        try:
+            # keep the bytes received so far, an interrupted download resumes
+            self.close(sync=False)
+        except OSError:
+            pass
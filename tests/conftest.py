@@ -0,0 +1,14 @@
+import pytest
+from src.getdat.mock_server import MockMirror
+
+
+@pytest.fixture
+def mirror_options():
+    """MockMirror options of the mirror fixture, override to change them"""
+    return {"payload_size": 128 * 1024, "results": 3}
+
+
+@pytest.fixture
+def mirror(mirror_options):
+    with MockMirror(**mirror_options) as server:
+        yield server
@@ -0,0 +1,294 @@
+import os
+import click
+import pytest
+from src.getdat.cache import MissCache, ResolutionCache
+from src.getdat.exceptions import DownloadError
+from src.getdat.mock_server import MockMirror
+from src.getdat.utils import AnnasArchive, AnnasEbook
+
+SEARCH = "Treasure Island Stevenson"
+
+
+@pytest.fixture
+def cache(tmp_path):
+    cache = ResolutionCache(str(tmp_path / "cache.db"), ttl=60)
+    yield cache
+    cache.close()
+
+
+@pytest.fixture
+def misses(tmp_path):
+    misses = MissCache(str(tmp_path / "cache.db"), ttl=60)
+    yield misses
+    misses.close()
+
+
+class TestResolutionCache:
+    def test_get_set_invalidate(self, cache, tmp_path):
+        md5 = MockMirror.md5_for(SEARCH, 0)
+        assert cache.get(md5, AnnasArchive._LIBGEN_RS) is None
+        cache.set(md5, AnnasArchive._LIBGEN_RS, "https://libgen.rs/get.php?md5=x")
+        assert cache.get(md5, AnnasArchive._LIBGEN_RS) == (
+            "https://libgen.rs/get.php?md5=x"
+        )
+        assert cache.get(md5, AnnasArchive._LIBGEN_LI) is None
+        # persisted between processes
+        other = ResolutionCache(str(tmp_path / "cache.db"))
+        assert other.get(md5, AnnasArchive._LIBGEN_RS) is not None
+        other.close()
+        cache.invalidate(md5, AnnasArchive._LIBGEN_RS)
+        assert cache.get(md5, AnnasArchive._LIBGEN_RS) is None
+
+    def test_expires(self, cache, mocker):
+        now = mocker.patch("src.getdat.cache.time.time", return_value=1000)
+        cache.set("a" * 32, AnnasArchive._LIBGEN_LI, "https://libgen.li/get.php")
+        now.return_value = 1061
+        assert cache.get("a" * 32, AnnasArchive._LIBGEN_LI) is None
+
+    def test_ttl_from_config_and_disabled(self, tmp_path, mocker):
+        mocker.patch("src.getdat.cache.load_config", return_value={"resolve_ttl": 0})
+        cache = ResolutionCache(str(tmp_path / "cache.db"))
+        assert cache.ttl == 0
+        cache.set("a" * 32, AnnasArchive._LIBGEN_LI, "https://libgen.li/get.php")
+        assert cache.get("a" * 32, AnnasArchive._LIBGEN_LI) is None
+        cache.close()
+
+    def test_opened_on_first_use(self, tmp_path):
+        ResolutionCache(str(tmp_path / "cache" / "cache.db"))
+        assert not os.path.exists(tmp_path / "cache")
+
+
+class TestAnnasArchiveResolveCache:
+    def test_fetch_skips_libgen_page(self, cache, mirror, tmp_path, mocker):
+        archive = AnnasArchive(instance=mirror.url, resolve_cache=cache)
+        md5 = MockMirror.md5_for(SEARCH, 0)
+        link = f"{mirror.url}/ads.php?md5={md5}"
+        spy_request = mocker.spy(archive, "_request")
+        archive.fetch(link, str(tmp_path / "first.pdf"), AnnasArchive._LIBGEN_RS)
+        assert cache.get(md5, AnnasArchive._LIBGEN_RS).startswith(
+            f"{mirror.url}/get.php?md5={md5}"
+        )
+        spy_request.reset_mock()
+        path = archive.fetch(link, str(tmp_path / "again.pdf"), AnnasArchive._LIBGEN_RS)
+        urls = [call.args[0] for call in spy_request.call_args_list]
+        assert urls == [cache.get(md5, AnnasArchive._LIBGEN_RS)]
+        with open(path, "rb") as f:
+            assert f.read() == mirror.payload(md5)
+
+    def test_fetch_stale_resolution(self, cache, mirror, tmp_path):
+        archive = AnnasArchive(instance=mirror.url, resolve_cache=cache)
+        md5 = MockMirror.md5_for(SEARCH, 0)
+        cache.set(md5, AnnasArchive._LIBGEN_RS, f"{mirror.url}/ipfs/not-an-md5")
+        path = archive.fetch(
+            f"{mirror.url}/ads.php?md5={md5}",
+            str(tmp_path / "book.pdf"),
+            AnnasArchive._LIBGEN_RS,
+        )
+        with open(path, "rb") as f:
+            assert f.read() == mirror.payload(md5)
+        assert cache.get(md5, AnnasArchive._LIBGEN_RS).startswith(
+            f"{mirror.url}/get.php?md5={md5}"
+        )
+
+    def test_page_without_get_link_is_not_cached(self, cache, misses, mirror):
+        archive = AnnasArchive(
+            instance=mirror.url, resolve_cache=cache, miss_cache=misses
+        )
+        md5 = MockMirror.md5_for(SEARCH, 0)
+        # a detail page, so an HTML page without a GET anchor
+        link = f"{mirror.url}/md5/{md5}"
+        with pytest.raises(DownloadError):
+            archive.resolve(link, AnnasArchive._LIBGEN_RS)
+        assert cache.get(md5, AnnasArchive._LIBGEN_RS) is None
+        assert misses.get(link) == "No GET link"
+
+
+class TestAnnasEbookResolveCache:
+    def ebook(self, cache):
+        ebook = AnnasEbook(
+            q=(SEARCH,),
+            ext="",
+            lang="",
+            content="",
+            sort="",
+            output_dir="",
+            resolve_cache=cache,
+        )
+        ebook._selected_result = {
+            "title": AnnasEbook._LIBGEN_RS,
+            "link": f"http://libgen.rs/ads.php?md5={'a' * 32}",
+        }
+        return ebook
+
+    def test__dl_or_launch_page_uses_cached_url(self, cache, mocker):
+        ebook = self.ebook(cache)
+        cache.set("a" * 32, AnnasEbook._LIBGEN_RS, "http://libgen.rs/get.php?md5=a")
+        response = mocker.Mock(
+            status_code=200, headers={"Content-Type": "application/pdf"}
+        )
+        mock_get = mocker.patch.object(ebook, "_get", return_value=response)
+        mock_to_filesystem = mocker.patch.object(ebook, "_to_filesystem")
+        ebook._dl_or_launch_page()
+        mock_get.assert_called_once_with(
+            stream=True, link="http://libgen.rs/get.php?md5=a"
+        )
+        mock_to_filesystem.assert_called_once_with(response)
+
+    def test__dl_or_launch_page_stale_cached_url(self, cache, mocker):
+        ebook = self.ebook(cache)
+        cache.set("a" * 32, AnnasEbook._LIBGEN_RS, "http://libgen.rs/get.php?md5=a")
+        stale = mocker.Mock(status_code=404, headers={})
+        page = mocker.Mock(status_code=200, headers={"Content-Type": "text/html"})
+        mocker.patch.object(ebook, "_get", return_value=stale)
+        mocker.patch.object(ebook, "_request", return_value=page)
+        mocker.patch.object(
+            ebook,
+            "_scrape",
+            return_value={"1": {"title": "GET", "link": "http://libgen.rs/get?k=b"}},
+        )
+        mock_download = mocker.patch.object(ebook, "_download")
+        ebook._dl_or_launch_page()
+        mock_download.assert_called_once_with(
+            AnnasEbook._LIBGEN_RS, link="http://libgen.rs/get?k=b"
+        )
+        assert cache.get("a" * 32, AnnasEbook._LIBGEN_RS) == "http://libgen.rs/get?k=b"
+
+    def test__dl_or_launch_page_cached_url_serves_junk(self, cache, mocker):
+        ebook = self.ebook(cache)
+        cache.set("a" * 32, AnnasEbook._LIBGEN_RS, "http://libgen.rs/get.php?md5=a")
+        junk = mocker.Mock(
+            status_code=200,
+            url="http://libgen.rs/get.php?md5=a",
+            headers={"Content-Type": "application/pdf"},
+        )
+        junk.iter_content.return_value = iter([b"<html><body>Rate limited"])
+        page = mocker.Mock(status_code=200, headers={"Content-Type": "text/html"})
+        mocker.patch.object(ebook, "_get", return_value=junk)
+        mocker.patch.object(ebook, "_request", return_value=page)
+        mocker.patch.object(
+            ebook,
+            "_scrape",
+            return_value={"1": {"title": "GET", "link": "http://libgen.rs/get?k=b"}},
+        )
+        mock_open = mocker.patch("src.getdat.utils.open", mocker.mock_open())
+        mock_download = mocker.patch.object(ebook, "_download")
+        ebook._dl_or_launch_page()
+        mock_open.assert_not_called()
+        mock_download.assert_called_once_with(
+            AnnasEbook._LIBGEN_RS, link="http://libgen.rs/get?k=b"
+        )
+        assert cache.get("a" * 32, AnnasEbook._LIBGEN_RS) == "http://libgen.rs/get?k=b"
+
+
+class TestMissCache:
+    def test_get_set_invalidate(self, misses, cache):
+        url = "https://annas-archive.org/search?q=nothing"
+        assert misses.get(url) is None
+        misses.set(url, "No results")
+        assert misses.get(url) == "No results"
+        # shares the database with the resolution cache
+        cache.set("a" * 32, AnnasArchive._LIBGEN_LI, "https://libgen.li/get.php")
+        assert cache.path == misses.path
+        assert misses.get(url) == "No results"
+        misses.invalidate(url)
+        assert misses.get(url) is None
+
+    def test_expires(self, misses, mocker):
+        now = mocker.patch("src.getdat.cache.time.time", return_value=1000)
+        misses.set("https://libgen.li/get.php?md5=a", "HTTP 404")
+        now.return_value = 1061
+        assert misses.get("https://libgen.li/get.php?md5=a") is None
+
+    def test_ttl_from_config_and_disabled(self, tmp_path, mocker):
+        mocker.patch("src.getdat.cache.load_config", return_value={"miss_ttl": 0})
+        misses = MissCache(str(tmp_path / "cache.db"))
+        assert misses.ttl == 0
+        misses.set("https://libgen.li/get.php?md5=a", "HTTP 404")
+        assert misses.get("https://libgen.li/get.php?md5=a") is None
+        misses.close()
+        mocker.patch("src.getdat.cache.load_config", return_value={})
+        assert MissCache(str(tmp_path / "cache.db")).ttl == MissCache.DEFAULT_TTL
+
+
+class TestAnnasArchiveMissCache:
+    def test_empty_search_is_not_repeated(self, misses, mocker):
+        with MockMirror(results=0) as mirror:
+            archive = AnnasArchive(instance=mirror.url, miss_cache=misses)
+            spy_send = mocker.spy(archive, "_send")
+            assert archive.search(SEARCH) == []
+            assert archive.search(f" {SEARCH} ") == []
+        spy_send.assert_called_once()
+        assert misses.get(archive._search_url(SEARCH, {})) == "No results"
+
+    def test_search_with_results_is_not_remembered(self, misses, mirror):
+        archive = AnnasArchive(instance=mirror.url, miss_cache=misses)
+        assert archive.search(SEARCH)
+        assert misses.get(archive._search_url(SEARCH, {})) is None
+
+    def test_dead_download_is_not_repeated(self, misses, mirror, tmp_path, mocker):
+        archive = AnnasArchive(instance=mirror.url, miss_cache=misses)
+        url = f"{mirror.url}/ipfs/not-an-md5"
+        spy_send = mocker.spy(archive, "_send")
+        for _ in range(2):
+            with pytest.raises(DownloadError):
+                archive.fetch(url, str(tmp_path / "book.pdf"), "IPFS Gateway #1")
+        spy_send.assert_called_once()
+        assert misses.get(url) == "HTTP 404"
+        assert archive.probe(url, "IPFS Gateway #1")["error"] == "HTTP 404"
+        spy_send.assert_called_once()
+
+    @pytest.mark.parametrize("status", [429, 500, 503])
+    def test_transient_errors_are_not_remembered(self, misses, status):
+        archive = AnnasArchive(miss_cache=misses)
+        archive._remember_miss("https://libgen.li/get.php?md5=a", "busy", status)
+        assert misses.get("https://libgen.li/get.php?md5=a") is None
+
+
+class TestAnnasEbookMissCache:
+    def ebook(self, misses, **kwargs):
+        return AnnasEbook(
+            q=(SEARCH,),
+            ext="",
+            lang="",
+            content="",
+            sort="",
+            output_dir="",
+            miss_cache=misses,
+            **kwargs,
+        )
+
+    def test__fetch_results_known_empty_search(self, misses, mocker):
+        ebook = self.ebook(misses)
+        misses.set(ebook._get_url(), "No results")
+        mock_get = mocker.patch.object(ebook, "_get")
+        results = ebook._fetch_results()
+        mock_get.assert_not_called()
+        assert list(results) == ["0"]
+        assert results["0"]["link"] == ebook._get_url()
+
+    def test__fetch_results_remembers_empty_search(self, misses):
+        with MockMirror(results=0) as mirror:
+            ebook = self.ebook(misses, instance=mirror.url)
+            assert list(ebook._fetch_results()) == ["0"]
+        assert misses.get(ebook._get_url()) == "No results"
+
+    def test__dl_or_launch_page_dead_link(self, misses, mocker):
+        ebook = self.ebook(misses)
+        link = f"https://ipfs.io/ipfs/{'a' * 32}"
+        ebook._selected_result = {"title": "IPFS Gateway #1", "link": link}
+        mocker.patch.object(
+            ebook, "_get", return_value=mocker.Mock(status_code=404, headers={})
+        )
+        ebook._dl_or_launch_page()
+        assert misses.get(link) == "HTTP 404"
+        ebook._get.reset_mock()
+        echo_spy = mocker.spy(click, "echo")
+        ebook._dl_or_launch_page()
+        ebook._get.assert_not_called()
+        echo_spy.assert_called_once_with(
+            click.style(
+                "Direct Download Not Available from IPFS Gateway #1.\n"
+                " Try Another Download Link",
+                fg="red",
+            )
+        )
@@ -0,0 +1,196 @@
+import http.client
+import json
+import os
+import threading
+import time
+from urllib.parse import urlparse
+import pytest
+import click
+from src.getdat.daemon import DaemonClient, DaemonError, GetdatDaemon, TTLCache
+from src.getdat.mock_server import MockMirror
+from src.getdat.utils import AnnasArchive, AnnasEbook
+
+SEARCH = "Treasure Island Stevenson"
+
+
+@pytest.fixture(params=["unix", "http"])
+def daemon(request, tmp_path, mirror, mocker):
+    mocker.patch.dict("os.environ", {"GETDAT_INSTANCE": mirror.url})
+    if request.param == "unix":
+        address = f"unix:{tmp_path / 'getdat.sock'}"
+    else:
+        address = "http://127.0.0.1:0"
+    server = GetdatDaemon(address=address, workers=2, download_dir=str(tmp_path))
+    thread = threading.Thread(target=server.serve_forever, daemon=True)
+    thread.start()
+    yield server
+    server.shutdown()
+    thread.join()
+
+
+class TestTTLCache:
+    def test_get_set_expire(self, mocker):
+        cache = TTLCache(ttl=10, max_entries=2)
+        monotonic = mocker.patch("src.getdat.daemon.time.monotonic", return_value=0)
+        cache.set("a", 1)
+        cache.set("b", 2)
+        assert cache.get("a") == 1
+        monotonic.return_value = 1
+        # full cache drops the entry closest to expiring
+        cache.set("c", 3)
+        assert cache.get("a") is None
+        assert cache.get("c") == 3
+        monotonic.return_value = 20
+        assert cache.get("b") is None
+
+
+class TestGetdatDaemon:
+    def test_discover(self, daemon, tmp_path):
+        assert DaemonClient.discover(daemon.address) is not None
+        assert DaemonClient.discover(f"unix:{tmp_path / 'missing.sock'}") is None
+
+    @pytest.mark.parametrize(
+        "address", ["http://0.0.0.0:0", "http://192.168.1.2:8765", "http://:0"]
+    )
+    def test_refuses_non_loopback_address(self, address):
+        with pytest.raises(DaemonError, match="not a loopback address"):
+            GetdatDaemon(address=address)
+
+    def test_refuses_to_replace_running_daemon(self, daemon):
+        with pytest.raises(DaemonError, match="already running"):
+            GetdatDaemon(address=daemon.address)
+        # the running daemon keeps its socket
+        assert DaemonClient.discover(daemon.address) is not None
+
+    def test_replaces_stale_socket(self, tmp_path):
+        path = tmp_path / "getdat.sock"
+        path.write_text("")
+        server = GetdatDaemon(address=f"unix:{path}")
+        server.close()
+
+    def test_search_and_links_are_cached(self, daemon, mocker):
+        client = DaemonClient(daemon.address)
+        spy_search = mocker.spy(AnnasArchive, "search")
+        results = client.search(SEARCH, ext="pdf")
+        assert [r["md5"] for r in results] == [
+            MockMirror.md5_for(SEARCH, idx) for idx in range(3)
+        ]
+        assert client.search(SEARCH, ext="pdf") == results
+        # the same search spelled differently hits the cache too
+        assert client.search(f"  {SEARCH.replace(' ', '  ')}", ext="PDF") == results
+        spy_search.assert_called_once()
+        links = client.links(results[0]["md5"])
+        assert AnnasArchive._LIBGEN_RS in [link["title"] for link in links]
+
+    def test_scrape(self, daemon, mirror):
+        client = DaemonClient(daemon.address)
+        results = client.scrape(
+            f"{mirror.url}/search?q={SEARCH}",
+            "search_page_scrape",
+            AnnasArchive._SOURCE_ANNAS,
+        )
+        assert len(results) == 4
+        with pytest.raises(DaemonError):
+            client.scrape(mirror.url, "not_a_scrape_key", AnnasArchive._SOURCE_ANNAS)
+
+    def test_jobs(self, daemon, mirror, tmp_path):
+        client = DaemonClient(daemon.address)
+        md5 = MockMirror.md5_for(SEARCH, 0)
+        job = client.submit(
+            f"{mirror.url}/ads.php?md5={md5}",
+            str(tmp_path),
+            AnnasArchive._LIBGEN_RS,
+            f"English [en], pdf, 0.1MB, {SEARCH}",
+        )
+        for _ in range(100):
+            job = client.job(job["id"])
+            if job["status"] in ("done", "failed"):
+                break
+            time.sleep(0.05)
+        assert job["status"] == "done"
+        assert job["path"] == os.path.join(tmp_path, f"{SEARCH}.pdf")
+        with pytest.raises(DaemonError):
+            client.job("unknown")
+
+    @pytest.mark.parametrize("dest", ["~/.bashrc", "/etc", "{tmp}/../elsewhere"])
+    def test_jobs_stay_in_download_dir(self, daemon, mirror, dest, tmp_path):
+        client = DaemonClient(daemon.address)
+        with pytest.raises(DaemonError, match="is outside of"):
+            client.submit(f"{mirror.url}/ipfs/x", dest.format(tmp=tmp_path))
+        assert daemon.jobs == {}
+
+    @pytest.fixture
+    def http_daemon(self, tmp_path, mirror, mocker):
+        mocker.patch.dict("os.environ", {"GETDAT_INSTANCE": mirror.url})
+        server = GetdatDaemon(address="http://127.0.0.1:0", download_dir=str(tmp_path))
+        thread = threading.Thread(target=server.serve_forever, daemon=True)
+        thread.start()
+        yield server
+        server.shutdown()
+        thread.join()
+
+    def request(self, daemon, method, path, body=None, headers=None):
+        parsed = urlparse(daemon.address)
+        connection = http.client.HTTPConnection(parsed.hostname, parsed.port)
+        try:
+            connection.request(method, path, body=body, headers=headers or {})
+            response = connection.getresponse()
+            return response.status, json.loads(response.read())
+        finally:
+            connection.close()
+
+    @pytest.mark.parametrize(
+        "host", ["evil.example:{port}", "127.0.0.1:1", "evil.example", "127.0.0.1:x"]
+    )
+    def test_refuses_other_hosts(self, http_daemon, host):
+        port = urlparse(http_daemon.address).port
+        headers = {"Host": host.format(port=port)}
+        for method, path in [("GET", "/health"), ("POST", "/jobs")]:
+            status, data = self.request(http_daemon, method, path, headers=headers)
+            assert status == 403
+        port_host = {"Host": f"localhost:{port}"}
+        assert self.request(http_daemon, "GET", "/health", headers=port_host)[0] == 200
+
+    @pytest.mark.parametrize(
+        "content_type", [None, "text/plain", "multipart/form-data"]
+    )
+    def test_jobs_must_be_json(self, http_daemon, tmp_path, content_type):
+        body = json.dumps({"link": "http://127.0.0.1:9/x", "dest": str(tmp_path)})
+        headers = {"Content-Type": content_type} if content_type else {}
+        status, data = self.request(http_daemon, "POST", "/jobs", body, headers)
+        assert status == 415
+        assert http_daemon.jobs == {}
+
+
+class TestAnnasEbookDaemon:
+    def ebook(self, daemon=None):
+        return AnnasEbook(
+            q=(SEARCH,),
+            ext="",
+            lang="",
+            content="",
+            sort="",
+            output_dir="",
+            daemon=daemon,
+        )
+
+    def test__fetch_results_through_daemon(self, mocker):
+        client = mocker.Mock()
+        client.scrape.return_value = {"0": {"title": "Continue in Browser"}}
+        ebook = self.ebook(daemon=client)
+        mock_get = mocker.patch.object(ebook, "_get")
+        assert ebook._fetch_results() == client.scrape.return_value
+        client.scrape.assert_called_once_with(
+            ebook._get_url(), "search_page_scrape", AnnasEbook._SOURCE_ANNAS
+        )
+        mock_get.assert_not_called()
+
+    def test__fetch_results_daemon_unavailable(self, mocker):
+        client = mocker.Mock()
+        client.scrape.side_effect = DaemonError
+        ebook = self.ebook(daemon=client)
+        mock_get = mocker.patch.object(ebook, "_get")
+        mock_scrape_results = mocker.patch.object(ebook, "_scrape_results")
+        assert ebook._fetch_results() == mock_scrape_results.return_value
+        mock_scrape_results.assert_called_once_with(mock_get.return_value)
+        assert ebook._daemon is None
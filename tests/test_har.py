@@ -0,0 +1,93 @@
+import base64
+import json
+import pytest
+import requests
+from src.getdat.exceptions import DownloadError
+from src.getdat.har import HarRecorder, HarReplayer
+from src.getdat.mock_server import MockMirror
+from src.getdat.utils import AnnasArchive
+
+SEARCH = "Treasure Island Stevenson"
+
+
+def flow(archive, dest):
+    results = archive.search(SEARCH)
+    links = archive.links(results[0]["md5"])
+    link = next(link for link in links if link["title"] == AnnasArchive._LIBGEN_RS)
+    return results, archive.fetch(link["link"], str(dest), link["title"])
+
+
+class TestHar:
+    def test_record_and_replay(self, tmp_path):
+        har = str(tmp_path / "session.har")
+        recorder = HarRecorder(har)
+        with MockMirror(payload_size=64 * 1024, results=3) as mirror:
+            archive = AnnasArchive(instance=mirror.url, session=recorder.session())
+            results, path = flow(archive, tmp_path / "recorded")
+        recorder.save()
+        with open(har) as f:
+            entries = json.load(f)["log"]["entries"]
+        urls = [entry["request"]["url"] for entry in entries]
+        assert urls[0].startswith(f"{mirror.url}/search?q=")
+        assert urls[-1].startswith(f"{mirror.url}/get.php?md5={results[0]['md5']}")
+        # the binary payload is kept byte for byte
+        assert entries[-1]["response"]["content"]["encoding"] == "base64"
+        assert all(entry["timings"]["wait"] >= 0 for entry in entries)
+
+        # the mirror is gone, every response comes from the capture
+        archive = AnnasArchive(
+            instance=mirror.url, session=HarReplayer.load(har).session()
+        )
+        replayed_results, replayed_path = flow(archive, tmp_path / "replayed")
+        assert replayed_results == results
+        with open(path, "rb") as recorded, open(replayed_path, "rb") as replayed:
+            assert replayed.read() == recorded.read()
+
+    def test_streamed_bodies_are_captured_as_read(self, tmp_path):
+        har = str(tmp_path / "session.har")
+        recorder = HarRecorder(har, max_body=16 * 1024)
+        with MockMirror(payload_size=1024 * 1024) as mirror:
+            archive = AnnasArchive(instance=mirror.url, session=recorder.session())
+            md5 = MockMirror.md5_for(SEARCH, 0)
+            path = archive.fetch(f"{mirror.url}/ipfs/{md5}", str(tmp_path / "book"))
+            # a download aborted after sniffing is not read any further
+            ext = MockMirror.ext_for(md5)
+            other = (
+                AnnasArchive._EPUB if ext == AnnasArchive._PDF else AnnasArchive._PDF
+            )
+            with pytest.raises(DownloadError):
+                archive.fetch(
+                    f"{mirror.url}/ipfs/{md5}",
+                    str(tmp_path),
+                    "IPFS Gateway #1",
+                    f"English [en], {other}, 1.0MB, {SEARCH}",
+                )
+        recorder.save()
+        with open(har) as f:
+            full, aborted = [
+                entry["response"] for entry in json.load(f)["log"]["entries"]
+            ]
+        assert full["bodySize"] == full["content"]["size"] == 1024 * 1024
+        assert full["content"]["_truncated"] is True
+        kept = base64.b64decode(full["content"]["text"])
+        with open(path, "rb") as f:
+            assert kept == f.read()[: 16 * 1024]
+        assert aborted["bodySize"] < 1024 * 1024
+
+    def test_replay_in_order_then_last(self):
+        def entry(body):
+            return {
+                "request": {"method": "GET", "url": "http://x.org/a"},
+                "response": {
+                    "status": 200,
+                    "statusText": "OK",
+                    "headers": [{"name": "Content-Type", "value": "text/plain"}],
+                    "content": {"size": 1, "text": body},
+                },
+                "timings": {"send": 0, "wait": 5, "receive": 0},
+            }
+
+        session = HarReplayer({"log": {"entries": [entry("1"), entry("2")]}}).session()
+        assert [session.get("http://x.org/a").text for _ in range(3)] == ["1", "2", "2"]
+        with pytest.raises(requests.ConnectionError):
+            session.get("http://x.org/b")
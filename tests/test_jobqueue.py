@@ -0,0 +1,197 @@
+import os
+import sqlite3
+import threading
+import time
+import pytest
+from src.getdat.exceptions import DownloadError
+from src.getdat.jobqueue import JobQueue, PENDING, RUNNING, DONE, FAILED
+from src.getdat.mock_server import MockMirror
+from src.getdat.utils import AnnasArchive
+
+SEARCH = "Treasure Island Stevenson"
+
+
+@pytest.fixture
+def job_queue(tmp_path):
+    job_queue = JobQueue(str(tmp_path / "queue.db"))
+    yield job_queue
+    job_queue.close()
+
+
+class TestJobQueue:
+    def test_add_claim_finish(self, job_queue, tmp_path):
+        with pytest.raises(ValueError):
+            job_queue.add(str(tmp_path))
+        first = job_queue.add(str(tmp_path), md5="a" * 32)
+        second = job_queue.add(str(tmp_path), link="https://x.org/f.pdf", title="X")
+        job = job_queue.claim()
+        assert job["id"] == first
+        assert job["status"] == RUNNING
+        assert job["attempts"] == 1
+        job_queue.finish(first, "/books/a.pdf")
+        assert job_queue.get(first)["status"] == DONE
+        assert job_queue.claim()["id"] == second
+        assert job_queue.claim() is None
+        assert job_queue.counts() == {PENDING: 0, RUNNING: 1, DONE: 1, FAILED: 0}
+
+    def test_persists_and_recovers(self, tmp_path, mocker):
+        path = str(tmp_path / "queue.db")
+        job_queue = JobQueue(path)
+        job_id = job_queue.add(str(tmp_path), md5="a" * 32)
+        job_queue.claim()
+        job_queue.close()
+        job_queue = JobQueue(path)
+        # the run may still be alive until its lease runs out
+        assert job_queue.recover() == 0
+        assert job_queue.get(job_id)["status"] == RUNNING
+        # then a new process finds the job left running and resumes it
+        expired = time.time() + JobQueue._LEASE_SECONDS + 1
+        mocker.patch("src.getdat.jobqueue.time.time", return_value=expired)
+        assert job_queue.recover() == 1
+        job = job_queue.get(job_id)
+        assert job["status"] == PENDING
+        assert job["owner"] is None and job["lease"] is None
+        job_queue.close()
+
+    def test_renew_lease(self, job_queue, tmp_path, mocker):
+        job_id = job_queue.add(str(tmp_path), md5="a" * 32)
+        lease = job_queue.claim("run-1")["lease"]
+        later = time.time() + JobQueue._LEASE_SECONDS / 2
+        mocker.patch("src.getdat.jobqueue.time.time", return_value=later)
+        assert job_queue.renew("run-2") == 0
+        assert job_queue.renew("run-1") == 1
+        assert job_queue.get(job_id)["lease"] > lease
+
+    def test_adds_lease_columns_to_old_database(self, tmp_path):
+        path = str(tmp_path / "queue.db")
+        db = sqlite3.connect(path)
+        db.execute(
+            JobQueue._SCHEMA.replace(
+                ",\n            owner TEXT,\n            lease REAL", ""
+            )
+        )
+        db.close()
+        job_queue = JobQueue(path)
+        job_id = job_queue.add(str(tmp_path), md5="a" * 32)
+        assert job_queue.claim("run-1")["id"] == job_id
+        assert job_queue.get(job_id)["owner"] == "run-1"
+        job_queue.close()
+
+    def test_fail_retry(self, job_queue, tmp_path):
+        job_id = job_queue.add(str(tmp_path), md5="a" * 32)
+        job_queue.claim()
+        job_queue.fail(job_id, "503", retry=True)
+        assert job_queue.get(job_id)["status"] == PENDING
+        job_queue.claim()
+        job_queue.fail(job_id, "503")
+        assert job_queue.get(job_id)["status"] == FAILED
+        assert job_queue.get(job_id)["error"] == "503"
+
+    def test_run_md5_and_link_jobs(self, job_queue, mirror, tmp_path):
+        archive = AnnasArchive(instance=mirror.url)
+        md5_0 = MockMirror.md5_for(SEARCH, 0)
+        md5_1 = MockMirror.md5_for(SEARCH, 1)
+        md5_job = job_queue.add(str(tmp_path), md5=md5_0)
+        link_job = job_queue.add(
+            str(tmp_path),
+            link=f"{mirror.url}/ads.php?md5={md5_1}",
+            title=AnnasArchive._LIBGEN_RS,
+            resource_name=f"English [en], pdf, 0.3MB, {SEARCH}",
+        )
+        updates = []
+        counts = job_queue.run(archive, workers=2, on_update=updates.append)
+        assert counts[DONE] == 2
+        assert len(updates) == 2
+        path = job_queue.get(md5_job)["path"]
+        assert os.path.basename(path).startswith(md5_0)
+        with open(path, "rb") as f:
+            assert f.read() == mirror.payload(md5_0)
+        assert job_queue.get(link_job)["path"] == os.path.join(
+            tmp_path, f"{SEARCH}.pdf"
+        )
+
+    def test_run_fastest_tries_probed_links(self, job_queue, mirror, tmp_path, mocker):
+        archive = AnnasArchive(instance=mirror.url)
+        md5 = MockMirror.md5_for(SEARCH, 0)
+        job_id = job_queue.add(str(tmp_path), md5=md5)
+        ipfs = f"{mirror.url}/ipfs/{md5}"
+        rank = mocker.patch.object(
+            archive,
+            "rank",
+            return_value=[
+                {"link": ipfs, "title": "IPFS Gateway #1", "url": ipfs, "error": None},
+                {"link": "x", "title": "Slow", "url": None, "error": "timed out"},
+            ],
+        )
+        spy_fetch = mocker.spy(archive, "fetch")
+        counts = job_queue.run(archive, fastest=True)
+        assert counts[DONE] == 1
+        links, resource_name = rank.call_args.args
+        assert all(link["direct"] for link in links)
+        # the fastest link is tried first and the failed probe never is
+        assert [call.args[0] for call in spy_fetch.call_args_list] == [ipfs]
+        with open(job_queue.get(job_id)["path"], "rb") as f:
+            assert f.read() == mirror.payload(md5)
+
+    def test_run_marks_failed_after_max_attempts(self, job_queue, mirror, tmp_path):
+        archive = AnnasArchive(instance=mirror.url)
+        job_id = job_queue.add(str(tmp_path), link=f"{mirror.url}/slow_download/x")
+        counts = job_queue.run(archive, max_attempts=2)
+        assert counts[FAILED] == 1
+        assert job_queue.get(job_id)["attempts"] == 2
+
+    def test_run_resumes_part_file(self, job_queue, mirror, tmp_path, mocker):
+        archive = AnnasArchive(instance=mirror.url)
+        md5 = MockMirror.md5_for(SEARCH, 0)
+        job_id = job_queue.add(str(tmp_path), link=f"{mirror.url}/ipfs/{md5}")
+        # simulate a run that was killed half way through the download
+        job_queue.claim()
+        path = str(tmp_path / md5)
+        job_queue.set_path(job_id, path)
+        with open(f"{path}.part", "wb") as f:
+            f.write(mirror.payload(md5, 0, 1000))
+        job_queue._update(job_id, lease=0)
+        spy_request = mocker.spy(archive, "_request")
+        job_queue.run(archive)
+        job = job_queue.get(job_id)
+        assert job["status"] == DONE
+        spy_request.assert_called_once_with(
+            f"{mirror.url}/ipfs/{md5}", stream=True, headers={"Range": "bytes=1000-"}
+        )
+        with open(job["path"], "rb") as f:
+            assert f.read() == mirror.payload(md5)
+
+    def test_run_leaves_jobs_of_live_run_alone(self, job_queue, mirror, tmp_path):
+        archive = AnnasArchive(instance=mirror.url)
+        md5_0 = MockMirror.md5_for(SEARCH, 0)
+        md5_1 = MockMirror.md5_for(SEARCH, 1)
+        live = job_queue.add(str(tmp_path), link=f"{mirror.url}/ipfs/{md5_0}")
+        pending = job_queue.add(str(tmp_path), link=f"{mirror.url}/ipfs/{md5_1}")
+        # another run is downloading the first job right now
+        job_queue.claim("other-run")
+        counts = job_queue.run(archive)
+        assert counts[RUNNING] == 1 and counts[DONE] == 1
+        assert job_queue.get(live)["owner"] == "other-run"
+        assert job_queue.get(live)["path"] is None
+        assert job_queue.get(pending)["status"] == DONE
+
+    def test_run_per_host_cap(self, job_queue, tmp_path, mocker):
+        archive = AnnasArchive()
+        active, peak = [0], [0]
+        lock = threading.Lock()
+
+        def fetch(url, path):
+            with lock:
+                active[0] += 1
+                peak[0] = max(peak[0], active[0])
+            time.sleep(0.05)
+            with lock:
+                active[0] -= 1
+            return path
+
+        mocker.patch.object(archive, "fetch", side_effect=fetch)
+        for idx in range(6):
+            job_queue.add(str(tmp_path), link=f"https://one.host/{idx}.pdf")
+        counts = job_queue.run(archive, workers=6, per_host=2)
+        assert counts[DONE] == 6
+        assert peak[0] == 2
@@ -1,9 +1,27 @@
+import json
 import pytest
 import click
 from unittest.mock import Mock
 from click.testing import CliRunner
 from src import getdat
-from src.getdat.main import cli, job, sport, cinema, ebook
+from src.getdat.main import (
+    cli,
+    job,
+    sport,
+    cinema,
+    ebook,
+    mirror,
+    serve,
+    queue,
+    parse,
+)
+from src.getdat.cache import MissCache, ResolutionCache
+from src.getdat.jobqueue import JobQueue
+from src.getdat.progress import LogProgress, TerminalProgress
+from src.getdat.ratelimit import RateLimiter
+from src.getdat.daemon import DaemonClient
+from src.getdat import daemon as getdat_daemon
+from src.getdat import mock_server
 from src.getdat.utils import AnnasEbook
 from src.getdat.constants import EBOOK_ERROR_MSG, MOVIE_WEB, TOTALSPORTK, BRAINTRUST
 
@@ -16,6 +34,23 @@ class TestCLI:
         homepage = "https://getdat.chrisdixononcode.dev"
         assert homepage in result.output
 
+    @pytest.mark.parametrize(
+        "option, path",
+        [
+            (["--profile"], "getdat.prof"),
+            (["--profile=out.folded"], "out.folded"),
+            (["--profile", "out.prof"], "out.prof"),
+        ],
+    )
+    def test_profile_option(self, option, path, tmp_path, monkeypatch, mocker):
+        monkeypatch.chdir(tmp_path)
+        launch = mocker.patch.object(click, "launch")
+        result = self.runner.invoke(cli, [*option, "job"])
+        assert result.exit_code == 0
+        launch.assert_called_once_with(BRAINTRUST)
+        assert f"Profile written to {path}" in result.output
+        assert (tmp_path / path).exists()
+
 
 class TestJob:
     runner = CliRunner()
@@ -183,6 +218,7 @@ class TestEbook:
             (AnnasEbook._ANNAS_ORG_URL, False),
             (AnnasEbook._ANNAS_GS_URL, False),
             (AnnasEbook._ANNAS_SE_URL, False),
+            ("http://localhost:8080", False),
             ("er", True),
         ],
     )
@@ -198,6 +234,149 @@ class TestEbook:
         else:
             ebook_run_method.assert_called_once()
 
+    def test_search_arg_ranked_instances_ebook(self, mocker):
+        mock_ebook = mocker.patch("src.getdat.main.AnnasEbook")
+        self.runner.invoke(
+            ebook,
+            "Treasure Island Stevenson -i http://localhost:8080 -i gs",
+        )
+        _, kwargs = mock_ebook.call_args
+        assert kwargs["instance"] == ("http://localhost:8080", "gs")
+        mock_ebook.return_value.run.assert_called_once()
+
+    @pytest.mark.parametrize("flag, discovered", [("", True), ("--no-daemon", False)])
+    def test_search_arg_daemon_option_ebook(self, flag, discovered, mocker):
+        mock_ebook = mocker.patch("src.getdat.main.AnnasEbook")
+        discover = mocker.patch.object(DaemonClient, "discover")
+        self.runner.invoke(ebook, f"Treasure Island Stevenson {flag}")
+        _, kwargs = mock_ebook.call_args
+        if discovered:
+            discover.assert_called_once()
+            assert kwargs["daemon"] == discover.return_value
+        else:
+            discover.assert_not_called()
+            assert kwargs["daemon"] is None
+
+    @pytest.mark.parametrize(
+        "limit_rate, expected", [("", None), ("--limit-rate 200K", 200 * 1024)]
+    )
+    def test_search_arg_limit_rate_option_ebook(self, limit_rate, expected, mocker):
+        mock_ebook = mocker.patch("src.getdat.main.AnnasEbook")
+        self.runner.invoke(ebook, f"Treasure Island Stevenson {limit_rate}")
+        _, kwargs = mock_ebook.call_args
+        assert kwargs["limit_rate"] == expected
+
+    @pytest.mark.parametrize("option, expected", [("", False), ("--progressive", True)])
+    def test_search_arg_progressive_option_ebook(self, option, expected, mocker):
+        mock_ebook = mocker.patch("src.getdat.main.AnnasEbook")
+        self.runner.invoke(ebook, f"Treasure Island Stevenson {option}")
+        _, kwargs = mock_ebook.call_args
+        assert kwargs["progressive"] is expected
+
+    @pytest.mark.parametrize(
+        "option, expected",
+        [
+            ("", type(None)),
+            ("--progress bar", TerminalProgress),
+            ("--progress log", LogProgress),
+            ("--progress off", type(None)),
+        ],
+    )
+    def test_search_arg_progress_option_ebook(self, option, expected, mocker):
+        mock_ebook = mocker.patch("src.getdat.main.AnnasEbook")
+        self.runner.invoke(ebook, f"Treasure Island Stevenson {option}")
+        _, kwargs = mock_ebook.call_args
+        # auto draws nothing when stderr is not a terminal
+        assert type(kwargs["progress"]) is expected
+
+    @pytest.mark.parametrize("option, expected", [("", False), ("--fastest", True)])
+    def test_search_arg_fastest_option_ebook(self, option, expected, mocker):
+        mock_ebook = mocker.patch("src.getdat.main.AnnasEbook")
+        self.runner.invoke(ebook, f"Treasure Island Stevenson {option}")
+        _, kwargs = mock_ebook.call_args
+        assert kwargs["fastest"] is expected
+
+    @pytest.mark.parametrize(
+        "options, pages, limit",
+        [("", None, None), ("--pages 3", 3, None), ("-p 2 -n 150", 2, 150)],
+    )
+    def test_search_arg_pages_limit_options_ebook(self, options, pages, limit, mocker):
+        mock_ebook = mocker.patch("src.getdat.main.AnnasEbook")
+        self.runner.invoke(ebook, f"Treasure Island Stevenson {options}")
+        _, kwargs = mock_ebook.call_args
+        assert kwargs["pages"] == pages
+        assert kwargs["limit"] == limit
+
+    def test_search_arg_record_replay_options_ebook(self, tmp_path, mocker):
+        mock_ebook = mocker.patch("src.getdat.main.AnnasEbook")
+        discover = mocker.patch.object(DaemonClient, "discover")
+        har = tmp_path / "session.har"
+        result = self.runner.invoke(ebook, ["Treasure", "--record", str(har)])
+        assert result.exit_code == 0
+        _, kwargs = mock_ebook.call_args
+        assert kwargs["daemon"] is None
+        assert kwargs["resolve_cache"] is None
+        assert kwargs["miss_cache"] is None
+        assert kwargs["session"] is not None
+        discover.assert_not_called()
+        # the capture is saved when the flow ends
+        assert json.loads(har.read_text())["log"]["entries"] == []
+        result = self.runner.invoke(ebook, ["Treasure", "--replay", str(har)])
+        assert result.exit_code == 0
+        assert mock_ebook.call_args.kwargs["session"] is not None
+        result = self.runner.invoke(
+            ebook, ["Treasure", "--record", str(har), "--replay", str(har)]
+        )
+        assert result.exit_code == 2
+
+    def test_md5_option_ebook(self, mocker):
+        run = mocker.patch.object(AnnasEbook, "run")
+        calls = []
+        mocker.patch.object(
+            AnnasEbook,
+            "run_md5",
+            side_effect=lambda md5s, interactive: calls.append(
+                (list(md5s), interactive)
+            ),
+        )
+        md5 = "4F95158D79DAE74E16B5D0567BE36FA6"
+        result = self.runner.invoke(ebook, ["--md5", md5, "--md5", "x"])
+        assert result.exit_code == 0
+        assert "Skipping x: not an md5" in result.output
+        run.assert_not_called()
+        result = self.runner.invoke(ebook, ["--md5", "-"], input=f"{md5}\nnope\n\n")
+        assert result.exit_code == 0
+        assert calls == [([md5.lower()], True), ([md5.lower()], False)]
+
+    def test_links_only_option_ebook(self, tmp_path, mocker):
+        calls = []
+        mocker.patch.object(
+            AnnasEbook,
+            "export_links",
+            side_effect=lambda file, links_format, md5s, workers: calls.append(
+                (
+                    file.name,
+                    links_format,
+                    md5s if md5s is None else list(md5s),
+                    workers,
+                )
+            ),
+        )
+        links = str(tmp_path / "links.txt")
+        result = self.runner.invoke(ebook, ["Treasure", "--links-only", links])
+        assert result.exit_code == 0
+        md5 = "4f95158d79dae74e16b5d0567be36fa6"
+        result = self.runner.invoke(
+            ebook,
+            ["--md5", md5, "--links-only", "-", "--links-format", "wget"]
+            + ["--links-workers", "64"],
+        )
+        assert result.exit_code == 0
+        assert calls == [
+            (links, "aria2c", None, AnnasEbook._RESOLVE_WORKERS),
+            ("-", "wget", [md5], 64),
+        ]
+
     def test_search_arg_options_ebook_run(self, mocker):
         ebook_run_method = mocker.patch.object(AnnasEbook, "run")
         self.runner.invoke(
@@ -205,3 +384,154 @@ class TestEbook:
             "Treasure Island Stevenson --ext=epub --output_dir=~/books/ --instance=gs",
         )
         ebook_run_method.assert_called_once()
+
+
+class TestMirror:
+    runner = CliRunner()
+
+    def test_mirror_serves_with_options(self, mocker):
+        mock_mirror = mocker.patch.object(mock_server, "MockMirror")
+        result = self.runner.invoke(
+            mirror, "--port 0 --latency 0.5 --rate 1M --fail-rate 0.1 --size 2M"
+        )
+        assert result.exit_code == 0
+        mock_mirror.assert_called_once_with(
+            host="127.0.0.1",
+            port=0,
+            latency=0.5,
+            rate=1024**2,
+            fail_rate=0.1,
+            payload_size=2 * 1024**2,
+            results=20,
+            pages=None,
+        )
+        mock_mirror.return_value.serve_forever.assert_called_once()
+
+    def test_mirror_invalid_rate(self, mocker):
+        mock_mirror = mocker.patch.object(mock_server, "MockMirror")
+        result = self.runner.invoke(mirror, "--rate fast")
+        assert result.exit_code != 0
+        mock_mirror.assert_not_called()
+
+
+class TestServe:
+    runner = CliRunner()
+
+    def test_serve_with_options(self, mocker):
+        mock_daemon = mocker.patch.object(getdat_daemon, "GetdatDaemon")
+        set_total_rate = mocker.patch.object(RateLimiter, "set_total_rate")
+        result = self.runner.invoke(
+            serve,
+            "--address http://127.0.0.1:9000 --workers 2 --ttl 60 "
+            "--output_dir ~/books --limit-rate 500K --total-rate 2M",
+        )
+        assert result.exit_code == 0
+        _, kwargs = mock_daemon.call_args
+        assert kwargs["address"] == "http://127.0.0.1:9000"
+        assert kwargs["workers"] == 2
+        assert kwargs["ttl"] == 60
+        assert kwargs["download_dir"] == "~/books"
+        assert kwargs["limit_rate"] == 500 * 1024
+        assert isinstance(kwargs["resolve_cache"], ResolutionCache)
+        assert isinstance(kwargs["miss_cache"], MissCache)
+        set_total_rate.assert_called_once_with(2 * 1024**2)
+        mock_daemon.return_value.serve_forever.assert_called_once()
+
+
+class TestQueue:
+    runner = CliRunner()
+
+    def test_queue_add_and_status(self, tmp_path):
+        db = str(tmp_path / "queue.db")
+        md5 = "4f95158d79dae74e16b5d0567be36fa6"
+        result = self.runner.invoke(
+            queue,
+            ["--db", db, "add", "-o", str(tmp_path), md5, "https://x.org/a.pdf", "x"],
+        )
+        assert result.exit_code == 0
+        assert "Skipping x" in result.output
+        assert "Queued 2 download(s)" in result.output
+        result = self.runner.invoke(
+            queue, ["--db", db, "add", "-"], input=f"{md5.upper()}\n\n"
+        )
+        assert "Queued 1 download(s)" in result.output
+        jobs = JobQueue(db).jobs()
+        assert [(job["md5"], job["link"]) for job in jobs] == [
+            (md5, None),
+            (None, "https://x.org/a.pdf"),
+            (md5, None),
+        ]
+        assert jobs[0]["dest"] == str(tmp_path)
+        result = self.runner.invoke(queue, ["--db", db, "status"])
+        assert f" 1 | pending | {md5} | " in result.output
+        assert "pending: 3, running: 0, done: 0, failed: 0" in result.output
+
+    def test_queue_run(self, tmp_path, mocker):
+        db = str(tmp_path / "queue.db")
+        run = mocker.patch.object(JobQueue, "run", return_value={"done": 1})
+        result = self.runner.invoke(
+            queue, ["--db", db, "run", "-w", "8", "--per-host", "3", "-i", "gs"]
+        )
+        assert result.exit_code == 0
+        args, kwargs = run.call_args
+        assert args[0].instances == ["gs"]
+        assert kwargs["workers"] == 8
+        assert kwargs["per_host"] == 3
+        assert kwargs["fastest"] is False
+        assert args[0].limit_rate is None
+        assert "done: 1" in result.output
+
+    def test_queue_run_fastest(self, tmp_path, mocker):
+        db = str(tmp_path / "queue.db")
+        run = mocker.patch.object(JobQueue, "run", return_value={"done": 1})
+        result = self.runner.invoke(queue, ["--db", db, "run", "--fastest"])
+        assert result.exit_code == 0
+        assert run.call_args.kwargs["fastest"] is True
+
+    def test_queue_run_progress(self, tmp_path, mocker):
+        db = str(tmp_path / "queue.db")
+        run = mocker.patch.object(JobQueue, "run", return_value={"done": 1})
+        result = self.runner.invoke(queue, ["--db", db, "run"])
+        assert result.exit_code == 0
+        assert run.call_args.args[0].progress is None
+        result = self.runner.invoke(queue, ["--db", db, "run", "--progress", "log"])
+        assert result.exit_code == 0
+        assert isinstance(run.call_args.args[0].progress, LogProgress)
+        result = self.runner.invoke(queue, ["--db", db, "run", "--progress", "x"])
+        assert result.exit_code == 2
+
+    def test_queue_run_limit_rate(self, tmp_path, mocker):
+        db = str(tmp_path / "queue.db")
+        run = mocker.patch.object(JobQueue, "run", return_value={"done": 1})
+        set_total_rate = mocker.patch.object(RateLimiter, "set_total_rate")
+        result = self.runner.invoke(
+            queue, ["--db", db, "run", "--limit-rate", "1M", "--total-rate", "4M"]
+        )
+        assert result.exit_code == 0
+        assert run.call_args.args[0].limit_rate == 1024**2
+        set_total_rate.assert_called_once_with(4 * 1024**2)
+        result = self.runner.invoke(queue, ["--db", db, "run", "--limit-rate", "x"])
+        assert result.exit_code == 2
+
+
+class TestParse:
+    runner = CliRunner()
+
+    def test_parse_ndjson(self):
+        result = self.runner.invoke(
+            parse, ["-w", "2", "tests/static", "tests/static/libgen_rs_detail.html"]
+        )
+        assert result.exit_code == 0
+        records = [json.loads(line) for line in result.output.splitlines()]
+        assert [record["path"] for record in records] == [
+            "tests/static/annas_archive_detail.html",
+            "tests/static/annas_archive_search.html",
+            "tests/static/libgen_li_detail.html",
+            "tests/static/libgen_rs_detail.html",
+            "tests/static/libgen_rs_detail.html",
+        ]
+        assert records[1]["page"] == "search_page_scrape"
+
+    def test_parse_missing_path(self):
+        result = self.runner.invoke(parse, ["does/not/exist"])
+        assert result.exit_code == 2
@@ -0,0 +1,104 @@
+import time
+import pytest
+import requests
+from src.getdat.mock_server import MockMirror
+from src.getdat.utils import AnnasEbook, parse_size
+
+SEARCH = "Treasure Island Stevenson"
+
+
+@pytest.fixture
+def mirror_options():
+    return {"payload_size": 64 * 1024, "results": 5}
+
+
+class TestParseSize:
+    @pytest.mark.parametrize(
+        "value, expected",
+        [
+            ("500", 500),
+            ("200K", 200 * 1024),
+            ("1.5m", int(1.5 * 1024**2)),
+            ("2G", 2 * 1024**3),
+            ("10kb", 10 * 1024),
+        ],
+    )
+    def test_parse_size(self, value, expected):
+        assert parse_size(value) == expected
+
+    @pytest.mark.parametrize("value", ["", "fast", "K"])
+    def test_parse_size_invalid(self, value):
+        with pytest.raises(ValueError):
+            parse_size(value)
+
+
+class TestMockMirror:
+    def ebook(self, mirror):
+        return AnnasEbook(
+            q=(SEARCH,),
+            ext="",
+            lang="",
+            content="",
+            sort="",
+            output_dir="",
+            instance=mirror.url,
+        )
+
+    def test_search_page_scrapes(self, mirror):
+        ebook = self.ebook(mirror)
+        response = ebook._get()
+        results = ebook._scrape_results(response)
+        # 5 results plus "Continue in Browser"
+        assert len(results) == 6
+        assert results["1"]["link"] == f"/md5/{MockMirror.md5_for(SEARCH, 0)}"
+        assert results["1"]["title"].startswith("English [en], ")
+
+    def test_detail_and_libgen_pages_scrape(self, mirror):
+        ebook = self.ebook(mirror)
+        md5 = MockMirror.md5_for(SEARCH, 0)
+        ebook._scrape_key = "detail_page_scrape"
+        ebook._selected_result = {"link": f"/md5/{md5}"}
+        results = ebook._scrape_results(ebook._get())
+        titles = [result["title"] for result in results.values()]
+        assert AnnasEbook._LIBGEN_RS in titles
+        assert "Bulk torrent downloads" not in titles
+        libgen = next(
+            r for r in results.values() if r["title"] == AnnasEbook._LIBGEN_RS
+        )
+        ebook._current_source = AnnasEbook._LIBGEN_RS
+        ebook._scrape_key = "download_page_scrape"
+        results = ebook._scrape_results(ebook._get(link=libgen["link"]))
+        get_link = next(r for r in results.values() if r["title"] == "GET")
+        response = requests.get(get_link["link"])
+        assert response.content == mirror.payload(md5)
+
+    def test_payload_range(self, mirror):
+        md5 = MockMirror.md5_for(SEARCH, 1)
+        response = requests.get(
+            f"{mirror.url}/ipfs/{md5}", headers={"Range": "bytes=100-199"}
+        )
+        assert response.status_code == 206
+        assert response.headers["Accept-Ranges"] == "bytes"
+        assert response.headers["Content-Range"] == f"bytes 100-199/{64 * 1024}"
+        assert response.content == mirror.payload(md5)[100:200]
+        response = requests.get(
+            f"{mirror.url}/ipfs/{md5}", headers={"Range": "bytes=999999-"}
+        )
+        assert response.status_code == 416
+
+    def test_payload_magic_matches_ext(self, mirror):
+        for idx in range(4):
+            md5 = MockMirror.md5_for(SEARCH, idx)
+            ext = MockMirror.ext_for(md5)
+            assert mirror.payload(md5).startswith(MockMirror._PAYLOAD_MAGIC[ext])
+
+    def test_fail_rate(self):
+        with MockMirror(fail_rate=1.0) as server:
+            assert requests.get(f"{server.url}/search?q=a").status_code == 503
+
+    def test_latency_and_rate(self):
+        with MockMirror(latency=0.1, rate=256 * 1024, payload_size=64 * 1024) as server:
+            start = time.monotonic()
+            requests.get(f"{server.url}/ipfs/{MockMirror.md5_for(SEARCH, 0)}")
+            # 0.1s latency + 64KiB at 256KiB/s
+            assert time.monotonic() - start >= 0.3
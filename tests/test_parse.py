@@ -0,0 +1,78 @@
+import shutil
+import pytest
+from src.getdat.parse import page_paths, parse_page, parse_pages
+from src.getdat.utils import AnnasArchive
+
+STATIC = "tests/static"
+
+
+@pytest.fixture
+def pages(tmp_path):
+    """The static pages copied into nested directories, several times over"""
+    for n in range(3):
+        directory = tmp_path / f"batch-{n}"
+        shutil.copytree(STATIC, directory)
+        (directory / "notes.txt").write_text("not a page")
+    return tmp_path
+
+
+class TestParse:
+    def test_page_paths(self, pages):
+        paths = page_paths([str(pages), f"{STATIC}/libgen_li_detail.html"])
+        assert len(paths) == 13
+        assert paths[0] == str(pages / "batch-0" / "annas_archive_detail.html")
+        assert paths[-1] == f"{STATIC}/libgen_li_detail.html"
+
+    @pytest.mark.parametrize(
+        "name, source, page, count",
+        [
+            (
+                "annas_archive_search.html",
+                AnnasArchive._SOURCE_ANNAS,
+                "search_page_scrape",
+                11,
+            ),
+            (
+                "annas_archive_detail.html",
+                AnnasArchive._SOURCE_ANNAS,
+                "detail_page_scrape",
+                7,
+            ),
+            (
+                "libgen_rs_detail.html",
+                AnnasArchive._LIBGEN_RS,
+                "download_page_scrape",
+                1,
+            ),
+        ],
+    )
+    def test_parse_page(self, name, source, page, count):
+        record = parse_page(f"{STATIC}/{name}")
+        assert (record["source"], record["page"]) == (source, page)
+        assert len(record["results"]) == count
+        if page == "search_page_scrape":
+            assert all(len(result["md5"]) == 32 for result in record["results"])
+
+    def test_parse_page_unknown_and_missing(self, tmp_path):
+        (tmp_path / "empty.html").write_text("<html></html>")
+        assert parse_page(str(tmp_path / "empty.html"))["results"] == []
+        assert "error" in parse_page(str(tmp_path / "missing.html"))
+
+    def test_parse_pages_reports_bad_page(self, tmp_path):
+        # a libgen page whose GET link has lost its href
+        (tmp_path / "a_bad.html").write_text("<html><a>GET</a></html>")
+        (tmp_path / "b_good.html").write_bytes(
+            open(f"{STATIC}/libgen_rs_detail.html", "rb").read()
+        )
+        bad, good = parse_pages(page_paths([str(tmp_path)]), workers=1)
+        assert bad == {
+            "path": str(tmp_path / "a_bad.html"),
+            "error": "KeyError: 'href'",
+        }
+        assert len(good["results"]) == 1
+
+    def test_parse_pages_in_input_order(self, pages):
+        paths = page_paths([str(pages)])
+        serial = list(parse_pages(paths, workers=1))
+        assert [record["path"] for record in serial] == paths
+        assert list(parse_pages(paths, workers=3, chunksize=2)) == serial
@@ -0,0 +1,45 @@
+import pstats
+import threading
+import time
+from src.getdat.profiling import SamplingProfiler, profiler
+
+
+def busy(seconds):
+    end = time.perf_counter() + seconds
+    while time.perf_counter() < end:
+        pass
+
+
+class TestProfiling:
+    def test_profiler_by_extension(self):
+        assert isinstance(profiler("out.folded"), SamplingProfiler)
+        assert isinstance(profiler("out.collapsed"), SamplingProfiler)
+        assert not isinstance(profiler("out.prof"), SamplingProfiler)
+
+    def test_sampling_profiler_every_thread(self, tmp_path):
+        prof = SamplingProfiler(interval=0.001)
+        prof.enable()
+        worker = threading.Thread(target=busy, args=(0.2,), name="worker")
+        worker.start()
+        busy(0.2)
+        worker.join()
+        prof.disable()
+        path = tmp_path / "out.folded"
+        prof.dump_stats(str(path))
+        lines = path.read_text().splitlines()
+        stacks = [line.rsplit(" ", 1) for line in lines]
+        assert all(count.isdigit() for _, count in stacks)
+        assert any(
+            stack.startswith("worker;") and "busy (test_profiling.py" in stack
+            for stack, _ in stacks
+        )
+        assert any(stack.startswith("MainThread;") for stack, _ in stacks)
+
+    def test_cprofile_writes_pstats(self, tmp_path):
+        prof = profiler(str(tmp_path / "out.prof"))
+        prof.enable()
+        busy(0.01)
+        prof.disable()
+        prof.dump_stats(str(tmp_path / "out.prof"))
+        stats = pstats.Stats(str(tmp_path / "out.prof"))
+        assert any(func[2] == "busy" for func in stats.stats)
@@ -0,0 +1,189 @@
+import io
+import json
+import pytest
+from src.getdat.exceptions import DownloadError
+from src.getdat.mock_server import MockMirror
+from src.getdat.progress import (
+    LogProgress,
+    TerminalProgress,
+    Transfer,
+    format_duration,
+    progress_reporter,
+)
+from src.getdat.utils import AnnasArchive
+
+SEARCH = "Treasure Island Stevenson"
+
+
+class Clock:
+    def __init__(self, now=100.0):
+        self.now = now
+
+    def __call__(self):
+        return self.now
+
+
+@pytest.fixture
+def clock(mocker):
+    clock = Clock()
+    mocker.patch("src.getdat.progress.time.monotonic", side_effect=clock)
+    return clock
+
+
+def events(file):
+    return [json.loads(line) for line in file.getvalue().splitlines()]
+
+
+@pytest.mark.parametrize(
+    "seconds, expected",
+    [(0, "0s"), (42.9, "42s"), (185, "3:05"), (3729, "1:02:09")],
+)
+def test_format_duration(seconds, expected):
+    assert format_duration(seconds) == expected
+
+
+class TestTransfer:
+    def test_rates_and_eta(self):
+        transfer = Transfer("book.pdf", "libgen.rs", total=10_000, now=0.0)
+        for second in range(1, 6):
+            transfer.add(1000, float(second))
+        assert transfer.done == 5000
+        assert transfer.average(5.0) == 1000
+        # the window has slowed down to the last few seconds
+        transfer.add(4000, 6.0)
+        assert transfer.rate(6.0) > transfer.average(6.0)
+        assert transfer.eta(6.0) == pytest.approx(1000 / transfer.rate(6.0))
+
+    def test_resumed_bytes_count_towards_progress_not_rate(self):
+        transfer = Transfer("book.pdf", "libgen.rs", 10_000, offset=8000, now=0.0)
+        transfer.add(1000, 1.0)
+        assert transfer.stats(1.0) == {
+            "name": "book.pdf",
+            "host": "libgen.rs",
+            "bytes": 9000,
+            "total": 10_000,
+            "rate": 1000,
+            "average": 1000,
+            "eta": 1.0,
+            "elapsed": 1.0,
+        }
+
+    def test_no_eta_without_total(self):
+        transfer = Transfer("book.pdf", "libgen.rs", now=0.0)
+        transfer.add(1000, 1.0)
+        assert transfer.eta(1.0) is None
+
+
+class TestTerminalProgress:
+    def test_aggregates_concurrent_downloads(self, clock):
+        file = io.StringIO()
+        progress = TerminalProgress(file, interval=0)
+        first = progress.start("a.pdf", "libgen.rs", 4096)
+        second = progress.start("b.epub", "ipfs.io", 4096)
+        clock.now += 2
+        progress.update(first, 1024)
+        progress.update(second, 1024)
+        line = file.getvalue().rpartition("\r")[2]
+        assert line.startswith(" 2 downloads | 2K / 8K | 25% | 1K/s now")
+        assert "| ETA 6s | ipfs.io, libgen.rs" in line
+
+    def test_finished_line(self, clock):
+        file = io.StringIO()
+        progress = TerminalProgress(file, interval=0)
+        transfer = progress.start("a.pdf", "libgen.rs", 2048)
+        clock.now += 2
+        progress.update(transfer, 2048)
+        progress.finish(transfer)
+        assert file.getvalue().endswith(
+            "\r Downloaded a.pdf | 2K in 2s | 1K/s avg | libgen.rs\x1b[K\n"
+        )
+        assert progress.transfers == []
+        failed = progress.start("b.pdf", "ipfs.io")
+        progress.finish(failed, ConnectionError("reset"))
+        assert "\r Failed b.pdf (reset) | 0 in 0s" in file.getvalue()
+
+    def test_reports_every_interval(self, clock):
+        file = io.StringIO()
+        progress = TerminalProgress(file, interval=1)
+        transfer = progress.start("a.pdf", "libgen.rs")
+        for _ in range(10):
+            clock.now += 0.25
+            progress.update(transfer, 100)
+        assert file.getvalue().count("\r") == 3
+
+
+class TestLogProgress:
+    def test_events(self, clock):
+        file = io.StringIO()
+        progress = LogProgress(file, interval=0)
+        transfer = progress.start("a.pdf", "libgen.rs", 2048)
+        clock.now += 1
+        progress.update(transfer, 1024)
+        progress.finish(transfer, DownloadError("Download is an HTML page"))
+        logged = events(file)
+        assert [event["event"] for event in logged] == ["start", "progress", "failed"]
+        assert logged[1]["bytes"] == 1024 and logged[1]["eta"] == 1.0
+        assert logged[2]["error"] == "Download is an HTML page"
+
+
+@pytest.mark.parametrize(
+    "mode, tty, expected",
+    [
+        ("auto", True, TerminalProgress),
+        ("auto", False, type(None)),
+        ("bar", False, TerminalProgress),
+        ("log", True, LogProgress),
+        ("off", True, type(None)),
+    ],
+)
+def test_progress_reporter(mode, tty, expected, mocker):
+    file = io.StringIO()
+    file.isatty = lambda: tty
+    assert type(progress_reporter(mode, file)) is expected
+
+
+class TestAnnasArchiveProgress:
+    def test_fetch(self, mirror, tmp_path):
+        file = io.StringIO()
+        archive = AnnasArchive(instance=mirror.url, progress=LogProgress(file))
+        md5 = MockMirror.md5_for(SEARCH, 0)
+        archive.fetch(f"{mirror.url}/ipfs/{md5}", str(tmp_path / "book.pdf"))
+        start, *_, done = events(file)
+        assert start["event"] == "start"
+        assert start["name"] == "book.pdf"
+        assert start["host"] == "127.0.0.1"
+        assert start["total"] == mirror.payload_size
+        assert done["event"] == "done"
+        assert done["bytes"] == mirror.payload_size
+        assert archive.progress.transfers == []
+
+    def test_fetch_resumed(self, mirror, tmp_path):
+        file = io.StringIO()
+        archive = AnnasArchive(instance=mirror.url, progress=LogProgress(file))
+        md5 = MockMirror.md5_for(SEARCH, 0)
+        path = str(tmp_path / md5)
+        with open(f"{path}.part", "wb") as f:
+            f.write(mirror.payload(md5, 0, 1000))
+        archive.fetch(f"{mirror.url}/ipfs/{md5}", path)
+        start, *_, done = events(file)
+        assert start["bytes"] == 1000
+        assert start["total"] == mirror.payload_size
+        assert done["bytes"] == mirror.payload_size
+
+    def test_fetch_wrong_file_type(self, mirror, tmp_path):
+        file = io.StringIO()
+        archive = AnnasArchive(instance=mirror.url, progress=LogProgress(file))
+        md5 = MockMirror.md5_for(SEARCH, 0)
+        ext = MockMirror.ext_for(md5)
+        other = AnnasArchive._EPUB if ext == AnnasArchive._PDF else AnnasArchive._PDF
+        with pytest.raises(DownloadError):
+            archive.fetch(
+                f"{mirror.url}/ipfs/{md5}",
+                str(tmp_path),
+                "IPFS Gateway #1",
+                f"English [en], {other}, 1.0MB, {SEARCH}",
+            )
+        failed = events(file)[-1]
+        assert failed["event"] == "failed"
+        assert f"not the expected {other} file" in failed["error"]
+        assert archive.progress.transfers == []
@@ -0,0 +1,161 @@
+import threading
+import time
+import pytest
+import requests
+from src.getdat.ratelimit import HostLimiter, RateLimiter, TokenBucket
+from src.getdat.utils import AnnasArchive
+
+
+class TestTokenBucket:
+    def test_acquire_waits_for_tokens(self, mocker):
+        sleep = mocker.patch("src.getdat.ratelimit.time.sleep")
+        monotonic = mocker.patch("src.getdat.ratelimit.time.monotonic", return_value=0)
+        bucket = TokenBucket(rate=2, capacity=2)
+        bucket.acquire()
+        bucket.acquire()
+        sleep.assert_not_called()
+
+        def advance(seconds):
+            monotonic.return_value += seconds
+
+        sleep.side_effect = advance
+        bucket.acquire()
+        sleep.assert_called_once_with(0.5)
+
+
+class TestHostLimiter:
+    def test_concurrency(self):
+        limiter = HostLimiter(concurrency=2)
+        active, peak = 0, 0
+        lock = threading.Lock()
+
+        def request():
+            nonlocal active, peak
+            with limiter.slot():
+                with lock:
+                    active += 1
+                    peak = max(peak, active)
+                time.sleep(0.02)
+                with lock:
+                    active -= 1
+
+        threads = [threading.Thread(target=request) for _ in range(6)]
+        for thread in threads:
+            thread.start()
+        for thread in threads:
+            thread.join()
+        assert peak == 2
+
+    @pytest.mark.parametrize(
+        "status_code, headers, backed_off",
+        [
+            (200, {}, False),
+            (404, {}, False),
+            (429, {"Retry-After": "3"}, True),
+            (503, {}, True),
+        ],
+    )
+    def test_observe(self, status_code, headers, backed_off, mocker):
+        mocker.patch("src.getdat.ratelimit.time.monotonic", return_value=100)
+        limiter = HostLimiter(rate=4)
+        response = mocker.Mock(status_code=status_code, headers=headers)
+        assert limiter.observe(response) is backed_off
+        if backed_off:
+            assert limiter._backoff_until == 100 + float(
+                headers.get("Retry-After", HostLimiter._BASE_DELAY)
+            )
+            assert limiter._bucket.rate == 2
+            limiter.observe(mocker.Mock(status_code=200))
+            assert limiter._bucket.rate == 2.5
+        else:
+            assert limiter._backoff_until == 0
+
+    def test_long_retry_after_is_not_waited_for(self, mocker):
+        mocker.patch("src.getdat.ratelimit.time.monotonic", return_value=100)
+        limiter = HostLimiter()
+        response = mocker.Mock(status_code=503, headers={"Retry-After": "86400"})
+        assert limiter.observe(response) is False
+        assert limiter._backoff_until == 100 + HostLimiter._MAX_DELAY
+
+    def test_backoff_grows(self, mocker):
+        mocker.patch("src.getdat.ratelimit.time.monotonic", return_value=0)
+        limiter = HostLimiter()
+        for _ in range(3):
+            limiter.backoff()
+        assert limiter._backoff_until == HostLimiter._BASE_DELAY * 4
+
+
+class TestRateLimiter:
+    def test_for_host(self):
+        limiter = RateLimiter()
+        annas = limiter.for_host("annas-archive.org")
+        assert annas is limiter.for_host("annas-archive.org")
+        assert annas.concurrency == 4
+        assert limiter.for_host("libgen.li").rate == 2.0
+        unlimited = limiter.for_host("localhost")
+        assert unlimited.concurrency is None and unlimited.rate is None
+
+    def test_from_config(self, mocker):
+        mocker.patch(
+            "src.getdat.ratelimit.load_config",
+            return_value={"annas-archive.gs": {"concurrency": 1, "rate": 0.5}},
+        )
+        limiter = RateLimiter.from_config()
+        assert limiter.for_host("annas-archive.gs").concurrency == 1
+        assert limiter.for_host("annas-archive.org").concurrency == 4
+
+
+class TestAnnasArchiveRequest:
+    def test_retries_after_backoff(self, mocker):
+        archive = AnnasArchive(limiter=RateLimiter({}))
+        backoff = mocker.patch.object(HostLimiter, "backoff")
+        throttled = mocker.Mock(status_code=429, headers={"Retry-After": "0"})
+        ok = mocker.Mock(status_code=200)
+        mocked_get = mocker.patch.object(requests, "get", side_effect=[throttled, ok])
+        assert archive._request("https://annas-archive.org/md5/x") == ok
+        assert mocked_get.call_count == 2
+        backoff.assert_called_once_with(0.0)
+        throttled.close.assert_called_once()
+
+    def test_gives_up_after_retries(self, mocker):
+        archive = AnnasArchive(limiter=RateLimiter({}))
+        mocker.patch.object(HostLimiter, "backoff")
+        unavailable = mocker.Mock(status_code=503, headers={})
+        mocked_get = mocker.patch.object(requests, "get", return_value=unavailable)
+        assert archive._request("https://libgen.li/ads.php") == unavailable
+        assert mocked_get.call_count == AnnasArchive._BACKOFF_RETRIES + 1
+
+    def test_gives_up_on_long_retry_after(self, mocker):
+        archive = AnnasArchive(limiter=RateLimiter({}))
+        unavailable = mocker.Mock(status_code=503, headers={"Retry-After": "86400"})
+        mocked_get = mocker.patch.object(requests, "get", return_value=unavailable)
+        assert archive._request("https://libgen.li/ads.php") == unavailable
+        assert mocked_get.call_count == 1
+
+
+class TestBandwidth:
+    def response(self, mocker, size: int):
+        response = mocker.Mock()
+        response.iter_content.side_effect = lambda chunk_size: (
+            b"x" * min(chunk_size, size - start) for start in range(0, size, chunk_size)
+        )
+        return response
+
+    def test_limit_rate(self, mocker, tmp_path):
+        archive = AnnasArchive(limiter=RateLimiter({}), limit_rate=16 * 1024)
+        acquire = mocker.patch.object(TokenBucket, "acquire")
+        response = self.response(mocker, 10 * 1024)
+        archive._write(response, str(tmp_path / "book.pdf"))
+        response.iter_content.assert_called_once_with(chunk_size=2 * 1024)
+        assert sum(call.args[0] for call in acquire.call_args_list) == 10 * 1024
+        assert (tmp_path / "book.pdf").stat().st_size == 10 * 1024
+
+    def test_total_rate_is_shared(self, mocker, tmp_path):
+        limiter = RateLimiter({}, total_rate=1024**2)
+        acquire = mocker.spy(limiter.bandwidth, "acquire")
+        for name in ("a.pdf", "b.pdf"):
+            archive = AnnasArchive(limiter=limiter)
+            archive._write(self.response(mocker, 1024), str(tmp_path / name))
+        assert acquire.call_count == 2
+        limiter.set_total_rate(None)
+        assert limiter.bandwidth is None
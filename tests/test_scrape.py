@@ -0,0 +1,187 @@
+import pytest
+from src.getdat.scrape import (
+    PARSERS,
+    PushScraper,
+    ScrapeRule,
+    configured_parser,
+    css_selector,
+)
+from src.getdat.utils import AnnasArchive
+
+PAGE = """
+<html><body>
+<nav><a href="/home" class="nav">Home</a></nav>
+<a href="/md5/1" class="result wide"><div class="title">First</div></a>
+<a href="/md5/2" class="wide extra result"><div class="title">Second</div></a>
+<a href="/get.php?md5=3">GET</a>
+<a href="/datasets" class="result wide"><div class="title">Bulk</div></a>
+</body></html>
+"""
+
+
+@pytest.fixture(params=PARSERS)
+def parser(request):
+    if request.param == "lxml":
+        pytest.importorskip("lxml")
+    return request.param
+
+
+class TestConfiguredParser:
+    @pytest.fixture(autouse=True)
+    def clear_cache(self):
+        configured_parser.cache_clear()
+        yield
+        configured_parser.cache_clear()
+
+    @pytest.mark.parametrize(
+        "config, expected",
+        [({}, "html.parser"), ({"parser": "html.parser"}, "html.parser")],
+    )
+    def test_parser(self, config, expected, mocker):
+        load_config = mocker.patch("src.getdat.scrape.load_config", return_value=config)
+        assert configured_parser() == expected
+        assert ScrapeRule({"tag": "a"}).parser == expected
+        load_config.assert_called_once_with("scrape")
+
+    def test_lxml_must_be_installed(self, mocker):
+        mocker.patch("src.getdat.scrape.load_config", return_value={"parser": "lxml"})
+        mocker.patch("src.getdat.scrape.find_spec", return_value=None)
+        with pytest.raises(ValueError, match="getdat\\[lxml\\]"):
+            configured_parser()
+
+    def test_unknown_parser(self, mocker):
+        mocker.patch(
+            "src.getdat.scrape.load_config", return_value={"parser": "html5lib"}
+        )
+        with pytest.raises(ValueError, match="not 'html5lib'"):
+            configured_parser()
+
+
+class TestScrapeRule:
+    @pytest.mark.parametrize(
+        "rule, expected",
+        [
+            ({"tag": "a"}, "a"),
+            ({"tag": "a", "class": "js-download-link"}, "a.js-download-link"),
+            (
+                {"tag": "a", "class": "flex left-[-10px] hover:bg-[#00000011]"},
+                r"a.flex.left-\[-10px\].hover\:bg-\[\#00000011\]",
+            ),
+            ({"class": "title"}, ".title"),
+            ({"tag": "a", "class": "x", "selector": "main a[href]"}, "main a[href]"),
+            ({}, "*"),
+        ],
+    )
+    def test_css_selector(self, rule, expected):
+        assert css_selector(rule) == expected
+
+    def test_scrape_classes_in_any_order(self, parser):
+        rule = ScrapeRule(
+            {
+                "tag": "a",
+                "class": "result wide",
+                "title_container": {"tag": "div", "class": "title"},
+                "exclude_text": "Bulk",
+            },
+            parser,
+        )
+        assert rule.scrape(PAGE) == [(1, "First", "/md5/1"), (2, "Second", "/md5/2")]
+
+    def test_scrape_text(self, parser):
+        rule = ScrapeRule({"tag": "a", "text": "GET"}, parser)
+        # valued by position among every anchor, like the libgen pages
+        assert rule.scrape(PAGE) == [(4, "GET", "/get.php?md5=3")]
+
+    def test_scrape_selector(self, parser):
+        rule = ScrapeRule({"selector": "nav > a"}, parser)
+        assert rule.strainer is None
+        assert rule.scrape(PAGE.encode()) == [(1, "Home", "/home")]
+
+    def test_scrape_bytes_with_encoding(self, mocker):
+        page = '<a href="/md5/1">Les Misérables</a>'.encode("latin-1")
+        spy = mocker.spy(ScrapeRule, "soup")
+        rule = ScrapeRule({"tag": "a"})
+        assert rule.scrape(page, "latin-1") == [(1, "Les Misérables", "/md5/1")]
+        assert spy.spy_return.original_encoding == "latin-1"
+        # str is already decoded, the encoding is ignored
+        assert rule.scrape(page.decode("latin-1"), "latin-1")[0][1] == "Les Misérables"
+
+
+def push(scraper, page, size) -> list:
+    """Feed `page` to `scraper` in chunks of `size` and close it"""
+    results = []
+    for start in range(0, len(page), size):
+        results += scraper.feed(page[start : start + size])
+    return results + scraper.close()
+
+
+class TestPushScraper:
+    @pytest.mark.parametrize("size", [1, 5, 64, 100_000])
+    @pytest.mark.parametrize(
+        "rule",
+        [
+            {
+                "tag": "a",
+                "class": "result wide",
+                "title_container": {"tag": "div", "class": "title"},
+                "exclude_text": "Bulk",
+            },
+            {"tag": "a", "text": "GET"},
+            {"selector": "nav > a"},
+        ],
+    )
+    def test_same_results_as_scrape(self, rule, size, parser):
+        rule = ScrapeRule(rule, parser)
+        assert push(PushScraper(rule), PAGE.encode(), size) == rule.scrape(PAGE)
+
+    @pytest.mark.parametrize(
+        "page, key",
+        [
+            ("tests/static/annas_archive_search.html", "search_page_scrape"),
+            ("tests/static/annas_archive_detail.html", "detail_page_scrape"),
+        ],
+    )
+    def test_static_pages(self, page, key, parser):
+        rule = AnnasArchive._SOURCE_DICT[AnnasArchive._SOURCE_ANNAS][key]
+        rule = ScrapeRule(rule, parser)
+        with open(page, "rb") as f:
+            content = f.read()
+        assert push(PushScraper(rule, "utf-8"), content, 1000) == rule.scrape(content)
+
+    def test_results_as_elements_complete(self):
+        scraper = PushScraper(ScrapeRule({"tag": "a"}))
+        assert scraper.feed(b'<p>x</p><a href="/md5/1">Fir') == []
+        assert scraper.feed(b'st</a><a href="/md5/2">') == [(1, "First", "/md5/1")]
+        assert scraper.feed(b"Second</a>") == [(2, "Second", "/md5/2")]
+        assert scraper.close() == []
+
+    def test_elements_of_a_chunk_are_parsed_once(self, mocker):
+        rule = ScrapeRule({"tag": "a", "exclude_text": "Skip"})
+        soup = mocker.spy(rule, "soup")
+        scraper = PushScraper(rule)
+        chunk = b'<a href="/1">One</a><p>x</p><a href="/2">Skip</a><a href="/3">Three'
+        assert scraper.feed(chunk) == [(1, "One", "/1")]
+        assert soup.call_count == 1
+        assert scraper.feed(b"</a>") == [(3, "Three", "/3")]
+        assert scraper.feed(b"<p>no elements</p>") == []
+        assert soup.call_count == 2
+
+    def test_selector_rule_waits_for_the_page(self):
+        scraper = PushScraper(ScrapeRule({"selector": "nav > a"}))
+        assert scraper.feed(PAGE.encode()) == []
+        assert scraper.close() == [(1, "Home", "/home")]
+
+    def test_multibyte_characters_split_across_chunks(self):
+        page = '<a href="/md5/1">Les Misérables &amp; Ça</a>'.encode()
+        rule = ScrapeRule({"tag": "a"})
+        assert push(PushScraper(rule, "utf-8"), page, 1) == [
+            (1, "Les Misérables & Ça", "/md5/1")
+        ]
+        latin = '<a href="/md5/1">Les Misérables</a>'.encode("latin-1")
+        assert push(PushScraper(rule, "latin-1"), latin, 3)[0][1] == "Les Misérables"
+
+    def test_unclosed_element_at_end(self):
+        scraper = PushScraper(ScrapeRule({"tag": "a"}))
+        assert push(scraper, b'<a href="/md5/1">Cut off', 4) == [
+            (1, "Cut off", "/md5/1")
+        ]
@@ -0,0 +1,111 @@
+import threading
+from concurrent.futures import ThreadPoolExecutor
+import pytest
+from src.getdat.mock_server import MockMirror
+from src.getdat.singleflight import SingleFlight
+from src.getdat.utils import AnnasArchive
+
+SEARCH = "Treasure Island Stevenson"
+CALLERS = 8
+
+
+def run_concurrently(flights, key, func):
+    """Call flights.do from CALLERS threads once func is running"""
+    with ThreadPoolExecutor(max_workers=CALLERS) as executor:
+        futures = [executor.submit(flights.do, key, func)]
+        func.started.wait()
+        futures += [executor.submit(flights.do, key, func) for _ in range(CALLERS - 1)]
+        while flights._calls[key].shared < CALLERS - 1:
+            threading.Event().wait(0.001)
+        func.release.set()
+        return futures
+
+
+class Blocking:
+    def __init__(self, value=None, error=None):
+        self.value = value
+        self.error = error
+        self.calls = 0
+        self.started = threading.Event()
+        self.release = threading.Event()
+
+    def __call__(self):
+        self.calls += 1
+        self.started.set()
+        self.release.wait()
+        if self.error:
+            raise self.error
+        return self.value
+
+
+class TestSingleFlight:
+    def test_concurrent_calls_share_one_run(self):
+        flights = SingleFlight()
+        func = Blocking(value={"page": 1})
+        futures = run_concurrently(flights, "url", func)
+        assert [future.result() for future in futures] == [{"page": 1}] * CALLERS
+        assert func.calls == 1
+        assert flights.in_flight() == 0
+
+    def test_error_is_shared(self):
+        flights = SingleFlight()
+        func = Blocking(error=ConnectionError("down"))
+        futures = run_concurrently(flights, "url", func)
+        for future in futures:
+            with pytest.raises(ConnectionError, match="down"):
+                future.result()
+        assert func.calls == 1
+        assert flights.in_flight() == 0
+
+    def test_nothing_is_cached(self):
+        flights = SingleFlight()
+        assert flights.do("url", lambda: 1) == 1
+        assert flights.do("url", lambda: 2) == 2
+        assert flights.do("other", lambda: 3) == 3
+
+
+class TestAnnasArchiveCoalescing:
+    def test_concurrent_links_fetch_once(self, mocker):
+        md5 = MockMirror.md5_for(SEARCH, 0)
+        release = threading.Event()
+        with MockMirror() as mirror:
+            archive = AnnasArchive(instance=mirror.url)
+            sent_url = f"{mirror.url}/md5/{md5}"
+            send = archive._send
+            sent = []
+
+            def slow_send(url, *args):
+                sent.append(url)
+                release.wait()
+                return send(url, *args)
+
+            mocker.patch.object(archive, "_send", side_effect=slow_send)
+            spy_scrape = mocker.spy(archive, "_scrape")
+            with ThreadPoolExecutor(max_workers=CALLERS) as executor:
+                futures = [executor.submit(archive.links, md5) for _ in range(CALLERS)]
+                key = (
+                    "scrape",
+                    sent_url,
+                    "detail_page_scrape",
+                    AnnasArchive._SOURCE_ANNAS,
+                )
+                while (
+                    key not in archive._flights._calls
+                    or archive._flights._calls[key].shared < CALLERS - 1
+                ):
+                    threading.Event().wait(0.001)
+                release.set()
+                results = [future.result() for future in futures]
+        assert sent == [sent_url]
+        assert results[0] and all(result == results[0] for result in results)
+        # callers get their own copies of the parsed links
+        assert results[0][0] is not results[1][0]
+        spy_scrape.assert_called_once()
+
+    def test_streams_are_not_coalesced(self, mocker):
+        archive = AnnasArchive(instance="http://localhost:8080")
+        send = mocker.patch.object(archive, "_send")
+        archive._request("http://localhost:8080/x", stream=True)
+        archive._request("http://localhost:8080/x", headers={"Range": "bytes=0-1"})
+        assert send.call_count == 2
+        assert archive._flights.in_flight() == 0
@@ -1,10 +1,22 @@
+import io
 import os
+import time
 import click
 import pytest
 import requests
+import threading
+from concurrent.futures import ThreadPoolExecutor
 from click.testing import CliRunner
 from requests.exceptions import ConnectionError, ChunkedEncodingError
-from src.getdat.utils import print_help, AnnasEbook
+from src.getdat.utils import (
+    print_help,
+    format_size,
+    parse_size,
+    AnnasArchive,
+    AnnasEbook,
+)
+from src.getdat.exceptions import DownloadError
+from src.getdat.mock_server import MockMirror
 
 
 class TestPrintHelp:
@@ -36,6 +48,16 @@ SEARCH = "Treasure Island Stevenson"
 
 PDF_CONTENT_TYPE = "application/pdf"
 EPUB_CONTENT_TYPE = "application/epub+zip"
+EPUB = b"PK\x03\x04mimetypeapplication/epub+zip" + bytes(1024)
+
+
+@pytest.mark.parametrize(
+    "size, expected",
+    [(0, "0"), (512, "512"), (1536, "1.5K"), (5 * 1024**2, "5M"), (3 * 1024**3, "3G")],
+)
+def test_format_size(size, expected):
+    assert format_size(size) == expected
+    assert parse_size(expected) == size
 
 
 class TestAnnasEbook:
@@ -191,6 +213,74 @@ class TestAnnasEbook:
             )
             assert ebook.instance == AnnasEbook._ANNAS_ORG_URL
 
+    @pytest.mark.parametrize(
+        "instance, env, config, expected_instances",
+        [
+            (
+                ("http://localhost:8080", "gs"),
+                "se",
+                "",
+                ["http://localhost:8080", "gs"],
+            ),
+            (None, "http://localhost:8080, se", "", ["http://localhost:8080", "se"]),
+            (
+                None,
+                "",
+                '[ebook]\ninstances = ["https://cache.local", "gs"]',
+                ["https://cache.local", "gs"],
+            ),
+            (("rs", "ftp://mirror"), "", "", [AnnasEbook._ANNAS_ORG_URL]),
+            (None, "", "", [AnnasEbook._ANNAS_ORG_URL]),
+        ],
+    )
+    def test_instances(
+        self, instance, env, config, expected_instances, mocker, tmp_path
+    ):
+        config_file = tmp_path / "config.toml"
+        config_file.write_text(config)
+        mocker.patch.dict(
+            "os.environ",
+            {"GETDAT_INSTANCE": env, "GETDAT_CONFIG": str(config_file)},
+            clear=True,
+        )
+        ebook = AnnasEbook(
+            q=self.q,
+            ext=self.ext,
+            lang=self.lang,
+            content=self.content,
+            sort=self.sort,
+            output_dir=self.output_dir,
+            instance=instance,
+        )
+        assert ebook.instances == expected_instances
+        assert ebook.instance == expected_instances[0]
+
+    def test__get_falls_back_to_next_instance(self, mocker):
+        ebook = AnnasEbook(
+            q=self.q,
+            ext=self.ext,
+            lang=self.lang,
+            content=self.content,
+            sort=self.sort,
+            output_dir=self.output_dir,
+            instance=("http://localhost:8080", AnnasEbook._ANNAS_GS_URL),
+        )
+        mocked_get = mocker.patch.object(requests, "get")
+        ok = mocker.Mock(status_code=200)
+        mocked_get.side_effect = [ConnectionError, ok]
+        assert ebook._get() == ok
+        assert ebook.instance == AnnasEbook._ANNAS_GS_URL
+        first_url = mocked_get.call_args_list[0].args[0]
+        second_url = mocked_get.call_args_list[1].args[0]
+        assert first_url.startswith("http://localhost:8080/search?q=")
+        assert second_url.startswith(
+            AnnasEbook._ANNAS_URLS[AnnasEbook._ANNAS_GS_URL] + "/search?q="
+        )
+        # no instances left to fall back to
+        mocked_get.side_effect = ConnectionError
+        with pytest.raises(ConnectionError):
+            ebook._get()
+
     @pytest.mark.parametrize(
         "sort", [("newest",), ("oldest",), ("smallest",), ("largest",)]
     )
@@ -229,7 +319,11 @@ class TestAnnasEbook:
                             ),
                         },
                     },
-                    "detail_page_scrape": {"tag": "a", "class": "js-download-link"},
+                    "detail_page_scrape": {
+                        "tag": "a",
+                        "class": "js-download-link",
+                        "exclude_text": "Bulk torrent downloads",
+                    },
                 },
             ),
             (
@@ -253,7 +347,11 @@ class TestAnnasEbook:
                             ),
                         },
                     },
-                    "detail_page_scrape": {"tag": "a", "class": "js-download-link"},
+                    "detail_page_scrape": {
+                        "tag": "a",
+                        "class": "js-download-link",
+                        "exclude_text": "Bulk torrent downloads",
+                    },
                 },
             ),
             (
@@ -277,14 +375,25 @@ class TestAnnasEbook:
                             ),
                         },
                     },
-                    "detail_page_scrape": {"tag": "a", "class": "js-download-link"},
+                    "detail_page_scrape": {
+                        "tag": "a",
+                        "class": "js-download-link",
+                        "exclude_text": "Bulk torrent downloads",
+                    },
                 },
             ),
-            (AnnasEbook._LIBGEN_RS, "", {"download_page_scrape": {"tag": "a"}}),
+            (
+                AnnasEbook._LIBGEN_RS,
+                "",
+                {"download_page_scrape": {"tag": "a", "text": "GET"}},
+            ),
             (
                 AnnasEbook._LIBGEN_LI,
                 AnnasEbook._ANNAS_GS_URL,
-                {"url": "https://libgen.li/", "download_page_scrape": {"tag": "a"}},
+                {
+                    "url": "https://libgen.li/",
+                    "download_page_scrape": {"tag": "a", "text": "GET"},
+                },
             ),
             ("Not part of _SOURCE_DICT", "", None),
         ],
@@ -314,6 +423,66 @@ class TestAnnasEbook:
             mocker.patch.object(ebook, "_current_source", source)
             assert ebook._determine_source() == expected_dict
 
+    def test_state_is_per_instance(self):
+        ebook_gs = AnnasEbook(
+            q=("Dune",),
+            ext="pdf",
+            lang=self.lang,
+            content=self.content,
+            sort=self.sort,
+            output_dir=self.output_dir,
+            instance=AnnasEbook._ANNAS_GS_URL,
+        )
+        ebook_org = AnnasEbook(
+            q=self.q,
+            ext="epub",
+            lang=self.lang,
+            content=self.content,
+            sort=self.sort,
+            output_dir=self.output_dir,
+        )
+        ebook_gs._selected_result["link"] = "/md5/234890238402380423"
+        ebook_gs._scrape_key = "detail_page_scrape"
+        assert ebook_org._selected_result == {}
+        assert ebook_org._scrape_key == "search_page_scrape"
+        assert ebook_org._search_params["ext"] == "epub"
+        assert ebook_gs._determine_source()["url"] == AnnasEbook._ANNAS_URLS.get(
+            AnnasEbook._ANNAS_GS_URL
+        )
+        # the shared source dict is never updated with an instance's url
+        assert AnnasEbook._SOURCE_DICT[AnnasEbook._SOURCE_ANNAS][
+            "url"
+        ] == AnnasEbook._ANNAS_URLS.get(AnnasEbook._ANNAS_ORG_URL)
+        assert ebook_org._determine_source()["url"] == AnnasEbook._ANNAS_URLS.get(
+            AnnasEbook._ANNAS_ORG_URL
+        )
+
+    def test_concurrent_searches(self):
+        instances = list(AnnasEbook._ANNAS_URLS.keys()) * 4
+        barrier = threading.Barrier(len(instances))
+
+        def search_url(idx, instance):
+            ebook = AnnasEbook(
+                q=(f"book {idx}",),
+                ext=AnnasEbook._FILE_EXT[idx % len(AnnasEbook._FILE_EXT)],
+                lang=self.lang,
+                content=self.content,
+                sort=self.sort,
+                output_dir=self.output_dir,
+                instance=instance,
+            )
+            barrier.wait()
+            return ebook._get_url()
+
+        with ThreadPoolExecutor(max_workers=len(instances)) as executor:
+            urls = list(executor.map(search_url, *zip(*enumerate(instances))))
+        for idx, (instance, url) in enumerate(zip(instances, urls)):
+            ext = AnnasEbook._FILE_EXT[idx % len(AnnasEbook._FILE_EXT)]
+            assert url == (
+                f"{AnnasEbook._ANNAS_URLS.get(instance)}/search?q=book+{idx}&ext={ext}"
+                "&lang=en"
+            )
+
     @pytest.mark.parametrize(
         "selected_result, expected_link",
         [
@@ -337,9 +506,7 @@ class TestAnnasEbook:
             sort=self.sort,
             output_dir=self.output_dir,
         )
-        mocker.patch.object(
-            ebook, "_current_source", AnnasEbook._current_source  # _SOURCE_ANNAS
-        )
+        mocker.patch.object(ebook, "_current_source", AnnasEbook._SOURCE_ANNAS)
         mocker.patch.object(ebook, "_selected_result", selected_result)
         assert ebook._determine_link() == expected_link
 
@@ -355,7 +522,7 @@ class TestAnnasEbook:
                 AnnasEbook._SOURCE_ANNAS,
                 {},
                 "search_page_scrape",
-                f"{AnnasEbook._SOURCE_DICT[AnnasEbook._SOURCE_ANNAS].get('url')}/search?q={SEARCH}",
+                f"{AnnasEbook._SOURCE_DICT[AnnasEbook._SOURCE_ANNAS].get('url')}/search?q=Treasure+Island+Stevenson",
             ),
             (
                 "epub",
@@ -366,7 +533,7 @@ class TestAnnasEbook:
                 AnnasEbook._SOURCE_ANNAS,
                 {},
                 "search_page_scrape",
-                f"{AnnasEbook._SOURCE_DICT[AnnasEbook._SOURCE_ANNAS].get('url')}/search?q={SEARCH}&ext=epub",
+                f"{AnnasEbook._SOURCE_DICT[AnnasEbook._SOURCE_ANNAS].get('url')}/search?q=Treasure+Island+Stevenson&ext=epub",
             ),
             (
                 "epub,pdf",
@@ -377,7 +544,7 @@ class TestAnnasEbook:
                 AnnasEbook._SOURCE_ANNAS,
                 {},
                 "search_page_scrape",
-                f"{AnnasEbook._SOURCE_DICT[AnnasEbook._SOURCE_ANNAS].get('url')}/search?q={SEARCH}&ext=epub&ext=pdf",
+                f"{AnnasEbook._SOURCE_DICT[AnnasEbook._SOURCE_ANNAS].get('url')}/search?q=Treasure+Island+Stevenson&ext=epub&ext=pdf",
             ),
             (
                 "epub",
@@ -388,7 +555,7 @@ class TestAnnasEbook:
                 AnnasEbook._SOURCE_ANNAS,
                 {},
                 "search_page_scrape",
-                f"{AnnasEbook._SOURCE_DICT[AnnasEbook._SOURCE_ANNAS].get('url')}/search?q={SEARCH}&ext=epub&lang=en",
+                f"{AnnasEbook._SOURCE_DICT[AnnasEbook._SOURCE_ANNAS].get('url')}/search?q=Treasure+Island+Stevenson&ext=epub&lang=en",
             ),
             (
                 "epub,mobi",
@@ -399,7 +566,7 @@ class TestAnnasEbook:
                 AnnasEbook._SOURCE_ANNAS,
                 {},
                 "search_page_scrape",
-                f"{AnnasEbook._SOURCE_DICT[AnnasEbook._SOURCE_ANNAS].get('url')}/search?q={SEARCH}&ext=epub&ext=mobi&lang=en&content=book_nonfiction&content=book_fiction",
+                f"{AnnasEbook._SOURCE_DICT[AnnasEbook._SOURCE_ANNAS].get('url')}/search?q=Treasure+Island+Stevenson&content=book_fiction&content=book_nonfiction&ext=epub&ext=mobi&lang=en",
             ),
             (
                 "pdf",
@@ -410,7 +577,7 @@ class TestAnnasEbook:
                 AnnasEbook._SOURCE_ANNAS,
                 {},
                 "search_page_scrape",
-                f"{AnnasEbook._SOURCE_DICT[AnnasEbook._SOURCE_ANNAS].get('url')}/search?q={SEARCH}&ext=pdf&sort=largest",
+                f"{AnnasEbook._SOURCE_DICT[AnnasEbook._SOURCE_ANNAS].get('url')}/search?q=Treasure+Island+Stevenson&ext=pdf&sort=largest",
             ),
             (
                 "pdf",
@@ -421,7 +588,7 @@ class TestAnnasEbook:
                 AnnasEbook._SOURCE_ANNAS,
                 {},
                 "search_page_scrape",
-                f"{AnnasEbook._SOURCE_DICT[AnnasEbook._SOURCE_ANNAS].get('url')}/search?q={SEARCH}&ext=pdf&lang=en&lang=es&lang=zh-Hant&content=magazine&sort=newest",
+                f"{AnnasEbook._SOURCE_DICT[AnnasEbook._SOURCE_ANNAS].get('url')}/search?q=Treasure+Island+Stevenson&content=magazine&ext=pdf&lang=en&lang=es&lang=zh-Hant&sort=newest",
             ),
             (
                 "xox",
@@ -432,7 +599,7 @@ class TestAnnasEbook:
                 AnnasEbook._SOURCE_ANNAS,
                 {},
                 "search_page_scrape",
-                f"{AnnasEbook._SOURCE_DICT[AnnasEbook._SOURCE_ANNAS].get('url')}/search?q={SEARCH}&lang=en&lang=es&lang=zh-Hant&content=magazine",
+                f"{AnnasEbook._SOURCE_DICT[AnnasEbook._SOURCE_ANNAS].get('url')}/search?q=Treasure+Island+Stevenson&content=magazine&lang=en&lang=es&lang=zh-Hant",
             ),
             (
                 "xox,epub",
@@ -443,7 +610,7 @@ class TestAnnasEbook:
                 AnnasEbook._SOURCE_ANNAS,
                 {},
                 "search_page_scrape",
-                f"{AnnasEbook._SOURCE_DICT[AnnasEbook._SOURCE_ANNAS].get('url')}/search?q={SEARCH}&ext=epub&lang=en&lang=es&lang=zh-Hant&content=magazine",
+                f"{AnnasEbook._SOURCE_DICT[AnnasEbook._SOURCE_ANNAS].get('url')}/search?q=Treasure+Island+Stevenson&content=magazine&ext=epub&lang=en&lang=es&lang=zh-Hant",
             ),
             (
                 "pdf,cbr",
@@ -454,7 +621,7 @@ class TestAnnasEbook:
                 AnnasEbook._SOURCE_ANNAS,
                 {},
                 "search_page_scrape",
-                f"{AnnasEbook._SOURCE_DICT[AnnasEbook._SOURCE_ANNAS].get('url')}/search?q={SEARCH}&ext=pdf&ext=cbr&lang=en&lang=es&lang=zh-Hant",
+                f"{AnnasEbook._SOURCE_DICT[AnnasEbook._SOURCE_ANNAS].get('url')}/search?q=Treasure+Island+Stevenson&ext=cbr&ext=pdf&lang=en&lang=es&lang=zh-Hant",
             ),
             (
                 "",
@@ -465,7 +632,7 @@ class TestAnnasEbook:
                 AnnasEbook._SOURCE_ANNAS,
                 {},
                 "search_page_scrape",
-                f"{AnnasEbook._SOURCE_DICT[AnnasEbook._SOURCE_ANNAS].get('url')}/search?q={SEARCH}",
+                f"{AnnasEbook._SOURCE_DICT[AnnasEbook._SOURCE_ANNAS].get('url')}/search?q=Treasure+Island+Stevenson",
             ),
             (
                 "",
@@ -476,7 +643,7 @@ class TestAnnasEbook:
                 AnnasEbook._SOURCE_ANNAS,
                 {},
                 "search_page_scrape",
-                f"{AnnasEbook._SOURCE_DICT[AnnasEbook._SOURCE_ANNAS].get('url')}/search?q={SEARCH}&lang=en&lang=es",
+                f"{AnnasEbook._SOURCE_DICT[AnnasEbook._SOURCE_ANNAS].get('url')}/search?q=Treasure+Island+Stevenson&lang=en&lang=es",
             ),
             (
                 "",
@@ -487,7 +654,7 @@ class TestAnnasEbook:
                 AnnasEbook._SOURCE_ANNAS,
                 {},
                 "search_page_scrape",
-                f"{AnnasEbook._SOURCE_DICT[AnnasEbook._SOURCE_ANNAS].get('url')}/search?q={SEARCH}&content=book_comic&content=book_unknown",
+                f"{AnnasEbook._SOURCE_DICT[AnnasEbook._SOURCE_ANNAS].get('url')}/search?q=Treasure+Island+Stevenson&content=book_comic&content=book_unknown",
             ),
             (
                 "",
@@ -498,7 +665,7 @@ class TestAnnasEbook:
                 AnnasEbook._SOURCE_ANNAS,
                 {},
                 "search_page_scrape",
-                f"{AnnasEbook._SOURCE_DICT[AnnasEbook._SOURCE_ANNAS].get('url')}/search?q={SEARCH}&content=book_comic",
+                f"{AnnasEbook._SOURCE_DICT[AnnasEbook._SOURCE_ANNAS].get('url')}/search?q=Treasure+Island+Stevenson&content=book_comic",
             ),
             (
                 "",
@@ -509,7 +676,7 @@ class TestAnnasEbook:
                 AnnasEbook._SOURCE_ANNAS,
                 {},
                 "search_page_scrape",
-                f"{AnnasEbook._SOURCE_DICT[AnnasEbook._SOURCE_ANNAS].get('url')}/search?q={SEARCH}",
+                f"{AnnasEbook._SOURCE_DICT[AnnasEbook._SOURCE_ANNAS].get('url')}/search?q=Treasure+Island+Stevenson",
             ),
             (
                 "pdf",
@@ -686,12 +853,13 @@ class TestAnnasEbook:
                     ]
                 )
         else:
-            mocked_get.return_value = "OK"
+            ok = mocker.Mock(status_code=200)
+            mocked_get.return_value = ok
             response = ebook._get()
             if msg:
                 spy.assert_called_once_with(f"\n{msg}", fg="bright_yellow")
             # No error occured and returns response
-            assert response == "OK"
+            assert response == ok
 
     @pytest.mark.parametrize(
         "_current_source, _scrape_key, html_file_path, expected_results",
@@ -861,6 +1029,8 @@ class TestAnnasEbook:
         mocker.patch.object(ebook, "_scrape_key", _scrape_key)
 
         class MockResponse:
+            headers = {"Content-Type": "text/html; charset=utf-8"}
+
             @property
             def url(self):
                 return "https://url.that-is-launched-in-browser.com"
@@ -874,6 +1044,19 @@ class TestAnnasEbook:
         results = ebook._scrape_results(response=response)
         assert results == expected_results
 
+    @pytest.mark.parametrize(
+        "content_type, expected",
+        [
+            ("text/html; charset=windows-1252", "windows-1252"),
+            ('text/html; Charset="UTF-8"', "UTF-8"),
+            ("text/html", None),
+            (None, None),
+        ],
+    )
+    def test__charset(self, content_type, expected, mocker):
+        response = mocker.Mock(headers={"Content-Type": content_type})
+        assert AnnasEbook._charset(response) == expected
+
     @pytest.mark.parametrize(
         "key, title_str, expected_str",
         [
@@ -1191,6 +1374,8 @@ class TestAnnasEbook:
         mock_get = mocker.patch.object(ebook, "_get")
 
         class MockResponse:
+            headers = {"Content-Type": "text/html; charset=utf-8"}
+
             @property
             def url(self):
                 return AnnasEbook._SOURCE_DICT[AnnasEbook._SOURCE_ANNAS].get("url")
@@ -1219,6 +1404,8 @@ class TestAnnasEbook:
         mock_cli_exit = mocker.patch.object(ebook, "_cli_exit")
 
         class MockResponse:
+            headers = {"Content-Type": "text/html; charset=utf-8"}
+
             @property
             def url(self):
                 return AnnasEbook._SOURCE_DICT[AnnasEbook._SOURCE_ANNAS].get("url")
@@ -1251,52 +1438,48 @@ class TestAnnasEbook:
         mock_cli_exit.assert_called_once_with(code=1)
 
     @pytest.mark.parametrize(
-        "_resource_name, html_file_path, output_dir, error",
+        "_resource_name, payload, output_dir, error",
         [
             (
                 "English [en], epub, 0.3MB, Treasure Island - Stevenson, Robert Louis.epub",
-                "tests/static/annas_archive_detail.html",
+                EPUB,
                 "~/books/epub/dir",
                 None,
             ),
             (
                 "English [en], epub, 0.3MB, Treasure Island - Stevenson, Robert Louis",
-                "tests/static/annas_archive_detail.html",
+                EPUB,
                 "~/books/epub/dir",
                 None,
             ),
             (
                 "English [en], epub, 0.3MB, Treasure Island - Stevenson, Robert Louis.epub",
-                "tests/static/annas_archive_detail.html",
+                EPUB,
                 "~/books/epub/dir",
                 FileNotFoundError,
             ),
             (
                 "English [en], epub, 0.3MB, Treasure Island - Stevenson, Robert Louis.epub",
-                "tests/static/annas_archive_detail.html",
+                EPUB,
                 "",
                 None,
             ),
             (
                 "English [en], epub, 0.3MB, Treasure Island - Stevenson, Robert Louis.epub",
-                "tests/static/annas_archive_detail.html",
+                EPUB,
                 "",
                 FileNotFoundError,
             ),
         ],
     )
-    def test__to_filesystem(
-        self, _resource_name, html_file_path, output_dir, error, mocker
-    ):
+    def test__to_filesystem(self, _resource_name, payload, output_dir, error, mocker):
         class MockResponse:
             @property
             def url(self):
                 return AnnasEbook._SOURCE_DICT[AnnasEbook._SOURCE_ANNAS].get("url")
 
-            @property
-            def content(self):
-                with open(html_file_path) as f:
-                    return f.read()
+            def iter_content(self, chunk_size=1):
+                yield payload
 
         ebook = AnnasEbook(
             q=self.q,
@@ -1311,6 +1494,7 @@ class TestAnnasEbook:
         mocker.patch.object(ebook, "output_dir", output_dir)
         mock_open = mocker.mock_open()
         mocker.patch("src.getdat.utils.open", mock_open)
+        mock_replace = mocker.patch("src.getdat.utils.os.replace")
         error_msg = "Error found here"
         if error:
             mock_open.side_effect = error(error_msg)
@@ -1323,7 +1507,7 @@ class TestAnnasEbook:
             resource_name = f"{resource_name}.{ext}"
         if output_dir:
             resource_path = os.path.join(os.path.expanduser(output_dir), resource_name)
-            mock_open.assert_called_once_with(resource_path, "wb")
+            mock_open.assert_called_once_with(f"{resource_path}.part", "wb")
             if error:
                 spy_echo.assert_has_calls(
                     [
@@ -1334,11 +1518,14 @@ class TestAnnasEbook:
                     ]
                 )
             else:
+                mock_replace.assert_called_once_with(
+                    f"{resource_path}.part", resource_path
+                )
                 spy_echo.assert_has_calls(
                     [mocker.call("Done 📚 🎆 🎇"), mocker.call(resource_path)]
                 )
         else:
-            mock_open.assert_called_once_with(resource_name, "wb")
+            mock_open.assert_called_once_with(f"{resource_name}.part", "wb")
             if error:
                 spy_echo.assert_has_calls(
                     [
@@ -1349,9 +1536,95 @@ class TestAnnasEbook:
                     ]
                 )
             else:
+                mock_replace.assert_called_once_with(
+                    f"{resource_name}.part", resource_name
+                )
                 spy_echo.assert_has_calls(
                     [mocker.call("Done 📚 🎆 🎇"), mocker.call(resource_name)]
                 )
+        if error:
+            mock_replace.assert_not_called()
+
+    @pytest.mark.parametrize("error", [ConnectionError, ChunkedEncodingError])
+    def test__to_filesystem_interrupted(self, error, tmp_path, mocker):
+        def chunks(chunk_size=1):
+            yield EPUB
+            raise error("Connection broken")
+
+        response = mocker.Mock(url="https://libgen.li/get.php?md5=a")
+        response.iter_content.side_effect = chunks
+        ebook = AnnasEbook(
+            q=self.q,
+            ext=self.ext,
+            lang=self.lang,
+            content=self.content,
+            sort=self.sort,
+            output_dir=str(tmp_path),
+        )
+        mocker.patch.object(
+            ebook, "_resource_name", "English [en], epub, 0.3MB, Treasure Island"
+        )
+        spy_echo = mocker.spy(click, "echo")
+        assert ebook._to_filesystem(response) is False
+        # nothing is left behind, under the book's name or as a .part file
+        assert os.listdir(tmp_path) == []
+        response.close.assert_called_once()
+        spy_echo.assert_called_once_with(
+            click.style(
+                f"Download from {response.url} interrupted.\n "
+                "Try Another Download Link",
+                fg="red",
+            )
+        )
+
+    @pytest.mark.parametrize(
+        "head, ext, expected",
+        [
+            (b"%PDF-1.7\n", "pdf", None),
+            (b"\r\n%!PS junk\n%PDF-1.4\n", "pdf", None),
+            (EPUB, "epub", None),
+            (EPUB, "cbz", None),
+            (bytes(60) + b"BOOKMOBI", "azw3", None),
+            (b"AT&TFORM\x00\x00", "djvu", None),
+            (b"Rar!\x1a\x07\x00", "cbr", None),
+            (b"%PDF-1.7\n", None, None),
+            (b"<?xml version", "fb2", None),
+            (EPUB, "pdf", "not the expected pdf file"),
+            (b"%PDF-1.7\n", "mobi", "not the expected mobi file"),
+            (b"", "epub", "not the expected epub file"),
+            (b"\xef\xbb\xbf\n<!DOCTYPE html><html>", None, "an HTML page"),
+            (b"  <HTML><head>", "pdf", "an HTML page"),
+        ],
+    )
+    def test__sniff(self, head, ext, expected):
+        assert AnnasEbook._sniff(head, ext) == expected
+
+    def test__to_filesystem_aborts_html(self, mocker):
+        chunks = [b"<!doctype html><title>Download</title>", b"x" * 8192, b"y"]
+        response = mocker.Mock(url="https://libgen.li/ads.php?md5=a")
+        response.iter_content.return_value = iter(chunks)
+        ebook = AnnasEbook(
+            q=self.q,
+            ext=self.ext,
+            lang=self.lang,
+            content=self.content,
+            sort=self.sort,
+            output_dir=self.output_dir,
+        )
+        mock_open = mocker.patch("src.getdat.utils.open", mocker.mock_open())
+        spy_echo = mocker.spy(click, "echo")
+        assert ebook._to_filesystem(response) is False
+        mock_open.assert_not_called()
+        response.close.assert_called_once()
+        # the download stops once the sniffed bytes are in
+        assert list(response.iter_content.return_value) == [b"y"]
+        spy_echo.assert_called_once_with(
+            click.style(
+                f"Download from {response.url} is an HTML page.\n "
+                "Try Another Download Link",
+                fg="red",
+            )
+        )
 
     @pytest.mark.parametrize(
         "title, error",
@@ -1576,6 +1849,9 @@ class TestAnnasEbook:
                 with open("tests/static/libgen_rs_detail.html") as f:
                     return f.read()
 
+            def close(self):
+                pass
+
         ebook = AnnasEbook(
             q=self.q,
             ext=self.ext,
@@ -1648,12 +1924,10 @@ class TestAnnasEbook:
                 echo_spy.assert_has_calls(echo_calls)
 
         elif response_content_type == AnnasEbook._HTML_CONTENT_TYPE and is_libgen:
-            mock_scrape_results = mocker.patch.object(
-                ebook,
-                "_scrape_results",
-            )
+            # resolved by the library, see AnnasArchive.resolve
+            mock_scrape = mocker.patch.object(ebook, "_scrape")
             mock_download = mocker.patch.object(ebook, "_download")
-            mock_scrape_results.return_value = page_results
+            mock_scrape.return_value = page_results
             mocked_get.return_value = MockResponse(
                 status_code=response_status_code, content_type=response_content_type
             )
@@ -1729,3 +2003,626 @@ class TestAnnasEbook:
             mocked_launch_browser.assert_not_called()
             mocked__dl_or_launch_page.assert_called_once()
             assert spy_clear.call_count == 2
+
+
+class TestAnnasArchive:
+    def test_search(self, mirror, mocker):
+        echo_spy = mocker.spy(click, "echo")
+        archive = AnnasArchive(instance=mirror.url)
+        results = archive.search(f"  {SEARCH} ", ext=["pdf", "epub"])
+        assert [result["md5"] for result in results] == [
+            MockMirror.md5_for(SEARCH, idx) for idx in range(3)
+        ]
+        assert results[0]["link"] == f"/md5/{results[0]['md5']}"
+        echo_spy.assert_not_called()
+
+    def test_links(self, mirror):
+        archive = AnnasArchive(instance=mirror.url)
+        md5 = MockMirror.md5_for(SEARCH, 0)
+        links = {link["title"]: link for link in archive.links(md5)}
+        assert links[f"{AnnasArchive._FAST_PARTNER_SERVER} #1"] == {
+            "title": f"{AnnasArchive._FAST_PARTNER_SERVER} #1",
+            "link": f"{mirror.url}/fast_download/{md5}/0/0",
+            "value": 1,
+            "direct": False,
+        }
+        assert links[f"{AnnasArchive._SLOW_PARTNER_SERVER} #1"]["direct"] is False
+        assert links["IPFS Gateway #1"]["direct"] is True
+        assert links[AnnasArchive._LIBGEN_RS]["direct"] is True
+
+    def test_resolve(self, mirror):
+        archive = AnnasArchive(instance=mirror.url)
+        md5 = MockMirror.md5_for(SEARCH, 0)
+        ipfs = f"{mirror.url}/ipfs/{md5}"
+        assert archive.resolve(ipfs, "IPFS Gateway #1") == ipfs
+        url = archive.resolve(
+            f"{mirror.url}/ads.php?md5={md5}", AnnasArchive._LIBGEN_RS
+        )
+        assert url.startswith(f"{mirror.url}/get.php?md5={md5}")
+
+    def test_fetch(self, mirror, tmp_path):
+        archive = AnnasArchive(instance=mirror.url)
+        result = archive.search(SEARCH)[0]
+        links = {link["title"]: link for link in archive.links(result["md5"])}
+        libgen = links[AnnasArchive._LIBGEN_RS]
+        path = archive.fetch(
+            libgen["link"], str(tmp_path), libgen["title"], result["title"]
+        )
+        assert path == os.path.join(tmp_path, AnnasArchive._filename(result["title"]))
+        with open(path, "rb") as f:
+            assert f.read() == mirror.payload(result["md5"])
+        # a file path is written as given
+        path = archive.fetch(
+            links["IPFS Gateway #1"]["link"], str(tmp_path / "book.bin")
+        )
+        assert path == str(tmp_path / "book.bin")
+
+    def test_concurrent_fallback(self, mirror):
+        dead = "http://127.0.0.1:9"
+        archive = AnnasArchive(instance=[dead, mirror.url])
+        queries = [f"{SEARCH} {idx}" for idx in range(8)]
+        for _ in range(5):
+            archive._demoted.clear()
+            with ThreadPoolExecutor(max_workers=len(queries)) as executor:
+                results = list(executor.map(archive.search, queries))
+            assert [result[0]["md5"] for result in results] == [
+                MockMirror.md5_for(q, 0) for q in queries
+            ]
+        assert archive.instance == mirror.url
+
+    def test_demoted_instance_is_tried_again(self, mirror, mocker):
+        dead = "http://127.0.0.1:9"
+        archive = AnnasArchive(instance=[dead, mirror.url])
+        archive.search(SEARCH)
+        assert archive.instance == mirror.url
+        monotonic = time.monotonic() + AnnasArchive._DEMOTE_SECONDS
+        mocker.patch("src.getdat.utils.time.monotonic", return_value=monotonic)
+        assert archive.instance == dead
+        assert archive._fallback_url(f"{mirror.url}/md5/x") is None
+        assert archive._fallback_url("https://elsewhere.org/md5/x") is None
+
+    def test_fetch_browser_only_link(self, mirror, tmp_path):
+        archive = AnnasArchive(instance=mirror.url)
+        md5 = MockMirror.md5_for(SEARCH, 0)
+        with pytest.raises(DownloadError):
+            archive.fetch(f"{mirror.url}/slow_download/{md5}/0/0", str(tmp_path))
+        with pytest.raises(DownloadError):
+            archive.fetch(f"{mirror.url}/ipfs/not-an-md5", str(tmp_path))
+        assert list(tmp_path.iterdir()) == []
+
+    def test_fetch_limit_rate(self, mirror, tmp_path):
+        archive = AnnasArchive(instance=mirror.url, limit_rate=64 * 1024)
+        md5 = MockMirror.md5_for(SEARCH, 0)
+        start = time.monotonic()
+        path = archive.fetch(f"{mirror.url}/ipfs/{md5}", str(tmp_path / "book.pdf"))
+        # the first second's worth is a burst, the remaining 64K takes a second
+        assert time.monotonic() - start >= 0.9
+        with open(path, "rb") as f:
+            assert f.read() == mirror.payload(md5)
+
+    @pytest.mark.parametrize(
+        "q, params",
+        [
+            (
+                "  Treasure   Island\tStevenson ",
+                {"ext": "PDF, epub,pdf", "lang": "ZH-hant,en", "content": "f,nf"},
+            ),
+            (
+                "Treasure Island Stevenson",
+                {"content": "nf,f,x", "lang": "en,zh-Hant,en", "ext": "epub,pdf"},
+            ),
+        ],
+    )
+    def test__search_url_canonical(self, q, params):
+        archive = AnnasArchive(instance="http://localhost:8080")
+        assert archive._search_url(q, {**params, "sort": ""}, 2) == (
+            "http://localhost:8080/search?q=Treasure+Island+Stevenson"
+            "&content=book_fiction&content=book_nonfiction&ext=epub&ext=pdf"
+            "&lang=en&lang=zh-Hant&page=2"
+        )
+
+    @pytest.mark.parametrize(
+        "tag, expected",
+        [
+            ("EN", "en"),
+            ("zh-hant", "zh-Hant"),
+            ("pt-br", "pt-BR"),
+            ("es-419", "es-419"),
+        ],
+    )
+    def test__lang_tag(self, tag, expected):
+        assert AnnasArchive._lang_tag(tag) == expected
+
+    def test__search_url_encodes(self):
+        archive = AnnasArchive(instance="http://localhost:8080")
+        url = archive._search_url('"zlib:1" & c++ #1', {})
+        assert url == ("http://localhost:8080/search?q=%22zlib%3A1%22+%26+c%2B%2B+%231")
+
+    @pytest.mark.parametrize(
+        "pages, limit, mirror_pages, expected",
+        [
+            (None, None, None, 3),
+            (3, None, None, 9),
+            (None, 7, None, 7),
+            (2, 100, None, 6),
+            (None, 100, 2, 6),
+        ],
+    )
+    def test_search_pages(self, pages, limit, mirror_pages, expected, mocker):
+        with MockMirror(results=3, pages=mirror_pages) as mirror:
+            archive = AnnasArchive(instance=mirror.url)
+            spy_request = mocker.spy(archive, "_request")
+            results = archive.search(SEARCH, pages=pages, limit=limit)
+        assert [result["md5"] for result in results] == [
+            MockMirror.md5_for(SEARCH, idx) for idx in range(expected)
+        ]
+        assert [result["value"] for result in results] == list(range(1, expected + 1))
+        urls = [call.args[0] for call in spy_request.call_args_list]
+        assert len(urls) == len(set(urls))
+        assert "&page=" not in urls[0]
+
+    def test_ebook_more_results(self, mirror, mocker):
+        ebook = AnnasEbook(
+            q=(SEARCH,),
+            ext="",
+            lang="",
+            content="",
+            sort="",
+            output_dir="",
+            instance=mirror.url,
+            pages=2,
+        )
+        spy_request = mocker.spy(ebook, "_request")
+        echo_spy = mocker.spy(click, "echo")
+        # 6 results from two pages, then More Results loads the third page
+        prompt = mocker.patch.object(click, "prompt", side_effect=[7, 8])
+        assert ebook._scrape_page() == 8
+        assert ebook._selected_result["link"] == (
+            f"/md5/{MockMirror.md5_for(SEARCH, 7)}"
+        )
+        assert prompt.call_args_list[1].kwargs["type"].max == 10
+        urls = sorted(call.args[0] for call in spy_request.call_args_list)
+        assert urls == [
+            ebook._search_url(ebook.q, ebook._search_params, page) for page in (1, 2, 3)
+        ]
+        more = click.style(f" 7 | {AnnasEbook._MORE_RESULTS}", fg="bright_cyan")
+        assert mocker.call(more) in echo_spy.call_args_list
+
+    @pytest.mark.parametrize("limit", [None, 2])
+    def test_ebook_progressive_output(self, mirror, limit, mocker):
+        def run(progressive):
+            ebook = AnnasEbook(
+                q=(SEARCH,),
+                ext="",
+                lang="",
+                content="",
+                sort="",
+                output_dir="",
+                instance=mirror.url,
+                pages=None if limit else 2,
+                limit=limit,
+                progressive=progressive,
+            )
+            echo_spy = mocker.spy(click, "echo")
+            spy_stream = mocker.spy(ebook, "_stream_results")
+            mocker.patch.object(click, "prompt", side_effect=[2, 2])
+            value = ebook._scrape_page()
+            assert spy_stream.call_count == progressive
+            mocker.stopall()
+            return value, ebook._selected_result, echo_spy.call_args_list
+
+        # the same rows in the same order, each printed once
+        assert run(True) == run(False)
+
+    def test_ebook_progressive_before_page_ends(self, mocker):
+        with open("tests/static/annas_archive_search.html", "rb") as f:
+            page = f.read()
+        chunks = [page[start : start + 4096] for start in range(0, len(page), 4096)]
+        received = []
+
+        def iter_content(chunk_size):
+            for chunk in chunks:
+                received.append(chunk)
+                yield chunk
+
+        response = mocker.MagicMock(
+            status_code=200,
+            url="https://annas-archive.org/search?q=x",
+            headers={"Content-Type": "text/html; charset=utf-8"},
+        )
+        response.iter_content.side_effect = iter_content
+        ebook = AnnasEbook(
+            q=(SEARCH,),
+            ext="",
+            lang="",
+            content="",
+            sort="",
+            output_dir="",
+            progressive=True,
+        )
+        mock_get = mocker.patch.object(ebook, "_get", return_value=response)
+        shown = []
+        echo_formatted = ebook._echo_formatted_title
+        mocker.patch.object(
+            ebook,
+            "_echo_formatted_title",
+            side_effect=lambda key, title: (
+                shown.append(len(received)),
+                echo_formatted(key, title),
+            ),
+        )
+        results = ebook._fetch_search_results()
+        assert mock_get.call_args.kwargs["stream"] is True
+        assert len(shown) == len(results) - 2
+        assert shown[0] < len(chunks)
+        response.__exit__.assert_called_once()
+
+    def md5_ebook(self, mirror, output_dir=""):
+        return AnnasEbook(
+            q=(),
+            ext="",
+            lang="",
+            content="",
+            sort="",
+            output_dir=output_dir,
+            instance=mirror.url,
+        )
+
+    def test_ebook_md5_skips_search(self, mirror, mocker):
+        ebook = self.md5_ebook(mirror)
+        md5s = [MockMirror.md5_for(SEARCH, idx) for idx in range(3)]
+        spy_request = mocker.spy(ebook, "_request")
+        echo_spy = mocker.spy(click, "echo")
+        prompt = mocker.patch.object(click, "prompt")
+        ebook.run_md5(iter(md5s + ["f" * 32]), interactive=False)
+        prompt.assert_not_called()
+        urls = sorted(call.args[0] for call in spy_request.call_args_list)
+        assert urls == sorted(f"{mirror.url}/md5/{md5}" for md5 in md5s + ["f" * 32])
+        for md5 in md5s + ["f" * 32]:
+            assert mocker.call(click.style(f"md5: {md5}", fg="bright_cyan")) in (
+                echo_spy.call_args_list
+            )
+        assert (
+            mocker.call(
+                f" 1 | {AnnasEbook._FAST_PARTNER_SERVER} #1 - (Requires Member Login / {AnnasEbook._browser})"
+            )
+            in echo_spy.call_args_list
+        )
+
+    def test_ebook_md5_interactive_download(self, mirror, tmp_path, mocker):
+        ebook = self.md5_ebook(mirror, str(tmp_path))
+        md5 = MockMirror.md5_for(SEARCH, 1)
+        links = AnnasArchive(instance=mirror.url).links(md5)
+        ipfs = next(link for link in links if link["title"] == "IPFS Gateway #1")
+        mocker.patch.object(click, "prompt", return_value=ipfs["value"])
+        ebook.run_md5([md5])
+        with open(tmp_path / md5, "rb") as f:
+            assert f.read() == mirror.payload(md5)
+
+    def test_ebook_md5_wrong_file_asks_again(self, mirror, tmp_path, mocker):
+        ebook = self.md5_ebook(mirror, str(tmp_path))
+        md5 = MockMirror.md5_for(SEARCH, 1)
+        links = {
+            link["title"]: link for link in AnnasArchive(instance=mirror.url).links(md5)
+        }
+        ipfs = links["IPFS Gateway #1"]
+        libgen = links[AnnasArchive._LIBGEN_RS]
+        prompt = mocker.patch.object(
+            click, "prompt", side_effect=[ipfs["value"], libgen["value"]]
+        )
+        # the IPFS gateway serves something else, the libgen mirror the book
+        mocker.patch.object(
+            AnnasArchive, "_sniff", side_effect=["not the expected pdf file", None]
+        )
+        echo_spy = mocker.spy(click, "echo")
+        ebook.run_md5([md5])
+        assert prompt.call_count == 2
+        # the links are listed again after the wrong file
+        listed = mocker.call(f" {libgen['value']} | {libgen['title']}")
+        assert echo_spy.call_args_list.count(listed) == 2
+        (path,) = tmp_path.iterdir()
+        with open(path, "rb") as f:
+            assert f.read() == mirror.payload(md5)
+
+    def test_ebook_md5_fastest_fails_over(self, mirror, tmp_path, mocker):
+        ebook = self.md5_ebook(mirror, str(tmp_path))
+        ebook._fastest = True
+        md5 = MockMirror.md5_for(SEARCH, 1)
+        prompt = mocker.patch.object(click, "prompt")
+        tried = []
+
+        def download():
+            tried.append(ebook._selected_result["title"])
+            return len(tried) > 1
+
+        mocker.patch.object(ebook, "_dl_or_launch_page", side_effect=download)
+        ebook.run_md5([md5])
+        prompt.assert_not_called()
+        assert len(tried) == 2 and tried[0] != tried[1]
+
+    def test_run_wrong_file_back_to_links(self, mirror, mocker):
+        ebook = self.md5_ebook(mirror)
+        book = {"title": "Treasure Island", "link": "/md5/x", "value": 1}
+        links = [{"title": "IPFS Gateway #1", "link": "/ipfs/x", "value": 3}]
+
+        def scrape_page():
+            if scrape_page.calls:
+                # the download links of the selected book, every time
+                assert ebook._selected_result == book
+                assert ebook._scrape_key == "detail_page_scrape"
+            ebook._selected_result = book if scrape_page.calls == 0 else links[0]
+            scrape_page.calls += 1
+            return ebook._selected_result["value"]
+
+        scrape_page.calls = 0
+        mocker.patch.object(ebook, "_scrape_page", side_effect=scrape_page)
+        selected = []
+
+        def download():
+            selected.append((ebook._selected_result, ebook._scrape_key))
+            return len(selected) > 1
+
+        mocker.patch.object(ebook, "_dl_or_launch_page", side_effect=download)
+        mocker.patch.object(click, "clear")
+        ebook.run()
+        assert scrape_page.calls == 3
+        assert selected == [(links[0], ""), (links[0], "")]
+
+    def test_ebook_md5_results_stream(self, mirror):
+        ebook = self.md5_ebook(mirror)
+        first = threading.Event()
+        streamed = []
+
+        def md5s():
+            yield MockMirror.md5_for(SEARCH, 0)
+            # the next md5 is only written once the first result is out
+            streamed.append(first.wait(timeout=5))
+            yield MockMirror.md5_for(SEARCH, 1)
+
+        received = []
+        for md5, results in ebook._md5_results(md5s()):
+            first.set()
+            received.append(md5)
+            assert results
+        assert received == [MockMirror.md5_for(SEARCH, idx) for idx in range(2)]
+        assert streamed == [True]
+
+    def test_resolve_md5(self, mirror):
+        archive = AnnasArchive(instance=mirror.url)
+        md5 = MockMirror.md5_for(SEARCH, 0)
+        entry = archive.resolve_md5(md5, f"English [en], pdf, 1.0MB, {SEARCH}")
+        assert entry == {
+            "md5": md5,
+            "title": "IPFS Gateway #1",
+            "url": f"{mirror.url}/ipfs/{md5}",
+            "filename": f"{SEARCH}.pdf",
+        }
+
+    def test_resolve_md5_libgen(self, mirror, mocker):
+        archive = AnnasArchive(instance=mirror.url)
+        md5 = MockMirror.md5_for(SEARCH, 0)
+        # IPFS does not resolve, libgen's GET link is used instead
+        resolve = archive.resolve
+
+        def resolve_not_ipfs(link, title):
+            if "ipfs" in link:
+                raise DownloadError("IPFS gateway timed out")
+            return resolve(link, title)
+
+        mocker.patch.object(archive, "resolve", side_effect=resolve_not_ipfs)
+        entry = archive.resolve_md5(md5)
+        assert entry["title"] == AnnasArchive._LIBGEN_RS
+        assert entry["url"].startswith(f"{mirror.url}/get.php?md5={md5}")
+        # named after the file path in get.php's key=
+        assert entry["filename"] == f"{md5}.{MockMirror.ext_for(md5)}"
+
+    @pytest.mark.parametrize(
+        "url, filename",
+        [
+            ("https://libgen.li/get.php?md5=%s&key=8ETFRGFWBSSQMDRV", "%s"),
+            ("https://libgen.li/get.php?md5=%s&key=ABC/%s.epub", "%s.epub"),
+            ("https://ipfs.io/ipfs/%s", "%s"),
+        ],
+    )
+    def test_filename_without_title(self, url, filename):
+        md5 = MockMirror.md5_for(SEARCH, 0)
+        url = url.replace("%s", md5)
+        assert AnnasArchive._filename("", url) == filename.replace("%s", md5)
+
+    @pytest.mark.parametrize(
+        "title, url, filename",
+        [
+            ("English [en], pdf, 1.0MB, AC/DC", "", "AC_DC.pdf"),
+            ("", "https://ipfs.io/ipfs/%2F..%2F..%2F.bashrc", "_.._.._.bashrc"),
+            ("", "https://ipfs.io/ipfs/..", "download"),
+        ],
+    )
+    def test_filename_is_never_a_path(self, title, url, filename):
+        assert AnnasArchive._filename(title, url) == filename
+
+    def test_resolve_md5_content_type(self, mirror):
+        archive = AnnasArchive(instance=mirror.url)
+        md5 = MockMirror.md5_for(SEARCH, 0)
+        # no title and an IPFS url: the extension comes from the Content-Type
+        entry = archive.resolve_md5(md5)
+        assert entry["url"] == f"{mirror.url}/ipfs/{md5}"
+        assert entry["filename"] == f"{md5}.{MockMirror.ext_for(md5)}"
+
+    def test_ebook_export_links_unknown_ext(self, mirror, mocker):
+        ebook = self.md5_ebook(mirror)
+        md5 = MockMirror.md5_for(SEARCH, 0)
+        mocker.patch.dict(
+            MockMirror._CONTENT_TYPES, {MockMirror.ext_for(md5): "application/x-book"}
+        )
+        out = io.StringIO()
+        ebook.export_links(out, md5s=iter([md5]))
+        # aria2c names the file itself rather than getting one without an ext
+        assert out.getvalue() == f"{mirror.url}/ipfs/{md5}\n"
+
+    @pytest.mark.parametrize("links_format", ["aria2c", "wget"])
+    def test_ebook_export_links(self, links_format, mirror, tmp_path):
+        ebook = AnnasEbook(
+            q=(SEARCH,),
+            ext="",
+            lang="",
+            content="",
+            sort="",
+            output_dir=str(tmp_path),
+            instance=mirror.url,
+        )
+        out = io.StringIO()
+        ebook.export_links(out, links_format)
+        md5s = [MockMirror.md5_for(SEARCH, idx) for idx in range(3)]
+        urls = [f"{mirror.url}/ipfs/{md5}" for md5 in md5s]
+        lines = out.getvalue().splitlines()
+        if links_format == "wget":
+            assert lines == urls
+        else:
+            assert lines[0::3] == urls
+            assert all(line.startswith("  out=") for line in lines[1::3])
+            assert lines[2::3] == [f"  dir={tmp_path}"] * 3
+
+    def test_ebook_export_links_workers(self, mirror, mocker):
+        ebook = self.md5_ebook(mirror)
+        md5s = [MockMirror.md5_for(SEARCH, idx) for idx in range(12)]
+        # the first 8 only return once all 8 are being resolved at once
+        all_started = threading.Barrier(8, timeout=5)
+        running, most, lock = [0], [0], threading.Lock()
+
+        def resolve_md5(md5, title):
+            with lock:
+                running[0] += 1
+                most[0] = max(most[0], running[0])
+            if md5 in md5s[:8]:
+                all_started.wait()
+            with lock:
+                running[0] -= 1
+            return {"url": f"{mirror.url}/ipfs/{md5}", "filename": md5}
+
+        mocker.patch.object(ebook, "resolve_md5", side_effect=resolve_md5)
+        out = io.StringIO()
+        ebook.export_links(out, "wget", md5s=iter(md5s), workers=8)
+        assert most[0] == 8
+        urls = [f"{mirror.url}/ipfs/{md5}" for md5 in md5s]
+        assert out.getvalue().splitlines() == urls
+
+    def test_ebook_export_links_md5s(self, mirror, mocker):
+        ebook = self.md5_ebook(mirror)
+        md5 = MockMirror.md5_for(SEARCH, 2)
+        mocker.patch.object(
+            AnnasEbook, "resolve_md5", side_effect=lambda md5, title: None
+        )
+        out = io.StringIO()
+        ebook.export_links(out, md5s=iter([md5]))
+        assert out.getvalue() == ""
+
+    def test_ebook_libgen_page_without_get_link(self, mirror, tmp_path, mocker):
+        ebook = self.md5_ebook(mirror, str(tmp_path))
+        md5 = MockMirror.md5_for(SEARCH, 0)
+        # a page without a GET anchor is not taken for the download itself
+        ebook._selected_result = {
+            "title": AnnasEbook._LIBGEN_LI,
+            "link": f"{mirror.url}/md5/{md5}",
+        }
+        mock_download = mocker.patch.object(ebook, "_download")
+        assert ebook._dl_or_launch_page() is False
+        mock_download.assert_not_called()
+
+    def test_ebook_md5_libgen_download(self, mirror, tmp_path, mocker):
+        ebook = self.md5_ebook(mirror, str(tmp_path))
+        md5 = MockMirror.md5_for(SEARCH, 1)
+        links = AnnasArchive(instance=mirror.url).links(md5)
+        libgen = next(link for link in links if link["title"] == AnnasEbook._LIBGEN_RS)
+        mocker.patch.object(click, "prompt", return_value=libgen["value"])
+        # the libgen page is served as text/html; charset=utf-8
+        ebook.run_md5([md5])
+        with open(tmp_path / f"{md5}.{MockMirror.ext_for(md5)}", "rb") as f:
+            assert f.read() == mirror.payload(md5)
+
+    def test_fetch_wrong_file_type(self, mirror, tmp_path):
+        archive = AnnasArchive(instance=mirror.url)
+        md5 = MockMirror.md5_for(SEARCH, 0)
+        ext = MockMirror.ext_for(md5)
+        other = AnnasArchive._EPUB if ext == AnnasArchive._PDF else AnnasArchive._PDF
+        with pytest.raises(DownloadError, match=f"not the expected {other} file"):
+            archive.fetch(
+                f"{mirror.url}/ipfs/{md5}",
+                str(tmp_path),
+                "IPFS Gateway #1",
+                f"English [en], {other}, 1.0MB, {SEARCH}",
+            )
+        assert list(tmp_path.iterdir()) == []
+
+    def test_probe(self, mirror):
+        archive = AnnasArchive(instance=mirror.url)
+        md5 = MockMirror.md5_for(SEARCH, 0)
+        probe = archive.probe(
+            f"{mirror.url}/ads.php?md5={md5}", AnnasArchive._LIBGEN_RS
+        )
+        assert probe["error"] is None
+        assert probe["url"].startswith(f"{mirror.url}/get.php?md5={md5}")
+        assert probe["size"] == mirror.payload_size
+        assert probe["ranges"] is True
+        assert probe["ttfb"] >= 0 and probe["throughput"] > 0
+        assert probe["expected"] >= probe["ttfb"]
+
+    def test_probe_errors(self, mirror):
+        archive = AnnasArchive(instance=mirror.url)
+        md5 = MockMirror.md5_for(SEARCH, 0)
+        # a page where a file should be
+        probe = archive.probe(f"{mirror.url}/md5/{md5}", "IPFS Gateway #1")
+        assert probe["error"] == "Download is an HTML page"
+        probe = archive.probe(f"{mirror.url}/ipfs/not-an-md5", "IPFS Gateway #1")
+        assert probe["error"] == "HTTP 404"
+
+    def test_rank(self, mocker):
+        archive = AnnasArchive()
+        expected = {"a": 3.0, "b": None, "c": 0.5}
+        mocker.patch.object(
+            archive,
+            "probe",
+            side_effect=lambda link, title, resource_name: {
+                "expected": expected[link],
+                "error": None if expected[link] else "HTTP 503",
+            },
+        )
+        links = [
+            {"link": link, "title": link, "value": n} for n, link in enumerate("abc")
+        ]
+        probes = archive.rank(links)
+        assert [probe["link"] for probe in probes] == ["c", "a", "b"]
+        assert probes[0]["value"] == 2
+        assert archive.rank([]) == []
+
+    def test_ebook_md5_fastest(self, mirror, tmp_path, mocker):
+        ebook = self.md5_ebook(mirror, str(tmp_path))
+        ebook._fastest = True
+        md5 = MockMirror.md5_for(SEARCH, 1)
+        prompt = mocker.patch.object(click, "prompt")
+        echo_spy = mocker.spy(click, "echo")
+        ebook.run_md5([md5])
+        prompt.assert_not_called()
+        assert (
+            mocker.call(
+                click.style("Download Links by Expected Time", fg="bright_cyan")
+            )
+            in echo_spy.call_args_list
+        )
+        (path,) = tmp_path.iterdir()
+        with open(path, "rb") as f:
+            assert f.read() == mirror.payload(md5)
+
+    def test_ebook_fastest_none_respond(self, mirror, mocker):
+        ebook = self.md5_ebook(mirror)
+        mocker.patch.object(
+            ebook,
+            "rank",
+            return_value=[
+                {"value": 3, "title": "IPFS Gateway #1", "error": "HTTP 503"},
+            ],
+        )
+        results = {
+            "3": {"title": "IPFS Gateway #1", "link": "/ipfs/x", "value": 3},
+            "0": {"title": AnnasEbook._browser, "link": "/md5/x", "value": 0},
+        }
+        assert ebook._select_fastest(results) is None
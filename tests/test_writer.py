@@ -0,0 +1,130 @@
+import io
+import threading
+import pytest
+from src.getdat.mock_server import MockMirror
+from src.getdat.utils import AnnasArchive
+from src.getdat.writer import FileWriter
+
+SEARCH = "Treasure Island Stevenson"
+
+
+class SlowFile(io.BytesIO):
+    """A file whose writes wait until `release` is set"""
+
+    def __init__(self):
+        super().__init__()
+        self.release = threading.Event()
+        self.writing = threading.Event()
+
+    def write(self, chunk):
+        self.writing.set()
+        self.release.wait()
+        return super().write(chunk)
+
+    def fileno(self):
+        return 0
+
+
+class BrokenFile(io.BytesIO):
+    def write(self, chunk):
+        raise OSError(28, "No space left on device")
+
+
+class TestFileWriter:
+    def test_writes_chunks_in_order(self, tmp_path):
+        chunks = [bytes([idx]) * 1000 for idx in range(50)]
+        with open(tmp_path / "book", "wb") as f:
+            with FileWriter(f, buffer_size=4096) as writer:
+                for chunk in chunks:
+                    writer.write(chunk)
+        assert (tmp_path / "book").read_bytes() == b"".join(chunks)
+
+    def test_buffer_is_bounded(self):
+        f = SlowFile()
+        writer = FileWriter(f, buffer_size=3000)
+        writer.write(b"a" * 1000)
+        f.writing.wait()
+        # the first chunk is on its way to disk, two more fit in the buffer
+        writer.write(b"b" * 1000)
+        writer.write(b"c" * 1000)
+        blocked = threading.Thread(target=writer.write, args=(b"d" * 2000,))
+        blocked.start()
+        blocked.join(0.1)
+        assert blocked.is_alive()
+        assert writer._queued <= writer.buffer_size
+        f.release.set()
+        blocked.join()
+        writer.close()
+        assert f.getvalue() == b"a" * 1000 + b"b" * 1000 + b"c" * 1000 + b"d" * 2000
+
+    def test_chunk_larger_than_buffer(self):
+        f = io.BytesIO()
+        with FileWriter(f, buffer_size=10) as writer:
+            writer.write(b"x" * 100)
+        assert f.getvalue() == b"x" * 100
+
+    def test_write_error_is_raised(self):
+        writer = FileWriter(BrokenFile(), buffer_size=1024)
+        writer.write(b"a")
+        with pytest.raises(OSError, match="No space left"):
+            writer.close()
+        with pytest.raises(OSError, match="No space left"):
+            writer.write(b"b")
+
+    def test_exception_keeps_queued_chunks(self, mocker):
+        fsync = mocker.patch("src.getdat.writer.os.fsync")
+        f = SlowFile()
+        with pytest.raises(ConnectionError):
+            with FileWriter(f, buffer_size=4096, fsync=True) as writer:
+                writer.write(b"a" * 100)
+                writer.write(b"b" * 100)
+                f.release.set()
+                raise ConnectionError
+        assert f.getvalue() == b"a" * 100 + b"b" * 100
+        fsync.assert_not_called()
+
+    def test_fsync_on_close(self, mocker):
+        fsync = mocker.patch("src.getdat.writer.os.fsync")
+        f = io.BytesIO()
+        f.fileno = lambda: 7
+        with FileWriter(f, fsync=True) as writer:
+            writer.write(b"a")
+        fsync.assert_called_once_with(7)
+
+    def test_unbuffered_writes_in_calling_thread(self):
+        f = io.BytesIO()
+        writer = FileWriter(f, buffer_size=0)
+        assert writer._thread is None
+        writer.write(b"a")
+        assert f.getvalue() == b"a"
+        writer.close()
+
+
+class TestAnnasArchiveWriter:
+    def test_config(self, mocker):
+        load_config = mocker.patch(
+            "src.getdat.utils.load_config",
+            side_effect=lambda section: (
+                {"buffer_size": "2M", "fsync": True} if section == "download" else {}
+            ),
+        )
+        archive = AnnasArchive()
+        assert archive.buffer_size == 2 * 1024**2
+        assert archive.fsync is True
+        archive = AnnasArchive(buffer_size=0, fsync=False)
+        assert archive.buffer_size == 0
+        assert archive.fsync is False
+        load_config.assert_any_call("download")
+
+    @pytest.mark.parametrize("buffer_size", [0, 16 * 1024])
+    def test_fetch(self, buffer_size, tmp_path, mocker):
+        fsync = mocker.patch("src.getdat.writer.os.fsync")
+        md5 = MockMirror.md5_for(SEARCH, 0)
+        with MockMirror(payload_size=256 * 1024) as mirror:
+            archive = AnnasArchive(
+                instance=mirror.url, buffer_size=buffer_size, fsync=True
+            )
+            path = archive.fetch(f"{mirror.url}/ipfs/{md5}", str(tmp_path / "book"))
+            with open(path, "rb") as f:
+                assert f.read() == mirror.payload(md5)
+        fsync.assert_called_once()